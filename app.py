@@ -2,10 +2,19 @@ import streamlit as st
 import datetime
 import pytz # Для роботи з часовими поясами
 import pandas as pd # Для роботи з DataFrame
-from io import BytesIO # Для збереження Excel в пам'ять
 
 # Імпортуємо нашу логіку з файлу mapon_api_client.py
-from mapon_api_client import get_fleet_odometer_and_fuel_data
+from mapon_api_client import MaponClient, get_unit_list, get_unit_groups, get_group_unit_ids, get_unit_name, get_fleet_odometer_and_fuel_data, DEFAULT_MAX_WORKERS, FUEL_LOOKUP_DAY, FUEL_LOOKUP_WINDOW, FUEL_SUMMARY_CHUNKS
+from mapon_cache import ResponseCache, account_hash
+from daily_aggregates import DailyAggregateStore, get_fleet_report_from_daily_aggregates, day_bounds_utc
+from daily_breakdown import get_fleet_daily_breakdown, fuel_events_records, fuel_events_from_records, DAY_COLUMN
+from report_schema import REPORT_COLUMNS, COL_UNIT, COL_UNIT_ID, label_statuses
+from fuel_analytics import FuelEventThresholds
+from report_cache import ReportResultCache
+from report_export import ReportExportCache, EXPORT_FORMATS
+from chart_series import ChartSeriesCache, DOWNSAMPLE_METHODS, DOWNSAMPLE_LTTB, DOWNSAMPLE_MINMAX, DEFAULT_CHART_POINTS, odometer_points_from_report, series_to_frame
+from report_jobs import ReportJobManager, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from mapon_metrics import metrics_to_json, metrics_to_prometheus, latency_quantile
 
 # --- Налаштування Streamlit сторінки ---
 # Ця команда МАЄ бути ПЕРШОЮ командою Streamlit у скрипті!
@@ -278,15 +287,77 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Ініціалізація session_state
-if 'df_report' not in st.session_state:
-    st.session_state.df_report = pd.DataFrame()
-if 'report_generated' not in st.session_state:
-    st.session_state.report_generated = False
-if 'start_date_display' not in st.session_state:
-    st.session_state.start_date_display = None
-if 'end_date_display' not in st.session_state:
-    st.session_state.end_date_display = None
+# Персистентний кеш відповідей Mapon API - один на процес, спільний для всіх сесій
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+# Сховище щоденних агрегатів - одне на процес
+@st.cache_resource
+def get_daily_aggregate_store():
+    return DailyAggregateStore()
+
+# Готові звіти - один кеш на процес: однакові звіти різних сесій рахуються один раз і не копіюються
+@st.cache_resource
+def get_report_cache():
+    return ReportResultCache()
+
+# Менеджер фонових завдань звітів - один на процес, завдання та результати живуть поза session_state.
+# Готовий звіт зберігається лише в кеші готових звітів, завдання тримає його ключ.
+@st.cache_resource
+def get_job_manager():
+    return ReportJobManager(result_cache=get_report_cache())
+
+# Готові файли експорту - один кеш на процес: файл звіту формується один раз для ID звіту, формату та колонок
+@st.cache_resource
+def get_export_cache():
+    return ReportExportCache()
+
+# Проріджені серії для графіків юнітів - один кеш на процес, ключ (акаунт, юніт, період, точки, метод)
+@st.cache_resource
+def get_chart_cache():
+    return ChartSeriesCache()
+
+# Генерація звіту у фоновому потоці (без викликів st.*)
+def run_report(api_key, max_workers, fuel_lookup, response_cache, aggregate_store, use_daily_aggregates, use_daily_breakdown, start_datetime_utc, end_datetime_utc, start_date, end_date, timezone, progress_callback=None, row_callback=None, unit_ids=None, exclude_inactive=False, fuel_summary_chunk=None, local_fuel_events=False):
+    # Один клієнт (пул keep-alive з'єднань) на весь звіт
+    with MaponClient(api_key, pool_size=max_workers, cache=response_cache, fuel_lookup=fuel_lookup, fuel_summary_chunk=fuel_summary_chunk) as client:
+        fuel_events = []
+        if use_daily_breakdown:
+            df = get_fleet_daily_breakdown(client, start_date, end_date, timezone=timezone, max_workers=max_workers, progress_callback=progress_callback, row_callback=row_callback, unit_ids=unit_ids, exclude_inactive=exclude_inactive, fuel_events=FuelEventThresholds() if local_fuel_events else None, events_callback=fuel_events.append)
+        elif use_daily_aggregates:
+            df = get_fleet_report_from_daily_aggregates(client, start_date, end_date, aggregate_store, timezone=timezone, max_workers=max_workers, progress_callback=progress_callback, unit_ids=unit_ids, exclude_inactive=exclude_inactive)
+        else:
+            df = get_fleet_odometer_and_fuel_data(client, start_datetime_utc, end_datetime_utc, max_workers=max_workers, progress_callback=progress_callback, row_callback=row_callback, unit_ids=unit_ids, exclude_inactive=exclude_inactive)
+        # Запити, що не вдалися навіть після повторів (їх клітинки порожні)
+        df.attrs['failed_requests'] = client.error_budget.failures
+        # Метрики запитів звіту для панелі продуктивності
+        df.attrs['metrics'] = client.metrics.snapshot()
+        # Події палива локального аналізу - у JSON-сумісному вигляді, щоб attrs не заважали експорту в Parquet
+        if fuel_events:
+            df.attrs['fuel_events'] = fuel_events_records(fuel_events[0])
+        return df
+
+# Звіт з кешу готових звітів процесу або сформований run_report (однакові звіти, що формуються одночасно, чекають на один результат)
+def run_report_cached(report_cache, report_key, expires_at, *args, progress_callback=None, row_callback=None, **kwargs):
+    return report_cache.get_or_compute(report_key, lambda: run_report(*args, progress_callback=progress_callback, row_callback=row_callback, **kwargs), expires_at)
+
+# Список юнітів і груп акаунта для вибору на боковій панелі (кешується з TTL у unit_directory.py)
+def load_unit_directory(api_key):
+    with MaponClient(api_key) as client:
+        return get_unit_list(client), get_unit_groups(client)
+
+# ID юнітів обраних груп
+def load_group_unit_ids(api_key, group_ids):
+    with MaponClient(api_key) as client:
+        return [unit_id for group_id in group_ids for unit_id in get_group_unit_ids(client, group_id)]
+
+job_manager = get_job_manager()
+
+# Ініціалізація session_state: сесія зберігає лише ID поточного завдання.
+# ID також дублюється в URL (?job=...), щоб після оновлення сторінки повернутися до звіту.
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = st.query_params.get('job')
 
 # --- Бокова панель для введення API ключа та вибору періоду ---
 st.sidebar.header("Налаштування API Mapon")
@@ -332,26 +403,89 @@ if start_datetime_utc > end_datetime_utc:
     st.stop() # Зупиняємо виконання, якщо дати некоректні
 
 st.sidebar.markdown("---")
+st.sidebar.header("Юніти")
+
+# Звіт лише по обраних юнітах і групах: запити робляться тільки для них
+directory_units, directory_groups = load_unit_directory(api_key)
+unit_names = {unit['unit_id']: f"{get_unit_name(unit)} ({unit['label']})" if unit.get('label') and unit.get('label') != get_unit_name(unit) else get_unit_name(unit) for unit in directory_units}
+group_names = {group['id']: group['name'] for group in directory_groups}
+selected_group_ids = st.sidebar.multiselect("Групи", options=list(group_names), format_func=lambda group_id: group_names[group_id], placeholder="Усі групи")
+selected_unit_ids = st.sidebar.multiselect("Юніти", options=list(unit_names), format_func=lambda unit_id: unit_names[unit_id], placeholder="Усі юніти")
+exclude_inactive = st.sidebar.checkbox(
+    "Пропускати юніти без даних за період",
+    help="Юніти, останні дані яких надійшли до початку періоду (наприклад, списані), не обробляються."
+)
+
+st.sidebar.markdown("---")
+
+# Кількість одночасних запитів до Mapon API (1 - послідовний режим)
+max_workers = st.sidebar.slider("Паралельні запити до API", min_value=1, max_value=32, value=DEFAULT_MAX_WORKERS)
+
+# Звіт за цілі доби зі збережених щоденних агрегатів (завантажуються лише відсутні доби)
+use_daily_aggregates = st.sidebar.checkbox(
+    "Використовувати щоденні агрегати",
+    help="Звіт рахується за цілі доби (час початку та закінчення ігнорується). Закриті доби зберігаються локально і не завантажуються повторно."
+)
+
+# Звіт у довгому форматі: рядок на кожен юніт і кожну добу періоду
+use_daily_breakdown = st.sidebar.checkbox(
+    "Розбивка по днях",
+    help="Рядок на кожну добу періоду для кожного юніта (час початку та закінчення ігнорується). Серія палива кожного юніта завантажується один раз за весь період."
+)
+
+# Заправки, зливи та витрата з уже завантажених серій рівня палива (лише для розбивки по днях)
+local_fuel_events = st.sidebar.checkbox(
+    "Рахувати заправки та зливи з серії рівня палива",
+    disabled=not use_daily_breakdown,
+    help="Замість запиту fuel/summary.json на кожну добу кожного юніта заправки, зливи та витрата визначаються локально зі згладженої серії рівня палива. Додається таблиця подій з часом і обсягом."
+) and use_daily_breakdown
+
+# Рівень палива на межах періоду: вузькі вікна навколо моменту замість завантаження всієї доби
+use_fuel_windows = st.sidebar.checkbox(
+    "Шукати рівень палива у вузькому вікні",
+    help="Замість усієї доби даних запитуються вікна ±15 хв, ±2 год, ±12 год навколо початку та кінця періоду. Менше даних і коректний пошук через межу доби UTC."
+)
+fuel_lookup = FUEL_LOOKUP_WINDOW if use_fuel_windows else FUEL_LOOKUP_DAY
+
+# Зведення по паливу за довгий період - частинами, паралельно (лише для звіту за період: щоденні режими вже діляться на доби)
+FUEL_SUMMARY_CHUNK_LABELS = {None: 'Одним запитом', 'day': 'По днях', 'week': 'По тижнях'}
+fuel_summary_chunk = st.sidebar.selectbox(
+    "Зведення по паливу",
+    options=[None] + list(FUEL_SUMMARY_CHUNKS),
+    format_func=lambda value: FUEL_SUMMARY_CHUNK_LABELS[value],
+    disabled=use_daily_aggregates or use_daily_breakdown,
+    help="Довгий період ділиться на доби або тижні, що завантажуються паралельно й об'єднуються. Помилка однієї частини не втрачає весь період, а завершені частини беруться з кешу в наступних звітах."
+)
+if use_daily_aggregates or use_daily_breakdown:
+    fuel_summary_chunk = None
+
+# Підписи станів фонових завдань
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: 'в черзі',
+    JOB_RUNNING: 'формується',
+    JOB_DONE: 'готовий',
+    JOB_FAILED: 'помилка',
+}
+
+# Підписи форматів експорту
+EXPORT_FORMAT_LABELS = {
+    'xlsx': 'Excel',
+    'csv': 'CSV',
+    'parquet': 'Parquet',
+}
+
+# Підписи методів проріджування графіків
+DOWNSAMPLE_LABELS = {
+    DOWNSAMPLE_LTTB: 'LTTB (форма кривої)',
+    DOWNSAMPLE_MINMAX: 'Мін/макс (піки)',
+}
 
 # --- Основна частина сторінки ---
 st.title("Звіт по автопарку Mapon")
 st.write("Отримайте детальний звіт по пробігу та витраті палива вашого автопарку за обраний період.")
 
-# Визначаємо всі можливі колонки
-all_possible_columns = [
-    'Номер Автомобіля',
-    'Одометр CAN (початок)',
-    'Одометр CAN (кінець)',
-    'Пробіг (CAN, км)',
-    'Паливо в баку (початок, л)',
-    'Паливо в баку (кінець, л)',
-    'Заправлено за період (л)',
-    'Зливи за період (л)',
-    'Витрата (датчик рівня, л)',
-    'Середня витрата (датчик рівня, л/100км)',
-    'Витрата (CAN Flow, л)',
-    'Середня витрата (CAN Flow, л/100км)'
-]
+# Визначаємо всі можливі колонки (числові колонки та колонки статусу - див. report_schema.py)
+all_possible_columns = REPORT_COLUMNS
 
 # Мультиселект для вибору колонок, на основній панелі (як і було в попередньому коді)
 selected_columns = st.multiselect(
@@ -368,63 +502,215 @@ if st.sidebar.button("Згенерувати Звіт"):
     elif not selected_columns:
         st.sidebar.warning("Будь ласка, оберіть хоча б одну колонку для відображення у звіті.")
     else:
-        with st.spinner("Завантаження даних... Це може зайняти деякий час для великих автопарків."):
-            try:
-                df = get_fleet_odometer_and_fuel_data(api_key, start_datetime_utc, end_datetime_utc)
-                
-                if not df.empty:
-                    st.session_state.df_report = df # Зберігаємо повний DataFrame у session_state
-                    st.session_state.report_generated = True
-                    st.session_state.start_date_display = start_date.strftime('%Y%m%d') # Зберігаємо для імені файлу
-                    st.session_state.end_date_display = end_date.strftime('%Y%m%d')    # Зберігаємо для імені файлу
-                    st.success("Звіт успішно згенеровано!")
-                else:
-                    st.session_state.df_report = pd.DataFrame() # Очищаємо, якщо немає даних
-                    st.session_state.report_generated = False
-                    st.warning("Звіт не містить даних для обраного періоду. Перевірте обраний період та/або активність юнітів у Mapon.")
-            
-            except Exception as e:
-                st.session_state.df_report = pd.DataFrame() # Очищаємо при помилці
-                st.session_state.report_generated = False
-                st.error(f"Виникла помилка при завантаженні даних: {e}. Будь ласка, перевірте API Key.")
+        period_description = f"{start_datetime_local:%d.%m.%Y %H:%M} - {end_datetime_local:%d.%m.%Y %H:%M}"
+        report_cache = get_report_cache()
+        # Фільтр юнітів: обрані юніти та всі юніти обраних груп (None - увесь акаунт)
+        report_unit_ids = None
+        if selected_unit_ids or selected_group_ids:
+            report_unit_ids = sorted(set(selected_unit_ids) | set(load_group_unit_ids(api_key, selected_group_ids)))
+        # Ключ звіту: акаунт, період і режими, що впливають на результат (але не швидкість завантаження)
+        report_mode = 'daily_breakdown' if use_daily_breakdown else 'daily_aggregates' if use_daily_aggregates else 'period'
+        # Проміжок серій палива звіту (для графіка юніта): для режимів по днях - повні локальні доби
+        if use_daily_breakdown or use_daily_aggregates:
+            chart_start_utc, chart_end_utc = day_bounds_utc(start_date, kyiv_tz)[0], day_bounds_utc(end_date, kyiv_tz)[1]
+        else:
+            chart_start_utc, chart_end_utc = start_datetime_utc, end_datetime_utc
+        report_key = ReportResultCache.make_key(account_hash(api_key), start_datetime_utc, end_datetime_utc, report_unit_ids, mode=report_mode, fuel_lookup=fuel_lookup, fuel_summary_chunk=fuel_summary_chunk, local_fuel_events=local_fuel_events, timezone=kyiv_tz.zone, exclude_inactive=exclude_inactive)
+        job_id = job_manager.submit(
+            account_hash(api_key), period_description, run_report_cached,
+            report_cache, report_key, report_cache.expires_at_for(end_datetime_utc),
+            api_key, max_workers, fuel_lookup, get_response_cache(), get_daily_aggregate_store(), use_daily_aggregates, use_daily_breakdown,
+            start_datetime_utc, end_datetime_utc, start_date, end_date, kyiv_tz.zone,
+            metadata={
+                'start_date_display': start_date.strftime('%Y%m%d'), # Для імені файлу
+                'end_date_display': end_date.strftime('%Y%m%d'),
+                'chart_start_utc': chart_start_utc,
+                'chart_end_utc': chart_end_utc,
+            },
+            dedup_key=report_key,
+            unit_ids=report_unit_ids,
+            exclude_inactive=exclude_inactive,
+            fuel_summary_chunk=fuel_summary_chunk,
+            local_fuel_events=local_fuel_events
+        )
+        st.session_state.job_id = job_id
+        st.query_params['job'] = job_id
+
+# Список звітів цього акаунта: можна повернутися до будь-якого запущеного чи готового звіту
+account_jobs = job_manager.list_jobs(account_hash(api_key))
+if account_jobs:
+    job_labels = {job.job_id: f"{job.description} ({JOB_STATUS_LABELS[job.status]})" for job in account_jobs}
+    job_ids = list(job_labels)
+    selected_job_id = st.sidebar.selectbox(
+        "Звіти",
+        options=job_ids,
+        index=job_ids.index(st.session_state.job_id) if st.session_state.job_id in job_ids else 0,
+        format_func=lambda job_id: job_labels[job_id]
+    )
+    if selected_job_id != st.session_state.job_id:
+        st.session_state.job_id = selected_job_id
+        st.query_params['job'] = selected_job_id
+
+current_job = job_manager.get(st.session_state.job_id) if st.session_state.job_id else None
+# Завдання іншого акаунта не показуємо
+if current_job is not None and current_job.owner != account_hash(api_key):
+    current_job = None
+
+
+# Колонки для відображення: обрані користувачем, що є у звіті; дата (розбивка по днях) - завжди після номера
+def report_columns(df, columns):
+    result = [col for col in columns if col in df.columns]
+    if DAY_COLUMN in df.columns and DAY_COLUMN not in result:
+        result.insert(1 if result and result[0] == 'Номер Автомобіля' else 0, DAY_COLUMN)
+    return result
+
+
+# Прогрес фонового звіту: фрагмент оновлюється сам, не перезапускаючи весь скрипт.
+# Таблиця росте по мірі надходження рядків.
+@st.fragment(run_every=2)
+def show_job_progress(job_id, columns):
+    job = job_manager.get(job_id)
+    if job is None or job.is_finished:
+        st.rerun() # Звіт готовий - перемальовуємо сторінку повністю
+    if job.progress_total:
+        progress_text = f"Оброблено {job.progress_done} з {job.progress_total}"
+        eta = job.eta_seconds()
+        if eta is not None:
+            progress_text += f", залишилось приблизно {int(eta // 60)} хв {int(eta % 60)} с"
+        st.progress(job.progress_done / job.progress_total, text=progress_text)
+    else:
+        st.progress(0, text="Завантаження даних... Це може зайняти деякий час для великих автопарків.")
+
+    df_partial = job.partial_result()
+    if not df_partial.empty:
+        st.dataframe(label_statuses(df_partial[report_columns(df_partial, columns)]), use_container_width=True)
+
+
+# Панель продуктивності: куди пішов час звіту - по ендпоінтах і джерелах даних
+def show_performance_panel(metrics, job_id):
+    with st.expander("Продуктивність (Performance)"):
+        rows = metrics.get('endpoints', [])
+        if not rows:
+            st.write("Немає даних про запити.")
+            return
+        st.dataframe(pd.DataFrame([{
+            'Ендпоінт': row['endpoint'],
+            'Джерело': row['source'],
+            'Запити': row['requests'],
+            'З кешу': row['cache_hits'],
+            'Помилки': row['errors'],
+            'Порожні результати': f"{row['empty']} з {row['results']}" if row['results'] else '',
+            'Мережа, с': round(row['latency_sum'], 2),
+            'Середня затримка, мс': round(row['latency_sum'] / row['requests'] * 1000) if row['requests'] else None,
+            'p95 затримки, с (≤)': latency_quantile(row, 0.95),
+            'Розбір, с': round(row['parse_seconds'], 2),
+            'Отримано, МБ': round(row['bytes'] / 1024 / 1024, 2),
+        } for row in rows]), use_container_width=True)
+        col_json, col_prometheus = st.columns(2)
+        col_json.download_button("Метрики (JSON)", data=metrics_to_json(metrics), file_name=f"mapon_metrics_{job_id}.json", mime="application/json")
+        col_prometheus.download_button("Метрики (Prometheus)", data=metrics_to_prometheus(metrics), file_name=f"mapon_metrics_{job_id}.prom", mime="text/plain")
+
+
+# Графік рівня палива та одометра обраного юніта за період звіту. Серія палива береться з даних,
+# уже завантажених звітом (сховище серій або кеш відповідей), і проріджується на сервері до
+# DEFAULT_CHART_POINTS точок; одометр - з рядків самого звіту, без запитів.
+# Графік будується лише після явного ввімкнення перемикача (клієнт API створюється тільки тоді),
+# а окремий фрагмент означає, що зміна юніта чи методу перемальовує лише графік, а не всю сторінку.
+@st.fragment
+def show_unit_chart(df_report, job):
+    start_utc, end_utc = job.metadata.get('chart_start_utc'), job.metadata.get('chart_end_utc')
+    if start_utc is None or COL_UNIT_ID not in df_report.columns:
+        return
+    # Юніти звіту за ID (номери можуть повторюватися - тоді до номера додається ID)
+    report_units = df_report[[COL_UNIT_ID, COL_UNIT]].drop_duplicates(COL_UNIT_ID)
+    duplicate_names = set(report_units[COL_UNIT][report_units[COL_UNIT].duplicated()])
+    unit_labels = {unit_id: f"{name} (ID {unit_id})" if name in duplicate_names else name for unit_id, name in zip(report_units[COL_UNIT_ID], report_units[COL_UNIT])}
+    if not unit_labels:
+        return
+    if not st.toggle("Показати графік палива та одометра", key='chart_visible'):
+        return
+    col_unit, col_method = st.columns([2, 1])
+    unit_id = col_unit.selectbox("Юніт", options=list(unit_labels), format_func=lambda value: unit_labels[value], key='chart_unit')
+    method = col_method.radio("Проріджування", options=list(DOWNSAMPLE_METHODS), format_func=lambda value: DOWNSAMPLE_LABELS[value], horizontal=True, key='chart_method')
+
+    with MaponClient(api_key, cache=get_response_cache()) as client:
+        series = get_chart_cache().get_or_load(client, unit_id, start_utc, end_utc, DEFAULT_CHART_POINTS, method)
+    fuel_frame = series_to_frame(series, 'Паливо в баку, л', kyiv_tz)
+    if fuel_frame.empty:
+        st.write("Немає даних рівня палива за період.")
+    else:
+        st.line_chart(fuel_frame, x='Час', y='Паливо в баку, л')
+
+    # Звіт має лише показання на межах періоду (або діб) - це окремі точки, а не серія
+    odometer_frame = odometer_points_from_report(df_report, unit_id, start_utc, end_utc, kyiv_tz)
+    if odometer_frame.empty:
+        st.write("Немає даних одометра за період.")
+    else:
+        st.caption("Одометр: показання на початок і кінець періоду (для розбивки по днях - кожної доби) з рядків звіту.")
+        st.scatter_chart(odometer_frame, x='Час', y='Одометр')
+
+    fuel_events = fuel_events_from_records(df_report.attrs.get('fuel_events', []))
+    if not fuel_events.empty:
+        unit_events = fuel_events[fuel_events[COL_UNIT_ID] == unit_id].drop(columns=[COL_UNIT_ID])
+        if not unit_events.empty:
+            st.dataframe(unit_events, use_container_width=True, hide_index=True)
+
 
 # Відображення звіту, якщо він був згенерований
-if st.session_state.report_generated and not st.session_state.df_report.empty:
+if current_job is not None and not current_job.is_finished:
+    st.subheader("Звіт формується")
+    show_job_progress(current_job.job_id, selected_columns)
+elif current_job is not None and current_job.status == JOB_FAILED:
+    st.error(f"Виникла помилка при завантаженні даних: {current_job.error}. Будь ласка, перевірте API Key.")
+    # Рядки, отримані до помилки, не втрачаються
+    df_partial = current_job.partial_result()
+    if not df_partial.empty:
+        st.subheader("Частковий звіт")
+        st.dataframe(label_statuses(df_partial[report_columns(df_partial, selected_columns)]), use_container_width=True)
+elif current_job is not None and current_job.result_evicted:
+    st.warning("Результат цього звіту більше не зберігається в пам'яті (місце звільнено для новіших звітів або дані за поточну добу застаріли). Згенеруйте звіт знову - дані за закриті періоди візьмуться з кешу.")
+elif current_job is not None and current_job.result is not None and not current_job.result.empty:
+    df_report = current_job.result
     st.subheader("Попередній перегляд звіту")
+    if df_report.attrs.get('failed_requests'):
+        st.warning(f"{df_report.attrs['failed_requests']} запитів до Mapon API не вдалося виконати навіть після повторів - частина клітинок може бути порожньою. Спробуйте перегенерувати звіт пізніше.")
     
     # Перевіряємо, чи всі selected_columns дійсно є в df_report
-    actual_selected_columns = [col for col in selected_columns if col in st.session_state.df_report.columns]
+    actual_selected_columns = report_columns(df_report, selected_columns)
     
     if actual_selected_columns:
-        df_display = st.session_state.df_report[actual_selected_columns]
-        st.dataframe(df_display, use_container_width=True)
-
-        # Функція для конвертації DataFrame в Excel (кешується)
-        @st.cache_data
-        def convert_df_to_excel(df_to_convert):
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                df_to_convert.to_excel(writer, index=False, sheet_name='Звіт по автопарку')
-                worksheet = writer.sheets['Звіт по автопарку']
-                for i, col in enumerate(df_to_convert.columns):
-                    # Розширюємо стовпці для кращої читабельності
-                    max_len = max(df_to_convert[col].astype(str).map(len).max(), len(col)) + 2
-                    worksheet.set_column(i, i, max_len)
-            processed_data = output.getvalue()
-            return processed_data
-
-        excel_data = convert_df_to_excel(df_display) # Передаємо відфільтрований DataFrame
+        df_display = df_report[actual_selected_columns]
+        st.dataframe(label_statuses(df_display), use_container_width=True)
+
+        # Файл експорту формується один раз для звіту (а не хешуванням DataFrame при кожному перезапуску скрипта).
+        # Excel і CSV - текстовий вигляд звіту, Parquet - типізовані колонки.
+        export_format = st.radio("Формат файлу", options=list(EXPORT_FORMATS), format_func=lambda value: EXPORT_FORMAT_LABELS[value], horizontal=True)
+        export_data = get_export_cache().get_or_export(current_job.job_id, df_report, export_format, actual_selected_columns)
         st.download_button(
-            label="📥 Завантажити звіт у Excel",
-            data=excel_data,
+            label=f"📥 Завантажити звіт ({EXPORT_FORMAT_LABELS[export_format]})",
+            data=export_data,
             # Використовуємо збережені дати для імені файлу
-            file_name=f"Mapon_Звіт_Автопарку_{st.session_state.start_date_display}_{st.session_state.end_date_display}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            file_name=f"Mapon_Звіт_Автопарку_{current_job.metadata['start_date_display']}_{current_job.metadata['end_date_display']}.{export_format}",
+            mime=EXPORT_FORMATS[export_format]
         )
-        
+
     else:
         st.warning("Вибрані колонки не знайдені в згенерованому звіті або звіт порожній. Будь ласка, перегенеруйте звіт.")
-elif st.session_state.report_generated and st.session_state.df_report.empty:
-    st.warning("Звіт згенеровано, але він не містить даних для відображення з обраними параметрами.")
-elif not st.session_state.report_generated:
-    st.info("Введіть API ключ, оберіть період та натисніть 'Згенерувати Звіт', щоб отримати дані.")
\ No newline at end of file
+
+    # Події палива з локального аналізу серій (розбивка по днях)
+    if 'fuel_events' in df_report.attrs:
+        fuel_events = fuel_events_from_records(df_report.attrs['fuel_events'])
+        with st.expander(f"Події палива ({len(fuel_events)})"):
+            if fuel_events.empty:
+                st.write("Заправок і зливів не знайдено.")
+            else:
+                st.dataframe(fuel_events, use_container_width=True)
+
+    show_unit_chart(df_report, current_job)
+
+    if df_report.attrs.get('metrics'):
+        show_performance_panel(df_report.attrs['metrics'], current_job.job_id)
+elif current_job is not None:
+    st.warning("Звіт не містить даних для обраного періоду. Перевірте обраний період та/або активність юнітів у Mapon.")
+else:
+    st.info("Введіть API ключ, оберіть період та натисніть 'Згенерувати Звіт', щоб отримати дані.")
@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import pytz # Для роботи з часовими поясами
+
+from mapon_api_client import MaponClient, get_group_unit_ids, get_fleet_odometer_and_fuel_data, DEFAULT_MAX_WORKERS, MAPON_API_BASE_URL, FUEL_LOOKUP_DAY
+from mapon_cache import ResponseCache
+from daily_breakdown import get_fleet_daily_breakdown
+from fuel_analytics import FuelEventThresholds
+from daily_aggregates import DailyAggregateStore, get_fleet_report_from_daily_aggregates, day_bounds_utc, DEFAULT_TIMEZONE
+from request_governor import RequestGovernor, DEFAULT_RATE_PER_SECOND, DEFAULT_BURST, DEFAULT_MAX_CONCURRENCY
+from report_export import EXPORT_FORMATS, export_report
+
+# Пакетна генерація звітів без браузера: багато акаунтів і періодів за один запуск (наприклад, щоночі з cron).
+# Звіти виконуються паралельно в пулі процесів; для кожного акаунта одночасно працює не більше
+# max_per_account звітів, а ліміт швидкості API ключа ділиться між ними. Приклад:
+#   python batch_reports.py nightly.json
+#
+# Файл завдання (JSON):
+# {
+#     "output_dir": "reports",
+#     "format": "xlsx",                  # xlsx, csv або parquet (можна список)
+#     "timezone": "Europe/Kiev",
+#     "processes": 4,                    # розмір пулу процесів
+#     "max_per_account": 1,              # одночасних звітів на один API ключ
+#     "max_workers": 8,                  # паралельних запитів усередині звіту
+#     "use_daily_aggregates": false,
+#     "daily_breakdown": false,          # рядок на кожну добу (довгий формат)
+#     "local_fuel_events": false,        # лише з daily_breakdown: заправки/зливи/витрата з серій рівня палива
+#     "fuel_lookup": "day",              # day (уся доба UTC) або window (вузькі вікна навколо моменту)
+#     "fuel_summary_chunk": "week",      # необов'язково: зведення по паливу частинами (day або week)
+#     "base_url": "https://mapon.com/api/v1", # необов'язково (наприклад, mapon_stub_server.py для перевірки)
+#     "ranges": ["yesterday", "last_week", "last_month"],
+#     "accounts": [
+#         {"name": "client-a", "api_key_env": "MAPON_KEY_A", "group_ids": [12], "exclude_inactive": true},
+#         {"name": "client-b", "api_key": "...", "ranges": [{"name": "june", "start": "2025-06-01", "end": "2025-06-30"}]}
+#     ]
+# }
+
+# Формати вихідних файлів і їх розширення
+OUTPUT_FORMATS = {'xlsx': 'xlsx', 'csv': 'csv', 'parquet': 'parquet'}
+DEFAULT_PROCESSES = 4
+DEFAULT_MAX_PER_ACCOUNT = 1
+
+
+# Межі відносного періоду (цілі локальні доби) відносно сьогоднішньої дати today
+def relative_range(name: str, today: datetime.date) -> tuple:
+    yesterday = today - datetime.timedelta(days=1)
+    if name == 'yesterday':
+        return yesterday, yesterday
+    if name == 'last_7_days':
+        return today - datetime.timedelta(days=7), yesterday
+    if name == 'last_week': # Попередній тиждень, понеділок - неділя
+        start = today - datetime.timedelta(days=today.weekday() + 7)
+        return start, start + datetime.timedelta(days=6)
+    if name == 'last_month':
+        end = today.replace(day=1) - datetime.timedelta(days=1)
+        return end.replace(day=1), end
+    raise ValueError(f"Невідомий період '{name}'")
+
+
+# Період з файлу завдання: назва відносного періоду або {"name", "start", "end"} з датами YYYY-MM-DD
+def resolve_range(range_spec, today: datetime.date) -> tuple:
+    if isinstance(range_spec, str):
+        start_date, end_date = relative_range(range_spec, today)
+        return range_spec, start_date, end_date
+    start_date = datetime.date.fromisoformat(range_spec['start'])
+    end_date = datetime.date.fromisoformat(range_spec['end'])
+    if start_date > end_date:
+        raise ValueError(f"Період {range_spec}: дата початку пізніше дати закінчення")
+    return range_spec.get('name', f"{start_date:%Y%m%d}_{end_date:%Y%m%d}"), start_date, end_date
+
+
+# API ключ акаунта з файлу завдання: api_key або змінна оточення api_key_env (спільне з prefetch_worker)
+def account_api_key(account: dict) -> str:
+    if account.get('api_key'):
+        return account['api_key']
+    if account.get('api_key_env'):
+        api_key = os.environ.get(account['api_key_env'])
+        if api_key:
+            return api_key
+        raise ValueError(f"Акаунт '{account.get('name')}': змінна оточення {account['api_key_env']} не задана")
+    raise ValueError(f"Акаунт '{account.get('name')}': не вказано api_key або api_key_env")
+
+
+def _safe_file_part(value: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', str(value)).strip('_')
+
+
+# Розгортає файл завдання у список окремих звітів (акаунт x період)
+def build_tasks(spec: dict, today: datetime.date = None) -> list:
+    timezone = spec.get('timezone', DEFAULT_TIMEZONE)
+    if today is None:
+        today = datetime.datetime.now(pytz.timezone(timezone)).date()
+    formats = spec.get('format', 'xlsx')
+    formats = [formats] if isinstance(formats, str) else list(formats)
+    for output_format in formats:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Невідомий формат '{output_format}', доступні: {', '.join(OUTPUT_FORMATS)}")
+
+    tasks = []
+    for number, account in enumerate(spec['accounts'], start=1):
+        account_name = account.get('name') or f"account{number}"
+        api_key = account_api_key(account)
+        for range_spec in account.get('ranges', spec.get('ranges', ['yesterday'])):
+            range_name, start_date, end_date = resolve_range(range_spec, today)
+            base_name = f"{_safe_file_part(account_name)}_{_safe_file_part(range_name)}_{start_date:%Y%m%d}_{end_date:%Y%m%d}"
+            tasks.append({
+                'account': account_name,
+                'api_key': api_key,
+                'range': range_name,
+                'start_date': start_date,
+                'end_date': end_date,
+                'timezone': timezone,
+                'max_workers': account.get('max_workers', spec.get('max_workers', DEFAULT_MAX_WORKERS)),
+                'use_daily_aggregates': account.get('use_daily_aggregates', spec.get('use_daily_aggregates', False)),
+                'unit_ids': account.get('unit_ids'),
+                'group_ids': account.get('group_ids'),
+                'exclude_inactive': account.get('exclude_inactive', spec.get('exclude_inactive', False)),
+                'daily_breakdown': account.get('daily_breakdown', spec.get('daily_breakdown', False)),
+                'local_fuel_events': account.get('local_fuel_events', spec.get('local_fuel_events', False)),
+                'fuel_lookup': account.get('fuel_lookup', spec.get('fuel_lookup', FUEL_LOOKUP_DAY)),
+                'fuel_summary_chunk': account.get('fuel_summary_chunk', spec.get('fuel_summary_chunk')),
+                'base_url': spec.get('base_url', MAPON_API_BASE_URL),
+                'max_per_account': spec.get('max_per_account', DEFAULT_MAX_PER_ACCOUNT),
+                'outputs': [os.path.join(spec.get('output_dir', 'reports'), f"{base_name}.{OUTPUT_FORMATS[output_format]}") for output_format in formats],
+            })
+    return tasks
+
+
+# Запис звіту у файл; формат визначається розширенням (див. report_export.py)
+def write_report_file(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    export_format = os.path.splitext(path)[1].lstrip('.')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Невідомий формат файлу: {path}")
+    export_report(df, export_format, path)
+
+
+# Один звіт у процесі-виконавці. Повертає короткий підсумок (без DataFrame - він лише записується у файли).
+def run_batch_task(task: dict) -> dict:
+    started = time.perf_counter()
+    tz = pytz.timezone(task['timezone'])
+    start_datetime_utc = day_bounds_utc(task['start_date'], tz)[0]
+    end_datetime_utc = day_bounds_utc(task['end_date'], tz)[1]
+    # Звіти одного акаунта в різних процесах ділять ліміт швидкості API ключа порівну
+    share = max(1, task['max_per_account'])
+    governor = RequestGovernor(rate=DEFAULT_RATE_PER_SECOND / share, burst=max(1, DEFAULT_BURST // share), max_concurrency=max(1, DEFAULT_MAX_CONCURRENCY // share))
+    max_workers = task['max_workers']
+
+    with MaponClient(task['api_key'], pool_size=max(max_workers or 1, 1), base_url=task['base_url'], cache=ResponseCache(), fuel_lookup=task['fuel_lookup'], fuel_summary_chunk=task['fuel_summary_chunk'], governor=governor) as client:
+        # Фільтр юнітів: перелічені юніти та всі юніти перелічених груп (None - увесь акаунт)
+        unit_ids = None
+        if task['unit_ids'] or task['group_ids']:
+            unit_ids = set(task['unit_ids'] or [])
+            for group_id in task['group_ids'] or []:
+                unit_ids.update(get_group_unit_ids(client, group_id))
+        unit_filter = {'unit_ids': unit_ids, 'exclude_inactive': task['exclude_inactive']}
+
+        if task['daily_breakdown']:
+            df = get_fleet_daily_breakdown(client, task['start_date'], task['end_date'], timezone=task['timezone'], max_workers=max_workers, fuel_events=FuelEventThresholds() if task['local_fuel_events'] else None, **unit_filter)
+        elif task['use_daily_aggregates']:
+            store = DailyAggregateStore()
+            try:
+                df = get_fleet_report_from_daily_aggregates(client, task['start_date'], task['end_date'], store, timezone=task['timezone'], max_workers=max_workers, **unit_filter)
+            finally:
+                store.close()
+        else:
+            df = get_fleet_odometer_and_fuel_data(client, start_datetime_utc, end_datetime_utc, max_workers=max_workers, **unit_filter)
+        failed_requests = client.error_budget.failures
+
+    for path in task['outputs']:
+        write_report_file(df, path)
+
+    return {
+        'account': task['account'],
+        'range': task['range'],
+        'rows': len(df),
+        'failed_requests': failed_requests,
+        'seconds': round(time.perf_counter() - started, 1),
+        'outputs': task['outputs'],
+    }
+
+
+# Виконання всіх звітів у пулі процесів з обмеженням одночасних звітів на акаунт.
+# Повертає список підсумків (для невдалих звітів - з полем 'error').
+def run_batch(tasks: list, processes: int = DEFAULT_PROCESSES, max_per_account: int = DEFAULT_MAX_PER_ACCOUNT) -> list:
+    pending = defaultdict(deque)
+    for task in tasks:
+        pending[task['account']].append(task)
+    running = defaultdict(int)
+    futures = {}
+    results = []
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while pending or futures:
+            # Дозаповнюємо пул завданнями акаунтів, що ще не досягли свого ліміту
+            for account in list(pending):
+                while pending[account] and running[account] < max_per_account and len(futures) < processes:
+                    task = pending[account].popleft()
+                    futures[executor.submit(run_batch_task, task)] = task
+                    running[account] += 1
+                if not pending[account]:
+                    del pending[account]
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = futures.pop(future)
+                running[task['account']] -= 1
+                try:
+                    result = future.result()
+                    print(f"[Batch] {result['account']} / {result['range']}: {result['rows']} рядків за {result['seconds']} с -> {', '.join(result['outputs'])}")
+                except Exception as e:
+                    result = {'account': task['account'], 'range': task['range'], 'error': str(e), 'outputs': []}
+                    print(f"[Batch] {task['account']} / {task['range']}: помилка: {e}")
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетна генерація звітів Mapon за файлом завдання (JSON).")
+    parser.add_argument('spec', help="Файл завдання")
+    parser.add_argument('--processes', type=int, help="Розмір пулу процесів (перекриває значення з файлу)")
+    parser.add_argument('--summary', help="Зберегти підсумок запуску в JSON файл")
+    args = parser.parse_args()
+
+    with open(args.spec, encoding='utf-8') as f:
+        spec = json.load(f)
+    tasks = build_tasks(spec)
+    processes = args.processes or spec.get('processes', DEFAULT_PROCESSES)
+    max_per_account = spec.get('max_per_account', DEFAULT_MAX_PER_ACCOUNT)
+    print(f"[Batch] {len(tasks)} звітів, процесів: {processes}, одночасних звітів на акаунт: {max_per_account}.")
+
+    results = run_batch(tasks, processes, max_per_account)
+    failed = [result for result in results if 'error' in result]
+    print(f"[Batch] Готово: {len(results) - len(failed)} з {len(results)} звітів, з помилкою: {len(failed)}.")
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import datetime
+import json
+import time
+import tracemalloc
+import pytz # Для роботи з часовими поясами
+
+from mapon_api_client import MaponClient, get_fleet_odometer_and_fuel_data, DEFAULT_MAX_WORKERS
+from mapon_stub_server import start_stub_server_process, fetch_stub_stats
+from request_governor import RequestGovernor
+from fuel_series import FuelSeriesStore
+from fuel_profiles import FuelSourceProfileStore
+
+# Бенчмарк звіту get_fleet_odometer_and_fuel_data на локальному замінику Mapon API (mapon_stub_server.py).
+# Для кожного розміру автопарку вимірюються: загальний час, кількість запитів до API, отримані байти
+# та пікова пам'ять Python (tracemalloc). Сервер працює в окремому процесі, тож у вимірювання
+# потрапляє лише клієнт. Приклад:
+#   python benchmark_report.py --sizes 10 100 1000 --workers 16 --latency 0.02
+
+# Фіксований період звіту: 1 червня 2025 за Києвом (00:00 - 23:59:59)
+BENCHMARK_START = datetime.datetime(2025, 5, 31, 21, 0, 0, tzinfo=pytz.utc)
+BENCHMARK_END = datetime.datetime(2025, 6, 1, 20, 59, 59, tzinfo=pytz.utc)
+
+
+# Один прогін звіту на автопарку заданого розміру. Кожен прогін - з холодними кешами.
+def run_benchmark(size: int, workers: int, points_per_day: int, latency: float, error_rate: float, throttle_rate: float, trace_memory: bool = True) -> dict:
+    process, base_url = start_stub_server_process(
+        {'size': size, 'points_per_day': points_per_day},
+        {'latency': latency, 'error_rate': error_rate, 'throttle_rate': throttle_rate}
+    )
+    try:
+        # Регулятор без обмеження швидкості: вимірюємо клієнт, а не ліміти API
+        governor = RequestGovernor(rate=1e9, burst=10 ** 6, max_concurrency=max(workers, 1))
+        client = MaponClient(f"benchmark-{size}", pool_size=max(workers, 1), base_url=base_url, fuel_series_store=FuelSeriesStore(), fuel_profiles=FuelSourceProfileStore(), governor=governor)
+
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with client:
+            df = get_fleet_odometer_and_fuel_data(client, BENCHMARK_START, BENCHMARK_END, max_workers=workers)
+        wall_time = time.perf_counter() - started
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        stats = fetch_stub_stats(base_url)
+    finally:
+        process.terminate()
+        process.join()
+
+    return {
+        'units': size,
+        'workers': workers,
+        'rows': len(df),
+        'wall_time_s': round(wall_time, 3),
+        'requests': sum(stats['request_counts'].values()),
+        'requests_by_endpoint': stats['request_counts'],
+        'bytes_received': stats['bytes_sent'],
+        'peak_memory_mb': round(peak_memory / 1024 / 1024, 1) if peak_memory is not None else None,
+        'failed_requests': client.error_budget.failures,
+        'metrics': client.metrics.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк звіту автопарку на локальному замінику Mapon API.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="Розміри автопарку")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help="max_workers звіту (1 - послідовно)")
+    parser.add_argument('--points-per-day', type=int, default=1440)
+    parser.add_argument('--latency', type=float, default=0.0, help="Середня затримка відповіді сервера, секунди")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--no-memory', action='store_true', help="Не вимірювати пам'ять (tracemalloc уповільнює прогін)")
+    parser.add_argument('--json', help="Зберегти результати в JSON файл")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'units':>6} {'workers':>7} {'wall, s':>9} {'requests':>9} {'MB recv':>8} {'peak MB':>8} {'failed':>6}")
+    for size in args.sizes:
+        result = run_benchmark(size, args.workers, args.points_per_day, args.latency, args.error_rate, args.throttle_rate, not args.no_memory)
+        results.append(result)
+        peak = '-' if result['peak_memory_mb'] is None else f"{result['peak_memory_mb']:.1f}"
+        print(f"{result['units']:>6} {result['workers']:>7} {result['wall_time_s']:>9.3f} {result['requests']:>9} "
+              f"{result['bytes_received'] / 1024 / 1024:>8.2f} {peak:>8} {result['failed_requests']:>6}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pytz # Для роботи з часовими поясами
+
+from mapon_api_client import MaponClient, FUEL_LEVEL_SOURCES
+from fuel_series import FuelSeries, to_datetime64
+from daily_breakdown import fetch_fuel_series_for_range
+from daily_aggregates import days_in_range
+from report_schema import COL_UNIT_ID, COL_DAY, COL_ODOMETER_START, COL_ODOMETER_END
+
+# Графіки юніта (рівень палива, одометр) для перегляду звіту. Сира серія CAN за добу - десятки тисяч точок,
+# тож серія проріджується на сервері до фіксованої кількості точок і лише тоді передається в браузер.
+
+# Методи проріджування
+DOWNSAMPLE_LTTB = 'lttb' # Largest-Triangle-Three-Buckets: зберігає форму кривої
+DOWNSAMPLE_MINMAX = 'minmax' # мінімум і максимум кожного кошика: зберігає піки (заправки, зливи)
+DOWNSAMPLE_METHODS = (DOWNSAMPLE_LTTB, DOWNSAMPLE_MINMAX)
+# Скільки точок серії передавати на графік
+DEFAULT_CHART_POINTS = 1000
+# Скільки проріджених серій тримаємо в пам'яті процесу
+DEFAULT_MAX_CHARTS = 1000
+# Скільки живе графік, період якого зачіпає поточну добу UTC (дані ще надходять), секунди
+DEFAULT_LIVE_TTL = 300
+
+
+# Проріджування LTTB: перша й остання точки зберігаються, решта ділиться на (points - 2) кошики за індексом,
+# і з кожного кошика береться точка, що утворює найбільший трикутник з попередньою обраною точкою
+# та середньою точкою наступного кошика. Середні всіх кошиків рахуються одним reduceat.
+# Повертає індекси обраних точок (за зростанням).
+def lttb_indexes(times: np.ndarray, values: np.ndarray, points: int) -> np.ndarray:
+    size = values.size
+    if points >= size or points < 3:
+        return np.arange(size)
+    x = times.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    x -= x[0] # менші числа - точніша площа
+    y = values.astype(np.float64)
+
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64) # кошик i - [edges[i], edges[i + 1])
+    counts = np.diff(edges)
+    average_x = np.add.reduceat(x[:size - 1], edges[:-1]) / counts
+    average_y = np.add.reduceat(y[:size - 1], edges[:-1]) / counts
+    # Для останнього кошика "наступний" - остання точка серії
+    next_x = np.append(average_x[1:], x[-1])
+    next_y = np.append(average_y[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    previous = 0
+    for bucket in range(points - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        area = np.abs(
+            (x[previous] - next_x[bucket]) * (y[low:high] - y[previous])
+            - (x[previous] - x[low:high]) * (next_y[bucket] - y[previous])
+        )
+        previous = low + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+# Проріджування min/max: серія ділиться на (points - 2) // 2 кошики за індексом, з кожного - мінімум і максимум
+# (у порядку часу), плюс перша й остання точки. Повністю векторизоване: одне сортування за (кошик, значення).
+# Повертає індекси обраних точок (за зростанням).
+def minmax_indexes(values: np.ndarray, points: int) -> np.ndarray:
+    size = values.size
+    buckets = (points - 2) // 2
+    if points >= size or buckets < 1:
+        return np.arange(size)
+    bucket_index = np.arange(size) * buckets // size
+    order = np.lexsort((values, bucket_index))
+    bucket_ends = np.cumsum(np.bincount(bucket_index, minlength=buckets))
+    bucket_starts = bucket_ends - np.bincount(bucket_index, minlength=buckets)
+    return np.unique(np.concatenate((order[bucket_starts], order[bucket_ends - 1], [0, size - 1])))
+
+
+# Проріджена серія обраним методом (FuelSeries -> FuelSeries)
+def downsample_series(series: FuelSeries, points: int = DEFAULT_CHART_POINTS, method: str = DOWNSAMPLE_LTTB) -> FuelSeries:
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Невідомий метод проріджування: {method}")
+    if len(series) <= points:
+        return series
+    if method == DOWNSAMPLE_LTTB:
+        indexes = lttb_indexes(series.times, series.values, points)
+    else:
+        indexes = minmax_indexes(series.values, points)
+    return FuelSeries(series.times[indexes], series.values[indexes])
+
+
+# Серія рівня палива юніта за проміжок [start, end] (UTC) з уже завантажених звітом даних, якщо вони є:
+# - добові серії UTC у сховищі клієнта (звіт за період і щоденні агрегати зберігають їх там) - якщо
+#   для одного джерела в сховищі є всі доби проміжку, серія складається з них без жодного запиту;
+# - інакше серія за весь проміжок одним запитом на джерело (як у розбивці по днях) - для того самого
+#   проміжку відповідь береться з кешу відповідей клієнта.
+def load_fuel_series_for_chart(client: MaponClient, unit_id: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> FuelSeries:
+    days = days_in_range(start_datetime.astimezone(pytz.utc).date(), end_datetime.astimezone(pytz.utc).date())
+    for data_source in FUEL_LEVEL_SOURCES:
+        day_series = [client.fuel_series_store.get((client.account, unit_id, data_source, day)) for day in days]
+        if all(series is not None for series in day_series) and any(len(series) for series in day_series):
+            times = np.concatenate([series.times for series in day_series])
+            values = np.concatenate([series.values for series in day_series])
+            inside = (times >= to_datetime64(start_datetime)) & (times <= to_datetime64(end_datetime))
+            print(f"[Chart] Серія палива Unit ID {unit_id}: {len(days)} діб зі сховища серій ({data_source}).")
+            return FuelSeries(times[inside], values[inside])
+    return fetch_fuel_series_for_range(client, unit_id, start_datetime, end_datetime)
+
+
+# Точки одометра юніта (за ID) з рядків готового звіту (без запитів): лише показання на початок і кінець
+# періоду, а для розбивки по днях - на початок і кінець кожної доби; проміжних показань звіт не має.
+# Повертає DataFrame з колонками 'Час' (локальний час tz, без поясу) та 'Одометр'.
+def odometer_points_from_report(df: pd.DataFrame, unit_id, start_datetime: datetime.datetime, end_datetime: datetime.datetime, tz=pytz.utc) -> pd.DataFrame:
+    unit_rows = df[df[COL_UNIT_ID] == unit_id]
+    if COL_DAY in unit_rows.columns:
+        unit_rows = unit_rows.sort_values(COL_DAY)
+        starts = [datetime.datetime.combine(day, datetime.time(0, 0, 0)) for day in unit_rows[COL_DAY]]
+        ends = [datetime.datetime.combine(day, datetime.time(23, 59, 59)) for day in unit_rows[COL_DAY]]
+    else:
+        starts = [start_datetime.astimezone(tz).replace(tzinfo=None)] * len(unit_rows)
+        ends = [end_datetime.astimezone(tz).replace(tzinfo=None)] * len(unit_rows)
+    points = pd.DataFrame({
+        'Час': pd.to_datetime(starts + ends),
+        'Одометр': np.concatenate((unit_rows[COL_ODOMETER_START].to_numpy(), unit_rows[COL_ODOMETER_END].to_numpy())),
+    })
+    return points.dropna().drop_duplicates('Час').sort_values('Час', ignore_index=True)
+
+
+# Кеш проріджених серій палива з ключем (акаунт, юніт, період, точки, метод): повторний перегляд того самого
+# юніта (перезапуск скрипта Streamlit, інша сесія) не завантажує і не проріджує серію заново.
+# Кожна серія формується один раз - навіть якщо її одночасно запитали кілька сесій; обмеження за кількістю (LRU).
+class ChartSeriesCache:
+    def __init__(self, max_charts: int = DEFAULT_MAX_CHARTS, live_ttl: float = DEFAULT_LIVE_TTL):
+        self.max_charts = max_charts
+        self.live_ttl = live_ttl
+        self._entries = OrderedDict() # ключ -> (FuelSeries, expires_at)
+        self._loading = {} # ключ -> Lock для формування
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(account: str, unit_id, start_datetime: datetime.datetime, end_datetime: datetime.datetime, points: int, method: str) -> tuple:
+        return (account, unit_id, start_datetime.isoformat(), end_datetime.isoformat(), points, method)
+
+    # Графік за період, що закінчився до початку поточної доби UTC, не змінюється; інакше - живе live_ttl секунд
+    def expires_at_for(self, end_datetime: datetime.datetime, now: float = None):
+        now = time.time() if now is None else now
+        start_of_today = datetime.datetime.fromtimestamp(now, tz=pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        if end_datetime < start_of_today:
+            return None
+        return now + self.live_ttl
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            series, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return series
+
+    def put(self, key: tuple, series: FuelSeries, expires_at=None):
+        with self._lock:
+            self._entries[key] = (series, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_charts:
+                self._entries.popitem(last=False)
+
+    # Проріджена серія палива юніта з кешу або завантажена (див. load_fuel_series_for_chart) і проріджена
+    def get_or_load(self, client: MaponClient, unit_id, start_datetime: datetime.datetime, end_datetime: datetime.datetime, points: int = DEFAULT_CHART_POINTS, method: str = DOWNSAMPLE_LTTB) -> FuelSeries:
+        key = self.make_key(client.account, unit_id, start_datetime, end_datetime, points, method)
+        series = self.get(key)
+        if series is not None:
+            return series
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            series = self.get(key)
+            if series is not None:
+                return series
+            try:
+                raw_series = load_fuel_series_for_chart(client, unit_id, start_datetime, end_datetime)
+                series = downsample_series(raw_series, points, method)
+                print(f"[Chart] Unit ID {unit_id}: {len(raw_series)} точок проріджено до {len(series)} ({method}).")
+                self.put(key, series, self.expires_at_for(end_datetime))
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return series
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Серія для графіка: DataFrame з колонками 'Час' (локальний час tz, без поясу) та значенням
+def series_to_frame(series: FuelSeries, value_column: str, tz=pytz.utc) -> pd.DataFrame:
+    if not len(series):
+        return pd.DataFrame({'Час': pd.Series(dtype='datetime64[ns]'), value_column: pd.Series(dtype=np.float64)})
+    times = pd.to_datetime(series.times).tz_localize('UTC').tz_convert(tz.zone).tz_localize(None)
+    return pd.DataFrame({'Час': times, value_column: series.values})
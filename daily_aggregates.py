@@ -0,0 +1,190 @@
+import sqlite3
+import threading
+import datetime
+import os
+import pandas as pd
+import pytz # Для роботи з часовими поясами
+
+from mapon_cache import DEFAULT_CACHE_DIR
+from mapon_api_client import (
+    MaponClient, FUEL_SUMMARY_SOURCE_KEYS, select_report_units, get_unit_name,
+    collect_fleet_unit_data, build_unit_row_from_data, merge_fuel_summaries
+)
+from report_schema import rows_to_dataframe
+
+# Файл сховища щоденних агрегатів за замовчуванням
+DEFAULT_AGGREGATES_PATH = os.path.join(DEFAULT_CACHE_DIR, 'daily_aggregates.sqlite3')
+# Часовий пояс, у якому рахуються доби (як у app.py)
+DEFAULT_TIMEZONE = 'Europe/Kiev'
+
+# Колонки зведення по паливу, що зберігаються для кожного дня
+SUMMARY_COLUMNS = [key for source_keys in FUEL_SUMMARY_SOURCE_KEYS.values() for key in source_keys]
+VALUE_COLUMNS = ['odometer_start', 'odometer_end', 'fuel_level_start', 'fuel_level_end'] + SUMMARY_COLUMNS
+
+
+# Межі локальної доби в UTC: [00:00:00, 23:59:59] в часовому поясі tz
+def day_bounds_utc(day: datetime.date, tz) -> tuple:
+    start = tz.localize(datetime.datetime.combine(day, datetime.time(0, 0, 0))).astimezone(pytz.utc)
+    end = tz.localize(datetime.datetime.combine(day, datetime.time(23, 59, 59))).astimezone(pytz.utc)
+    return start, end
+
+
+def days_in_range(start_date: datetime.date, end_date: datetime.date) -> list:
+    return [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+# Матеріалізовані щоденні агрегати по юнітах (SQLite).
+# Для кожного (акаунт, часовий пояс, доба, юніт) зберігаються одометр і рівень палива на межах доби
+# та заправки/зливи/витрата/середня витрата по кожному джерелу. Зберігаються лише закриті доби.
+class DailyAggregateStore:
+    def __init__(self, path: str = DEFAULT_AGGREGATES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        value_columns_sql = ', '.join(f'{column} REAL' for column in VALUE_COLUMNS)
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS daily_unit_aggregates (
+                account TEXT NOT NULL,
+                timezone TEXT NOT NULL,
+                day TEXT NOT NULL,
+                unit_id INTEGER NOT NULL,
+                unit_name TEXT,
+                {value_columns_sql},
+                PRIMARY KEY (account, timezone, day, unit_id)
+            )
+        """)
+
+    # Які юніти ще не мають агрегату за кожну з діб: {day: [unit_id, ...]}
+    def missing_unit_days(self, account: str, timezone: str, days: list, unit_ids: list) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT day, unit_id FROM daily_unit_aggregates WHERE account = ? AND timezone = ? AND day BETWEEN ? AND ?',
+                (account, timezone, days[0].isoformat(), days[-1].isoformat())
+            ).fetchall()
+        stored = set(rows)
+        missing = {}
+        for day in days:
+            day_missing = [unit_id for unit_id in unit_ids if (day.isoformat(), unit_id) not in stored]
+            if day_missing:
+                missing[day] = day_missing
+        return missing
+
+    def save_day(self, account: str, timezone: str, day: datetime.date, unit_data: list):
+        columns = ['account', 'timezone', 'day', 'unit_id', 'unit_name'] + VALUE_COLUMNS
+        rows = []
+        for data in unit_data:
+            summary = data['fuel_summary_data']
+            values = [data['odometer_start'], data['odometer_end'], data['fuel_level_start'], data['fuel_level_end']] + [summary.get(key) for key in SUMMARY_COLUMNS]
+            rows.append([account, timezone, day.isoformat(), data['unit_id'], data['unit_name']] + values)
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO daily_unit_aggregates ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                rows
+            )
+
+    # Агрегати за діапазон діб: {unit_id: [запис за кожну збережену добу в порядку дат]}
+    def load_days(self, account: str, timezone: str, days: list, unit_ids: list) -> dict:
+        with self._lock:
+            df = pd.read_sql_query(
+                'SELECT * FROM daily_unit_aggregates WHERE account = ? AND timezone = ? AND day BETWEEN ? AND ? ORDER BY day',
+                self._conn, params=(account, timezone, days[0].isoformat(), days[-1].isoformat())
+            )
+        wanted = set(unit_ids)
+        by_unit = {}
+        for record in df.astype(object).where(df.notna(), None).to_dict('records'):
+            if record['unit_id'] in wanted:
+                by_unit.setdefault(record['unit_id'], []).append(record)
+        return by_unit
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Поєднання щоденних записів юніта в дані за весь діапазон (той самий формат, що й collect_fleet_unit_data)
+def compose_unit_days(unit: dict, day_records: list) -> dict:
+    first, last = day_records[0], day_records[-1]
+    return {
+        'unit_id': unit['unit_id'],
+        'unit_name': get_unit_name(unit),
+        'odometer_start': first['odometer_start'],
+        'odometer_end': last['odometer_end'],
+        'fuel_level_start': first['fuel_level_start'],
+        'fuel_level_end': last['fuel_level_end'],
+        'fuel_summary_data': merge_fuel_summaries(
+            [{key: record[key] for key in SUMMARY_COLUMNS} for record in day_records],
+            [_day_distance(record) for record in day_records],
+        ),
+    }
+
+
+# Пробіг юніта за добу за одометрами запису (None, якщо одометра немає або його скинуто)
+def _day_distance(record: dict):
+    if record['odometer_start'] is None or record['odometer_end'] is None:
+        return None
+    distance = record['odometer_end'] - record['odometer_start']
+    return distance if distance >= 0 else None
+
+
+def get_fleet_report_from_daily_aggregates(client: MaponClient, start_date: datetime.date, end_date: datetime.date, store: DailyAggregateStore, timezone: str = DEFAULT_TIMEZONE, max_workers: int = None, progress_callback=None, unit_ids=None, exclude_inactive: bool = False) -> pd.DataFrame:
+    if start_date > end_date:
+        print("Помилка: Дата початку періоду не може бути пізніше дати закінчення.")
+        return pd.DataFrame()
+
+    tz = pytz.timezone(timezone)
+    units = select_report_units(client, unit_ids, day_bounds_utc(start_date, tz)[0] if exclude_inactive else None)
+    if not units:
+        return pd.DataFrame()
+
+    now_utc = datetime.datetime.now(pytz.utc)
+    days = days_in_range(start_date, end_date)
+    unit_ids = [unit['unit_id'] for unit in units]
+    units_by_id = {unit['unit_id']: unit for unit in units}
+
+    missing = store.missing_unit_days(client.account, timezone, days, unit_ids)
+    print(f"[DailyAggregates] Діб у періоді: {len(days)}, потрібно завантажити: {len(missing)}.")
+
+    # Доба юніта зберігається, щойно доба закрилась і жоден запит саме цього юніта не вдався. Значення None
+    # з успішних відповідей (наприклад, у юніта лише датчик витрати або немає одометра CAN) - це дані, і вони
+    # зберігаються. Доби, що ще не закрились, і юніти з невдалими запитами додаються до складання напряму,
+    # а наступний звіт завантажить лише їх (див. missing_unit_days).
+    live_records = {}
+    for day_index, (day, day_unit_ids) in enumerate(missing.items()):
+        if progress_callback:
+            progress_callback(day_index, len(missing))
+        day_start, day_end = day_bounds_utc(day, tz)
+        failures_before = client.error_budget.unit_failure_counts(day_unit_ids)
+        day_data = collect_fleet_unit_data(client, [units_by_id[unit_id] for unit_id in day_unit_ids], day_start, day_end, max_workers)
+        failures_after = client.error_budget.unit_failure_counts(day_unit_ids)
+        failed_unit_ids = {unit_id for unit_id in day_unit_ids if failures_after[unit_id] > failures_before[unit_id]}
+
+        day_closed = day_end < now_utc
+        stored_data = [data for data in day_data if day_closed and data['unit_id'] not in failed_unit_ids]
+        if stored_data:
+            store.save_day(client.account, timezone, day, stored_data)
+        if day_closed and failed_unit_ids:
+            print(f"[DailyAggregates] Доба {day}: {len(failed_unit_ids)} юнітів з невдалими запитами не збережено, їх буде завантажено знову.")
+        for data in day_data:
+            if day_closed and data['unit_id'] not in failed_unit_ids:
+                continue
+            record = {key: data[key] for key in ('odometer_start', 'odometer_end', 'fuel_level_start', 'fuel_level_end')}
+            record.update({key: data['fuel_summary_data'].get(key) for key in SUMMARY_COLUMNS})
+            record['day'] = day.isoformat()
+            live_records.setdefault(data['unit_id'], []).append(record)
+
+    if progress_callback:
+        progress_callback(len(missing), len(missing))
+
+    stored_records = store.load_days(client.account, timezone, days, unit_ids)
+
+    results = []
+    for unit in units:
+        day_records = stored_records.get(unit['unit_id'], []) + live_records.get(unit['unit_id'], [])
+        if not day_records:
+            continue
+        day_records.sort(key=lambda record: record['day'])
+        results.append(build_unit_row_from_data(compose_unit_days(unit, day_records)))
+
+    return rows_to_dataframe(results)
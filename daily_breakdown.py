@@ -0,0 +1,230 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import pytz # Для роботи з часовими поясами
+import requests
+
+from mapon_api_client import (
+    MaponClient, FUEL_LEVEL_SOURCES, select_report_units, get_unit_name, get_fuel_series,
+    fetch_odometer_snapshot, fetch_fuel_summary_range, build_unit_row
+)
+from fuel_series import FuelSeries, EMPTY_FUEL_SERIES, fuel_levels_for_periods, to_datetime64
+from daily_aggregates import day_bounds_utc, days_in_range, DEFAULT_TIMEZONE
+from report_schema import COL_DAY, COL_UNIT, COL_UNIT_ID, rows_to_dataframe
+from fuel_analytics import FuelEventThresholds, analyze_fleet_fuel, EVENT_REFUEL, EVENT_DRAIN
+
+# Колонка дня у звіті з розбивкою по днях (у DataFrame - одразу після номера автомобіля)
+DAY_COLUMN = COL_DAY
+# Підписи подій палива (локальний аналіз серій) для таблиці подій
+FUEL_EVENT_LABELS = {EVENT_REFUEL: 'Заправка', EVENT_DRAIN: 'Злив'}
+# Колонки часу в таблиці подій палива (локальний час)
+FUEL_EVENT_TIME_COLUMNS = ('Початок', 'Кінець')
+
+
+# Серія рівня палива юніта за весь діапазон одним запитом на джерело (сенсор, потім CAN рівень).
+# Джерела без даних за профілем юніта не запитуються (див. fuel_profiles.py).
+def fetch_fuel_series_for_range(client: MaponClient, unit_id: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> FuelSeries:
+    profile_key = (client.account, unit_id)
+    empty_sources = []
+    try:
+        for data_source in client.fuel_profiles.ordered_sources(profile_key, FUEL_LEVEL_SOURCES):
+            series = get_fuel_series(client, unit_id, data_source, start_datetime, end_datetime)
+            if not len(series):
+                empty_sources.append(data_source)
+                continue
+            client.fuel_profiles.record(profile_key, data_source, True)
+            for empty_source in empty_sources:
+                client.fuel_profiles.record(profile_key, empty_source, False)
+            return series
+    except requests.exceptions.RequestException as e:
+        print(f"[DailyBreakdown] Помилка при отриманні серії палива для Unit ID {unit_id}: {e}")
+    return EMPTY_FUEL_SERIES
+
+
+# Рядки звіту юніта по днях з уже отриманих даних
+def build_unit_day_rows(unit: dict, days: list, bounds: list, odometer_snapshots: list, series: FuelSeries, summaries: list) -> list:
+    starts = np.array([to_datetime64(day_start) for day_start, _ in bounds])
+    ends = np.array([to_datetime64(day_end) for _, day_end in bounds])
+    fuel_starts, fuel_ends = fuel_levels_for_periods(series, starts, ends)
+
+    unit_id = unit['unit_id']
+    unit_name = get_unit_name(unit)
+    rows = []
+    for day_index, day in enumerate(days):
+        row = build_unit_row(
+            unit_name,
+            odometer_snapshots[day_index].get(unit_id), odometer_snapshots[day_index + 1].get(unit_id),
+            fuel_starts[day_index], fuel_ends[day_index], summaries[day_index], unit_id
+        )
+        row.day = day
+        rows.append(row)
+    return rows
+
+
+# Звіт з розбивкою по локальних добах [start_date, end_date] у довгому форматі: рядок на (юніт, доба).
+# Замість окремого звіту на кожну добу:
+# - серія рівня палива юніта завантажується один раз за весь діапазон і ділиться на доби векторизовано;
+# - одометри - знімком автопарку на кожній межі діб (кінець доби = початок наступної, різниця в 1 с
+#   не впливає на пробіг), тобто (діб + 1) запитів на весь автопарк;
+# - зведення по паливу (заправки, зливи, витрата) API рахує лише за проміжок, тож воно запитується
+#   для кожної доби окремо - усі ці запити йдуть паралельно в одному пулі.
+# progress_callback(done, total) рахує оброблені юніти; row_callback(index, row) отримує кожен готовий рядок.
+# unit_ids, exclude_inactive: фільтр юнітів (див. select_report_units)
+# fuel_events: пороги локального аналізу серій (див. fuel_analytics.py) - тоді заправки, зливи та витрата рахуються
+# з уже завантажених серій рівня палива, без жодного запиту fuel/summary.json;
+# events_callback(events) отримує таблицю знайдених подій (див. fuel_events_table) - окремо від DataFrame звіту
+def get_fleet_daily_breakdown(client: MaponClient, start_date: datetime.date, end_date: datetime.date, timezone: str = DEFAULT_TIMEZONE, max_workers: int = None, progress_callback=None, row_callback=None, unit_ids=None, exclude_inactive: bool = False, fuel_events: FuelEventThresholds = None, events_callback=None) -> pd.DataFrame:
+    if start_date > end_date:
+        print("Помилка: Дата початку періоду не може бути пізніше дати закінчення.")
+        return pd.DataFrame()
+
+    units = select_report_units(client, unit_ids, day_bounds_utc(start_date, pytz.timezone(timezone))[0] if exclude_inactive else None)
+    if not units:
+        return pd.DataFrame()
+
+    tz = pytz.timezone(timezone)
+    days = days_in_range(start_date, end_date)
+    bounds = [day_bounds_utc(day, tz) for day in days]
+    range_start, range_end = bounds[0][0], bounds[-1][1]
+    print(f"[DailyBreakdown] Юнітів: {len(units)}, діб: {len(days)}.")
+
+    report_unit_ids = [unit['unit_id'] for unit in units]
+    boundaries = [day_start for day_start, _ in bounds] + [range_end]
+    parallel = max_workers and max_workers > 1
+    if parallel:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mapon-odometer-days') as executor:
+            odometer_snapshots = list(executor.map(lambda boundary: fetch_odometer_snapshot(client, boundary, report_unit_ids), boundaries))
+    else:
+        odometer_snapshots = [fetch_odometer_snapshot(client, boundary, report_unit_ids) for boundary in boundaries]
+
+    if fuel_events is not None:
+        return _daily_breakdown_from_series(client, units, days, bounds, odometer_snapshots, max_workers, fuel_events, tz, progress_callback, row_callback, events_callback)
+
+    rows = {}
+
+    def add_unit_rows(unit_index: int, unit_rows: list):
+        for day_index, row in enumerate(unit_rows):
+            index = unit_index * len(days) + day_index
+            rows[index] = row
+            if row_callback:
+                row_callback(index, row)
+        if progress_callback:
+            progress_callback(len(rows) // len(days), len(units))
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mapon-days') as executor:
+            unit_futures = []
+            future_to_index = {}
+            for unit_index, unit in enumerate(units):
+                futures = {'series': executor.submit(fetch_fuel_series_for_range, client, unit['unit_id'], range_start, range_end)}
+                for day_index, (day_start, day_end) in enumerate(bounds):
+                    futures[day_index] = executor.submit(fetch_fuel_summary_range, client, unit['unit_id'], day_start, day_end)
+                unit_futures.append(futures)
+                for future in futures.values():
+                    future_to_index[future] = unit_index
+
+            pending_counts = [len(futures) for futures in unit_futures]
+            for future in as_completed(future_to_index):
+                unit_index = future_to_index[future]
+                pending_counts[unit_index] -= 1
+                if pending_counts[unit_index]:
+                    continue
+                futures = unit_futures[unit_index]
+                summaries = [futures[day_index].result() for day_index in range(len(days))]
+                add_unit_rows(unit_index, build_unit_day_rows(units[unit_index], days, bounds, odometer_snapshots, futures['series'].result(), summaries))
+                print(f"--- Юніт оброблено: {get_unit_name(units[unit_index])} ---")
+    else:
+        for unit_index, unit in enumerate(units):
+            # Зведення першими: вони наповнюють профіль джерел палива юніта
+            summaries = [fetch_fuel_summary_range(client, unit['unit_id'], day_start, day_end) for day_start, day_end in bounds]
+            series = fetch_fuel_series_for_range(client, unit['unit_id'], range_start, range_end)
+            add_unit_rows(unit_index, build_unit_day_rows(unit, days, bounds, odometer_snapshots, series, summaries))
+            print(f"--- Юніт оброблено: {get_unit_name(unit)} ---")
+
+    return rows_to_dataframe([rows[index] for index in sorted(rows)])
+
+
+# Розбивка по днях з локальним аналізом серій: спершу серії рівня палива всіх юнітів (по одному запиту на джерело),
+# потім один векторизований прохід по всьому автопарку - події та підсумки за кожну добу кожного юніта.
+# Значення з серії рівня (датчик або CAN рівень) йдуть у колонки датчика рівня.
+def _daily_breakdown_from_series(client: MaponClient, units: list, days: list, bounds: list, odometer_snapshots: list, max_workers: int, thresholds: FuelEventThresholds, tz, progress_callback=None, row_callback=None, events_callback=None) -> pd.DataFrame:
+    range_start, range_end = bounds[0][0], bounds[-1][1]
+    series_list = [None] * len(units)
+    done = 0
+
+    def on_series(unit_index: int, series: FuelSeries):
+        nonlocal done
+        series_list[unit_index] = series
+        done += 1
+        if progress_callback:
+            progress_callback(done, len(units))
+
+    if max_workers and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mapon-series') as executor:
+            futures = {executor.submit(fetch_fuel_series_for_range, client, unit['unit_id'], range_start, range_end): unit_index for unit_index, unit in enumerate(units)}
+            for future in as_completed(futures):
+                on_series(futures[future], future.result())
+    else:
+        for unit_index, unit in enumerate(units):
+            on_series(unit_index, fetch_fuel_series_for_range(client, unit['unit_id'], range_start, range_end))
+
+    analysis = analyze_fleet_fuel(series_list, thresholds)
+    starts = np.array([to_datetime64(day_start) for day_start, _ in bounds])
+    ends = np.array([to_datetime64(day_end) for _, day_end in bounds])
+    refuelled, drained, consumed = analysis.period_totals(starts, ends)
+    print(f"[DailyBreakdown] Локальний аналіз серій: {len(analysis.events)} подій для {len(units)} юнітів.")
+
+    rows = []
+    for unit_index, unit in enumerate(units):
+        summaries = [{
+            'refuelled_sensor': _optional(refuelled[unit_index, day_index]),
+            'drained_sensor': _optional(drained[unit_index, day_index]),
+            'consumed_sensor': _optional(consumed[unit_index, day_index]),
+        } for day_index in range(len(days))]
+        for row in build_unit_day_rows(unit, days, bounds, odometer_snapshots, series_list[unit_index], summaries):
+            if row_callback:
+                row_callback(len(rows), row)
+            rows.append(row)
+
+    if events_callback:
+        events_callback(fuel_events_table(analysis.events, units, tz))
+    return rows_to_dataframe(rows)
+
+
+def _optional(value: float):
+    return None if np.isnan(value) else float(value)
+
+
+# Таблиця подій палива для відображення: юніт, тип, час початку й кінця (локальний), обсяг і рівні
+def fuel_events_table(events: pd.DataFrame, units: list, tz) -> pd.DataFrame:
+    series_index = events['series'].to_numpy()
+    return pd.DataFrame({
+        COL_UNIT: np.array([get_unit_name(unit) for unit in units], dtype=object)[series_index] if len(events) else [],
+        'Подія': events['kind'].map(FUEL_EVENT_LABELS),
+        FUEL_EVENT_TIME_COLUMNS[0]: pd.to_datetime(events['start']).dt.tz_localize('UTC').dt.tz_convert(tz.zone).dt.tz_localize(None),
+        FUEL_EVENT_TIME_COLUMNS[1]: pd.to_datetime(events['end']).dt.tz_localize('UTC').dt.tz_convert(tz.zone).dt.tz_localize(None),
+        'Обсяг (л)': events['volume'],
+        'Рівень до (л)': events['level_before'],
+        'Рівень після (л)': events['level_after'],
+        COL_UNIT_ID: np.array([unit['unit_id'] for unit in units], dtype=object)[series_index] if len(events) else [],
+    })
+
+
+# Таблиця подій у вигляді, придатному для JSON (наприклад, для df.attrs звіту, які Parquet зберігає як JSON):
+# список словників, час - рядки ISO
+def fuel_events_records(events: pd.DataFrame) -> list:
+    records = events.copy()
+    for column in FUEL_EVENT_TIME_COLUMNS:
+        records[column] = records[column].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return records.astype(object).where(records.notna(), None).to_dict('records')
+
+
+# Зворотне перетворення fuel_events_records у таблицю подій (без подій - порожній DataFrame)
+def fuel_events_from_records(records: list) -> pd.DataFrame:
+    events = pd.DataFrame.from_records(records)
+    if events.empty:
+        return events
+    for column in FUEL_EVENT_TIME_COLUMNS:
+        events[column] = pd.to_datetime(events[column])
+    return events
@@ -0,0 +1,197 @@
+from dataclasses import dataclass
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+
+from fuel_series import FuelSeries
+
+# Локальний аналіз серій рівня палива (fuel/data.json): заправки, зливи та витрата без fuel/summary.json.
+# Усі серії автопарку склеюються в один масив із номером серії для кожної точки, тож згладжування,
+# пошук подій і підсумки за проміжками рахуються одним векторизованим проходом для всього автопарку.
+
+# Типи подій
+EVENT_REFUEL = 'refuel'
+EVENT_DRAIN = 'drain'
+
+
+# Пороги виявлення подій. Швидкість зміни рівня рахується за часовим вікном, а не між сусідніми точками,
+# тож пороги не залежать від частоти точок (щосекунди чи щохвилини).
+# smoothing_points: ширина ковзної медіани (точок) - прибирає коливання палива в баку на ходу
+# window_seconds: ширина вікна, за яке рахується швидкість зміни згладженого рівня, с
+# refuel_min_rate: мінімальна швидкість зростання рівня для заправки, л/год
+# refuel_min: мінімальний обсяг заправки, л (зростання на стільки через розрив у даних довший за вікно - теж заправка)
+# drain_min: мінімальний обсяг зливу, л
+# drain_min_rate: мінімальна швидкість падіння рівня для зливу, л/год (звичайна витрата значно повільніша)
+@dataclass(frozen=True)
+class FuelEventThresholds:
+    smoothing_points: int = 5
+    window_seconds: float = 300.0
+    refuel_min_rate: float = 60.0
+    refuel_min: float = 10.0
+    drain_min: float = 10.0
+    drain_min_rate: float = 60.0
+
+
+# Результат аналізу автопарку: згладжені серії в одному масиві та знайдені події
+class FleetFuelAnalysis:
+    def __init__(self, times: np.ndarray, smoothed: np.ndarray, offsets: np.ndarray, events: pd.DataFrame):
+        self.times = times # datetime64[s] усіх точок, серія за серією
+        self.smoothed = smoothed # згладжені рівні, float64
+        self.offsets = offsets # межі серій: точки серії i - [offsets[i], offsets[i + 1])
+        self.events = events # колонки: series, kind, start, end, volume, level_before, level_after
+
+    # Заправки, зливи та витрата кожної серії за кожен проміжок [starts[j], ends[j]] (datetime64, UTC).
+    # Подія належить проміжку, в якому почалась. Витрата = рівень на початок - рівень на кінець + заправки - зливи
+    # (рівні - перша й остання згладжені точки проміжку; без точок у проміжку витрата 0).
+    # Повертає три масиви (серій x проміжків); для серій без точок - NaN.
+    def period_totals(self, starts: np.ndarray, ends: np.ndarray) -> tuple:
+        series_count = self.offsets.size - 1
+        starts = starts.astype('datetime64[s]')
+        ends = ends.astype('datetime64[s]')
+        refuelled = np.zeros((series_count, starts.size))
+        drained = np.zeros((series_count, starts.size))
+        for kind, totals in ((EVENT_REFUEL, refuelled), (EVENT_DRAIN, drained)):
+            kind_events = self.events[self.events['kind'] == kind]
+            if kind_events.empty:
+                continue
+            event_starts = kind_events['start'].to_numpy().astype('datetime64[s]')
+            period_index = np.searchsorted(starts, event_starts, side='right') - 1
+            inside = (period_index >= 0) & (event_starts <= ends[np.clip(period_index, 0, None)])
+            np.add.at(totals, (kind_events['series'].to_numpy()[inside], period_index[inside]), kind_events['volume'].to_numpy()[inside])
+
+        # Перша й остання точка кожної серії в кожному проміжку - один searchsorted за складеним ключем (серія, час)
+        first_inside = self._search(starts, 'left')
+        last_inside = self._search(ends, 'right') - 1
+        has_points = first_inside <= last_inside
+        consumed = np.zeros(refuelled.shape)
+        if self.smoothed.size:
+            level_start = self.smoothed[np.clip(first_inside, 0, self.smoothed.size - 1)]
+            level_end = self.smoothed[np.clip(last_inside, 0, self.smoothed.size - 1)]
+            consumed = np.where(has_points, np.maximum(level_start - level_end + refuelled - drained, 0.0), 0.0)
+
+        empty_series = np.diff(self.offsets) == 0
+        for totals in (refuelled, drained, consumed):
+            totals[empty_series] = np.nan
+        return np.round(refuelled, 2), np.round(drained, 2), np.round(consumed, 2)
+
+    # Позиції меж (datetime64) у кожній серії: масив (серій x меж) глобальних індексів точок
+    def _search(self, bounds: np.ndarray, side: str) -> np.ndarray:
+        series_count = self.offsets.size - 1
+        if not self.times.size:
+            return np.zeros((series_count, bounds.size), dtype=np.int64)
+        seconds = self.times.astype(np.int64)
+        bound_seconds = bounds.astype(np.int64)
+        low = min(seconds.min(), bound_seconds.min()) - 1
+        span = max(seconds.max(), bound_seconds.max()) - low + 1
+        series_index = np.repeat(np.arange(series_count), np.diff(self.offsets))
+        keys = series_index * span + (seconds - low)
+        bound_keys = np.arange(series_count)[:, None] * span + (bound_seconds - low)[None, :]
+        return np.searchsorted(keys, bound_keys, side=side)
+
+
+# Ковзна медіана в межах кожної серії: вікно біля країв серії доповнюється крайнім значенням.
+# Серії обробляються по одній (offsets - межі серій у values), вікна - представлення sliding_window_view
+# над доповненим відрізком серії, тож пам'ять обмежена найбільшою серією, а не всім автопарком.
+def _rolling_median(values: np.ndarray, offsets: np.ndarray, points: int) -> np.ndarray:
+    half = max(points, 1) // 2
+    if not half or not values.size:
+        return values.copy()
+    smoothed = np.empty_like(values, dtype=np.float64)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        if start == end:
+            continue
+        padded = np.pad(values[start:end], half, mode='edge')
+        smoothed[start:end] = np.median(sliding_window_view(padded, 2 * half + 1), axis=1)
+    return smoothed
+
+
+# Швидкість зміни рівня (л/год) для кожного проміжку між сусідніми точками серії: різниця згладжених рівнів
+# на краях вікна window_seconds з центром у середині проміжку, поділена на фактичну тривалість між цими точками.
+# Краї - остання точка не пізніше початку вікна й перша не раніше його кінця (у межах серії), тож вікно
+# завжди охоплює сам проміжок; проміжок, довший за вікно, рахується сам по собі.
+def _window_rates(times: np.ndarray, smoothed: np.ndarray, offsets: np.ndarray, window_seconds: float) -> np.ndarray:
+    if times.size < 2:
+        return np.zeros(max(times.size - 1, 0))
+    series_index = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))
+    seconds = times.astype(np.int64)
+    half = int(np.ceil(window_seconds / 2))
+    # Пошук у всіх серіях одним searchsorted за складеним ключем (серія, час), як у FleetFuelAnalysis._search
+    low = seconds.min() - half - 1
+    span = seconds.max() + half - low + 1
+    keys = series_index * span + (seconds - low)
+    interval_series = series_index[:-1]
+    middle = (seconds[:-1] + seconds[1:]) // 2
+    left = np.searchsorted(keys, interval_series * span + (middle - half - low), side='right') - 1
+    right = np.searchsorted(keys, interval_series * span + (middle + half - low), side='left')
+    intervals = np.arange(seconds.size - 1)
+    left = np.clip(left, offsets[interval_series], intervals)
+    right = np.clip(right, intervals + 1, offsets[interval_series + 1] - 1)
+    hours = (seconds[right] - seconds[left]).astype(np.float64) / 3600.0
+    change = smoothed[right] - smoothed[left]
+    # Точки з однаковим часом: будь-яка зміна рівня між ними - миттєва
+    instant = np.where(change == 0, 0.0, np.copysign(np.inf, change))
+    return np.divide(change, hours, out=instant, where=hours > 0)
+
+
+# Послідовні відрізки True у масиві: (початки, кінці не включно)
+def _runs(mask: np.ndarray) -> tuple:
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+# Відрізки (початок, кінець включно) звужені до самої події: вікно швидкості захоплює до половини своєї ширини
+# до й після неї. Для заправки - від найнижчої точки відрізка до найвищої після неї, для зливу - навпаки.
+def _trim_runs(smoothed: np.ndarray, run_starts: np.ndarray, run_ends: np.ndarray, rising: bool) -> tuple:
+    trimmed_starts = run_starts.copy()
+    trimmed_ends = run_ends.copy()
+    pick_start, pick_end = (np.argmin, np.argmax) if rising else (np.argmax, np.argmin)
+    for index, (start, end) in enumerate(zip(run_starts, run_ends)):
+        trimmed_starts[index] = start + pick_start(smoothed[start:end + 1])
+        trimmed_ends[index] = trimmed_starts[index] + pick_end(smoothed[trimmed_starts[index]:end + 1])
+    return trimmed_starts, trimmed_ends
+
+
+# Аналіз серій рівня палива всього автопарку (список FuelSeries; порядок задає номер серії в результаті)
+def analyze_fleet_fuel(series_list: list, thresholds: FuelEventThresholds = None) -> FleetFuelAnalysis:
+    thresholds = thresholds or FuelEventThresholds()
+    lengths = np.array([len(series) for series in series_list], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    if offsets[-1]:
+        times = np.concatenate([series.times.astype('datetime64[s]') for series in series_list if len(series)])
+        values = np.concatenate([series.values for series in series_list if len(series)])
+    else:
+        times = np.array([], dtype='datetime64[s]')
+        values = np.array([], dtype=np.float64)
+    series_index = np.repeat(np.arange(lengths.size), lengths)
+
+    smoothed = _rolling_median(values, offsets, thresholds.smoothing_points)
+
+    # Проміжки між сусідніми точками однієї серії, де рівень швидко росте чи падає (за часовим вікном)
+    delta = np.diff(smoothed)
+    same_series = series_index[1:] == series_index[:-1]
+    rates = _window_rates(times, smoothed, offsets, thresholds.window_seconds)
+    rising = same_series & ((rates >= thresholds.refuel_min_rate) | (delta >= thresholds.refuel_min))
+    falling = same_series & (rates <= -thresholds.drain_min_rate)
+
+    frames = []
+    for kind, mask, min_volume in ((EVENT_REFUEL, rising, thresholds.refuel_min), (EVENT_DRAIN, falling, thresholds.drain_min)):
+        run_starts, run_ends = _trim_runs(smoothed, *_runs(mask), kind == EVENT_REFUEL)
+        volumes = np.abs(smoothed[run_ends] - smoothed[run_starts])
+        keep = volumes >= min_volume
+        run_starts, run_ends = run_starts[keep], run_ends[keep]
+        frames.append(pd.DataFrame({
+            'series': series_index[run_starts],
+            'kind': kind,
+            'start': times[run_starts],
+            'end': times[run_ends],
+            'volume': np.round(volumes[keep], 2),
+            'level_before': np.round(smoothed[run_starts], 2),
+            'level_after': np.round(smoothed[run_ends], 2),
+        }))
+    events = pd.concat(frames, ignore_index=True).sort_values(['series', 'start'], kind='stable', ignore_index=True)
+    return FleetFuelAnalysis(times, smoothed, offsets, events)
+
+
+# Аналіз однієї серії (наприклад, для графіка юніта)
+def analyze_fuel_series(series: FuelSeries, thresholds: FuelEventThresholds = None) -> FleetFuelAnalysis:
+    return analyze_fleet_fuel([series], thresholds)
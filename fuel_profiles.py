@@ -0,0 +1,45 @@
+import threading
+import time
+
+# Скільки живе спостереження про джерело палива юніта, секунди (після цього джерело перевіряється знову)
+DEFAULT_PROFILE_TTL = 24 * 60 * 60
+# Джерела даних про паливо, які відстежуються в профілі
+FUEL_PROFILE_SOURCES = ('sensor', 'can', 'flow')
+
+
+# Профіль джерел палива юнітів: які з sensor/can/flow справді повертають дані.
+# Ключ - (акаунт, юніт). Профіль навчається з fuel/summary.json і з отриманих серій fuel/data.json,
+# тож пошук рівня палива одразу йде до джерела з даними і не робить гарантовано порожніх запитів.
+# Кожне спостереження застаріває через ttl - після цього джерело знову вважається невідомим.
+class FuelSourceProfileStore:
+    def __init__(self, ttl: float = DEFAULT_PROFILE_TTL):
+        self.ttl = ttl
+        self._profiles = {} # ключ -> {джерело: (є дані, час спостереження)}
+        self._lock = threading.Lock()
+
+    # Чинний профіль юніта: {джерело: True / False / None (невідомо)}
+    def get(self, key: tuple) -> dict:
+        threshold = time.time() - self.ttl
+        with self._lock:
+            observations = dict(self._profiles.get(key, {}))
+        return {
+            source: observations[source][0] if source in observations and observations[source][1] >= threshold else None
+            for source in FUEL_PROFILE_SOURCES
+        }
+
+    def record(self, key: tuple, source: str, has_data: bool):
+        with self._lock:
+            self._profiles.setdefault(key, {})[source] = (has_data, time.time())
+
+    # Джерела для опитування в порядку пріоритету sources без тих, для яких відомо, що даних немає
+    def ordered_sources(self, key: tuple, sources: tuple) -> list:
+        profile = self.get(key)
+        return [source for source in sources if profile.get(source) is not False]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+# Спільний профіль процесу: навчається в одному звіті й використовується наступними
+DEFAULT_FUEL_PROFILE_STORE = FuelSourceProfileStore()
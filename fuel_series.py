@@ -0,0 +1,211 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pytz # Для роботи з часовими поясами
+
+# Максимальний обсяг розібраних добових серій у пам'яті процесу, байти
+# (доба з точкою щосекунди - близько 1,4 МБ)
+DEFAULT_MAX_SERIES_BYTES = 256 * 1024 * 1024
+# Скільки живе серія за поточну добу UTC (дані ще надходять), секунди
+DEFAULT_TODAY_TTL = 300
+
+
+# Розібрана серія рівня палива: відсортовані масиви часу (datetime64, UTC) і значень (float64)
+class FuelSeries:
+    __slots__ = ('times', 'values')
+
+    def __init__(self, times: np.ndarray, values: np.ndarray):
+        self.times = times
+        self.values = values
+
+    def __len__(self):
+        return self.values.size
+
+    # Обсяг масивів серії в пам'яті, байти
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + self.values.nbytes
+
+
+EMPTY_FUEL_SERIES = FuelSeries(np.array([], dtype='datetime64[s]'), np.array([], dtype=np.float64))
+
+
+# Рядок часу точки у вигляді 'YYYY-MM-DDTHH:MM:SS' (UTC), який NumPy розбирає сам.
+# Звичайний формат Mapon - '2025-06-01T00:00:00Z': для нього достатньо перших 19 символів;
+# час з іншим зсувом ('+03:00') чи дробовими секундами розбирається fromisoformat і переводиться в UTC.
+def _gmt_to_utc_string(gmt: str) -> str:
+    if len(gmt) == 20 and gmt[19] == 'Z':
+        return gmt[:19]
+    parsed = datetime.datetime.fromisoformat(gmt.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.utc).replace(tzinfo=None)
+    return parsed.isoformat(timespec='seconds')
+
+
+# Розбір сирих значень fuel/data.json за один прохід у масиви NumPy (час - див. _gmt_to_utc_string)
+def parse_fuel_series(raw_values) -> FuelSeries:
+    if not raw_values or not isinstance(raw_values, list):
+        return EMPTY_FUEL_SERIES
+    gmt = []
+    values = []
+    for point in raw_values:
+        value = point.get('value')
+        if isinstance(value, (int, float)) and value >= 0 and point.get('gmt'):
+            gmt.append(_gmt_to_utc_string(point['gmt']))
+            values.append(value)
+    if not values:
+        return EMPTY_FUEL_SERIES
+
+    times = np.array(gmt, dtype='datetime64[s]')
+    values = np.array(values, dtype=np.float64)
+    # API зазвичай віддає точки впорядкованими, сортуємо лише за потреби
+    if times.size > 1 and (times[1:] < times[:-1]).any():
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = values[order]
+    return FuelSeries(times, values)
+
+
+# Переведення datetime з часовим поясом у datetime64 (UTC) для порівняння з серією
+def to_datetime64(dt_object: datetime.datetime) -> np.datetime64:
+    return np.datetime64(dt_object.astimezone(pytz.utc).replace(tzinfo=None), 'us')
+
+
+# Пошук значення рівня палива для початку ('start') або кінця ('end') періоду бінарним пошуком
+def find_fuel_value(series: FuelSeries, target_datetime_utc: datetime.datetime, fuel_type: str):
+    if not len(series):
+        return None
+    target = to_datetime64(target_datetime_utc)
+    if fuel_type == 'start':
+        # Перша точка, яка >= target_datetime; якщо таких немає - найперша точка серії
+        index = np.searchsorted(series.times, target, side='left')
+        if index >= len(series):
+            index = 0
+    elif fuel_type == 'end':
+        # Остання точка, яка <= target_datetime; якщо таких немає - найостанніша точка серії
+        index = np.searchsorted(series.times, target, side='right') - 1
+        if index < 0:
+            index = len(series) - 1
+    else:
+        return None
+    return round(float(series.values[index]), 2)
+
+
+# Значення рівня палива, найближче до target_datetime з боку періоду (для пошуку у вузькому вікні):
+# 'start' - перша точка >= target, а якщо таких немає - остання точка перед ним;
+# 'end' - остання точка <= target, а якщо таких немає - перша точка після нього
+def find_nearest_fuel_value(series: FuelSeries, target_datetime_utc: datetime.datetime, fuel_type: str):
+    if not len(series):
+        return None
+    target = to_datetime64(target_datetime_utc)
+    if fuel_type == 'start':
+        index = np.searchsorted(series.times, target, side='left')
+        if index >= len(series):
+            index = len(series) - 1
+    elif fuel_type == 'end':
+        index = np.searchsorted(series.times, target, side='right') - 1
+        if index < 0:
+            index = 0
+    else:
+        return None
+    return round(float(series.values[index]), 2)
+
+
+# Рівні палива на початок і кінець кожного з послідовних проміжків (наприклад, локальних діб) з однієї серії.
+# starts/ends - масиви datetime64 (UTC). Пошук векторизований: один searchsorted на всі межі.
+# Якщо в проміжку є точки - початок і кінець беруться з першої та останньої з них; якщо точок немає
+# (юніт стояв), обидва значення - остання точка перед проміжком, а без неї - перша точка після нього.
+# Повертає (список рівнів на початок, список рівнів на кінець); для порожньої серії - None.
+def fuel_levels_for_periods(series: FuelSeries, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    if not len(series):
+        return [None] * len(starts), [None] * len(ends)
+    first_inside = np.searchsorted(series.times, starts, side='left')
+    last_inside = np.searchsorted(series.times, ends, side='right') - 1
+    has_points = first_inside <= last_inside
+    before = first_inside - 1
+    fallback = np.where(before >= 0, before, first_inside)
+    start_indexes = np.where(has_points, first_inside, fallback)
+    end_indexes = np.where(has_points, last_inside, fallback)
+    return (
+        [round(float(value), 2) for value in series.values[start_indexes]],
+        [round(float(value), 2) for value in series.values[end_indexes]],
+    )
+
+
+# Сховище розібраних добових серій палива в пам'яті процесу, ключ - (акаунт, юніт, джерело, доба UTC).
+# Кожна доба завантажується один раз: паралельні запити на той самий ключ чекають на перше завантаження,
+# а наступні пошуки (start/end, інші звіти) відповідаються з пам'яті.
+# Обсяг серій обмежений max_bytes (сума times.nbytes + values.nbytes), витіснення - LRU.
+class FuelSeriesStore:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_SERIES_BYTES, today_ttl: float = DEFAULT_TODAY_TTL):
+        self.max_bytes = max_bytes
+        self.today_ttl = today_ttl
+        self._series = OrderedDict() # ключ -> (FuelSeries, expires_at)
+        self._total_bytes = 0
+        self._loading = {} # ключ -> Lock для завантаження
+        self._lock = threading.Lock()
+
+    # Серія з пам'яті або завантажена через loader() (loader повертає FuelSeries)
+    def get_or_load(self, key: tuple, day: datetime.date, loader):
+        series = self.get(key)
+        if series is not None:
+            return series
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Поки чекали, серію міг завантажити інший потік
+            series = self.get(key)
+            if series is not None:
+                return series
+            try:
+                series = loader()
+                self.put(key, day, series)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return series
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._series.get(key)
+            if entry is None:
+                return None
+            series, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._series.move_to_end(key)
+            return series
+
+    def put(self, key: tuple, day: datetime.date, series: FuelSeries):
+        if series.nbytes > self.max_bytes:
+            return
+        today_utc = datetime.datetime.now(pytz.utc).date()
+        expires_at = None if day < today_utc else time.time() + self.today_ttl
+        with self._lock:
+            if key in self._series:
+                self._remove(key)
+            self._series[key] = (series, expires_at)
+            self._total_bytes += series.nbytes
+            while self._total_bytes > self.max_bytes and self._series:
+                self._remove(next(iter(self._series)))
+
+    def _remove(self, key: tuple):
+        series, _ = self._series.pop(key)
+        self._total_bytes -= series.nbytes
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._total_bytes = 0
+
+
+# Спільне сховище процесу: серії перевикористовуються між звітами (і клієнтами) одного процесу
+DEFAULT_FUEL_SERIES_STORE = FuelSeriesStore()
@@ -1,348 +1,800 @@
 import requests
+from requests.adapters import HTTPAdapter
 import datetime
 import pandas as pd
+import json
+import time
 import pytz # Для роботи з часовими поясами
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from collections import namedtuple
+
+from mapon_cache import ResponseCache, account_hash
+from request_governor import RequestGovernor, ErrorBudget, get_request_governor
+from fuel_series import FuelSeries, FuelSeriesStore, DEFAULT_FUEL_SERIES_STORE, parse_fuel_series, find_fuel_value, find_nearest_fuel_value
+from mapon_metrics import ClientMetrics
+from fuel_profiles import FuelSourceProfileStore, DEFAULT_FUEL_PROFILE_STORE, FUEL_PROFILE_SOURCES
+from unit_directory import UnitDirectoryCache, DEFAULT_UNIT_DIRECTORY_CACHE
+from report_schema import UnitReportRow, STATUS_OK, STATUS_RESET, STATUS_NO_DISTANCE, to_float, rows_to_dataframe
+
+# Базова адреса Mapon API
+MAPON_API_BASE_URL = "https://mapon.com/api/v1"
+# Розмір пулу з'єднань і таймаут запиту (секунди) за замовчуванням
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = 60
+# Режими пошуку рівня палива на момент часу: за всю добу UTC або вікнами, що поступово розширюються
+FUEL_LOOKUP_DAY = 'day'
+FUEL_LOOKUP_WINDOW = 'window'
+# Півширина вікон пошуку навколо цільового моменту (режим FUEL_LOOKUP_WINDOW)
+FUEL_LOOKUP_WINDOWS = (datetime.timedelta(minutes=15), datetime.timedelta(hours=2), datetime.timedelta(hours=12))
+# Розбиття довгих періодів для fuel/summary.json на частини фіксованої довжини (None - весь період одним запитом)
+FUEL_SUMMARY_CHUNKS = {
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(weeks=1),
+}
+# Межі частин вирівнюються від понеділка 00:00 UTC: повні частини мають однакові параметри запиту в різних звітах
+# і беруться з кешу відповідей
+FUEL_SUMMARY_CHUNK_ANCHOR = datetime.datetime(2024, 1, 1, tzinfo=pytz.utc)
+
+
+# Клієнт Mapon API: одна пулована keep-alive сесія на весь звіт.
+# З'єднання з mapon.com відкриваються один раз і перевикористовуються всіма запитами звіту.
+# cache: необов'язковий ResponseCache для історичних даних (див. mapon_cache.py)
+# fuel_series_store: сховище розібраних добових серій палива (за замовчуванням спільне для процесу)
+# fuel_profiles: профіль джерел палива юнітів (sensor/can/flow), за замовчуванням спільний для процесу
+# fuel_lookup: режим пошуку рівня палива - FUEL_LOOKUP_DAY (уся доба UTC) або FUEL_LOOKUP_WINDOW (вузькі вікна)
+# unit_directory: кеш списку юнітів і груп з TTL, за замовчуванням спільний для процесу
+# governor: регулятор запитів (ліміт швидкості, паралельність, повтори), за замовчуванням спільний для API ключа
+# error_budget: бюджет повторів і лічильник втрачених запитів цього клієнта (одного звіту)
+# metrics: лічильники запитів, затримок, байтів і порожніх результатів по ендпоінтах (див. mapon_metrics.py)
+# fuel_summary_chunk: None або ключ FUEL_SUMMARY_CHUNKS - зведення по паливу за довгий період запитується частинами
+class MaponClient:
+    def __init__(self, api_key: str, pool_size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT, base_url: str = MAPON_API_BASE_URL, cache: ResponseCache = None, fuel_series_store: FuelSeriesStore = None, fuel_profiles: FuelSourceProfileStore = None, fuel_lookup: str = FUEL_LOOKUP_DAY, unit_directory: UnitDirectoryCache = None, governor: RequestGovernor = None, error_budget: ErrorBudget = None, metrics: ClientMetrics = None, fuel_summary_chunk: str = None):
+        self.api_key = api_key
+        self.account = account_hash(api_key)
+        self.cache = cache
+        self.fuel_series_store = fuel_series_store if fuel_series_store is not None else DEFAULT_FUEL_SERIES_STORE
+        self.fuel_profiles = fuel_profiles if fuel_profiles is not None else DEFAULT_FUEL_PROFILE_STORE
+        self.fuel_lookup = fuel_lookup
+        self.unit_directory = unit_directory if unit_directory is not None else DEFAULT_UNIT_DIRECTORY_CACHE
+        self.governor = governor if governor is not None else get_request_governor(api_key)
+        self.error_budget = error_budget if error_budget is not None else ErrorBudget()
+        self.metrics = metrics if metrics is not None else ClientMetrics()
+        self.fuel_summary_chunk = fuel_summary_chunk
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.base_url = base_url.rstrip('/')
+
+        self.session = requests.Session()
+        # pool_block=True: при вичерпанні пулу потік чекає на вільне з'єднання замість відкриття зайвого
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+    # GET-запит до ендпоінта Mapon (наприклад, 'unit/list.json') через регулятор запитів.
+    # Тимчасові помилки (429/5xx, мережа) повторюються; остаточна помилка - виняток RequestException.
+    def get(self, endpoint: str, params: dict = None) -> requests.Response:
+        query = {'key': self.api_key}
+        if params:
+            query.update(params)
+        url = f"{self.base_url}/{endpoint}"
+        return self.governor.execute(lambda: self.session.get(url, params=query, timeout=self.timeout), self.error_budget, endpoint)
+
+    # GET-запит з розбором JSON. cacheable=True - відповідь береться з кешу / зберігається в кеш
+    # (лише для даних з часовими параметрами: can_point, fuel/data, fuel/summary)
+    def get_json(self, endpoint: str, params: dict = None, cacheable: bool = False) -> dict:
+        params = params or {}
+        source = params.get('data_source')
+        use_cache = cacheable and self.cache is not None
+        if use_cache:
+            key = ResponseCache.make_key(self.account, endpoint, params)
+            cached_text = self.cache.get(key)
+            if cached_text is not None:
+                self.metrics.record_cache_hit(endpoint, source)
+                started = time.perf_counter()
+                data = json.loads(cached_text)
+                self.metrics.record_parse(endpoint, source, time.perf_counter() - started)
+                return data
+
+        started = time.perf_counter()
+        try:
+            response = self.get(endpoint, params)
+        except requests.exceptions.RequestException as e:
+            size = len(e.response.content) if e.response is not None else 0
+            self.metrics.record_request(endpoint, source, time.perf_counter() - started, size, error=True)
+            raise
+        self.metrics.record_request(endpoint, source, time.perf_counter() - started, len(response.content))
+
+        started = time.perf_counter()
+        data = response.json()
+        self.metrics.record_parse(endpoint, source, time.perf_counter() - started)
+        # Відповіді з помилкою API не кешуємо
+        if use_cache and isinstance(data, dict) and 'error' not in data:
+            self.cache.put(key, endpoint, params, response.text)
+        return data
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 
 # Функція для форматування дати в формат Mapon API (UTC)
 def format_datetime_for_mapon(dt_object: datetime.datetime) -> str:
     # Mapon очікує ISO 8601 формат з UTC (Z)
     return dt_object.strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
 
-# Функція для отримання списку юнітів
-def get_unit_list(api_key: str) -> list:
-    url = f"https://mapon.com/api/v1/unit/list.json?key={api_key}"
-    print(f"[Main] Спроба отримати список юнітів за URL: {url}")
+# Функція для отримання списку юнітів (з кешу довідників клієнта, див. unit_directory.py)
+def get_unit_list(client: MaponClient) -> list:
+    return list(client.unit_directory.get_or_load((client.account, 'units'), lambda: _load_unit_list(client)))
+
+# Завантаження списку юнітів з API
+def _load_unit_list(client: MaponClient) -> list:
+    print(f"[Main] Спроба отримати список юнітів за URL: {client.base_url}/unit/list.json")
     try:
-        response = requests.get(url)
-        response.raise_for_status() # Викликає виняток для HTTP помилок (4xx або 5xx)
-        data = response.json()
+        data = client.get_json('unit/list.json') # Викликає виняток для HTTP помилок (4xx або 5xx)
         print(f"[Main] Відповідь від unit/list.json отримано.")
-
-        if 'data' in data and 'units' in data['data'] and isinstance(data['data']['units'], list):
-            all_units = data['data']['units']
-            print(f"[Main] Успішно отримано {len(all_units)} юнітів з API.")
-            
-            filtered_units = []
-            units_filtered_out = 0
-            for unit in all_units:
-                # Фільтруємо юніти, щоб переконатися, що unit_id є дійсним
-                if unit.get('unit_id') is not None and isinstance(unit.get('unit_id'), int) and unit['unit_id'] > 0:
-                    filtered_units.append(unit)
-                else:
-                    print(f"[Main] Юніт \"{unit.get('label') or unit.get('number') or 'ID:' + str(unit.get('unit_id'))}\" (ID: {unit.get('unit_id')}) пропущений: unit_id недійсний або відсутній.")
-                    units_filtered_out += 1
-            print(f"[Main] Всього юнітів пропущено (некоректний ID): {units_filtered_out}.")
-            print(f"[Main] Для подальшої обробки вибрано {len(filtered_units)} юнітів.")
-            
-            if not filtered_units:
-                print('Увага! Після фільтрації не знайдено жодного юніта з дійсним unit_id. Перевірте дані в Mapon.')
-            
-            return filtered_units
-        else:
-            print('Помилка! Неочікуваний формат відповіді від Mapon API для unit/list.json. JSON-структура не містить data.units.')
-            print(f'Повна відповідь: {response.text}')
-            return []
+        return _parse_unit_list(data)
     except requests.exceptions.RequestException as e:
         print(f"Критична помилка при отриманні списку юнітів: {e}")
         return []
 
+# Юніти з дійсним unit_id з відповіді unit/list.json (спільне для синхронного та асинхронного клієнта)
+def _parse_unit_list(data: dict) -> list:
+    if 'data' in data and 'units' in data['data'] and isinstance(data['data']['units'], list):
+        all_units = data['data']['units']
+        print(f"[Main] Успішно отримано {len(all_units)} юнітів з API.")
+        
+        filtered_units = []
+        units_filtered_out = 0
+        for unit in all_units:
+            # Фільтруємо юніти, щоб переконатися, що unit_id є дійсним
+            if unit.get('unit_id') is not None and isinstance(unit.get('unit_id'), int) and unit['unit_id'] > 0:
+                filtered_units.append(unit)
+            else:
+                print(f"[Main] Юніт \"{unit.get('label') or unit.get('number') or 'ID:' + str(unit.get('unit_id'))}\" (ID: {unit.get('unit_id')}) пропущений: unit_id недійсний або відсутній.")
+                units_filtered_out += 1
+        print(f"[Main] Всього юнітів пропущено (некоректний ID): {units_filtered_out}.")
+        print(f"[Main] Для подальшої обробки вибрано {len(filtered_units)} юнітів.")
+        
+        if not filtered_units:
+            print('Увага! Після фільтрації не знайдено жодного юніта з дійсним unit_id. Перевірте дані в Mapon.')
+        
+        return filtered_units
+    else:
+        print('Помилка! Неочікуваний формат відповіді від Mapon API для unit/list.json. JSON-структура не містить data.units.')
+        print(f'Повна відповідь: {data}')
+        return []
+
+# Групи юнітів акаунта з unit_groups/list.json: [{'id': ..., 'name': ...}]
+def get_unit_groups(client: MaponClient) -> list:
+    def load():
+        try:
+            data = client.get_json('unit_groups/list.json')
+        except requests.exceptions.RequestException as e:
+            print(f"Помилка при отриманні списку груп юнітів: {e}")
+            return []
+        return _parse_unit_groups(data)
+
+    return list(client.unit_directory.get_or_load((client.account, 'groups'), load))
+
+def _parse_unit_groups(data: dict) -> list:
+    groups = data.get('data', {}).get('groups') if isinstance(data.get('data'), dict) else data.get('data')
+    if not isinstance(groups, list):
+        return []
+    return [{'id': group.get('id'), 'name': group.get('name') or f"Група {group.get('id')}"}
+            for group in groups if isinstance(group, dict) and group.get('id') is not None]
+
+# ID юнітів групи з unit_groups/list_units.json (елементи - ID або записи з unit_id)
+def get_group_unit_ids(client: MaponClient, group_id) -> list:
+    def load():
+        try:
+            data = client.get_json('unit_groups/list_units.json', {'id': group_id})
+        except requests.exceptions.RequestException as e:
+            print(f"Помилка при отриманні юнітів групи {group_id}: {e}")
+            return []
+        return _parse_group_unit_ids(data)
+
+    return list(client.unit_directory.get_or_load((client.account, 'group', group_id), load))
+
+def _parse_group_unit_ids(data: dict) -> list:
+    units = data.get('data', {}).get('units') if isinstance(data.get('data'), dict) else data.get('data')
+    if not isinstance(units, list):
+        return []
+    return [unit['unit_id'] if isinstance(unit, dict) else unit for unit in units
+            if isinstance(unit, int) or (isinstance(unit, dict) and isinstance(unit.get('unit_id'), int))]
+
+# Час останніх даних юніта (поле last_update списку юнітів) або None
+def _unit_last_update(unit: dict):
+    value = unit.get('last_update')
+    if not isinstance(value, str):
+        return None
+    try:
+        return ensure_utc(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')))
+    except ValueError:
+        return None
+
+# Юніти для звіту: весь акаунт або лише unit_ids (у порядку списку юнітів).
+# active_since: пропустити юніти, останні дані яких старші (за період звіту в них немає нових даних),
+# ще до будь-яких запитів по юніту. Юніти без last_update не пропускаються.
+def select_report_units(client: MaponClient, unit_ids=None, active_since: datetime.datetime = None) -> list:
+    return _filter_report_units(get_unit_list(client), unit_ids, active_since)
+
+def _filter_report_units(units: list, unit_ids=None, active_since: datetime.datetime = None) -> list:
+    if unit_ids is not None:
+        wanted = set(unit_ids)
+        units = [unit for unit in units if unit['unit_id'] in wanted]
+    if active_since is not None:
+        active_units = []
+        for unit in units:
+            last_update = _unit_last_update(unit)
+            if last_update is None or last_update >= active_since:
+                active_units.append(unit)
+        if len(active_units) < len(units):
+            print(f"[Main] Пропущено {len(units) - len(active_units)} юнітів без даних з {format_datetime_for_mapon(active_since)}.")
+        units = active_units
+    if unit_ids is not None or active_since is not None:
+        print(f"[Main] Для звіту вибрано {len(units)} юнітів.")
+    return units
+
+# Значення одометра CAN (total_distance) з одного запису data.units відповіді can_point.json
+def _parse_total_distance(unit_data: dict):
+    if isinstance(unit_data, dict) and unit_data.get('total_distance') and \
+       isinstance(unit_data['total_distance'].get('value'), (int, float)):
+        return unit_data['total_distance']['value']
+    return None
+
 # Функція для отримання даних одометра CAN
-def fetch_odometer(api_key: str, unit_id: str, datetime_obj: datetime.datetime):
+def fetch_odometer(client: MaponClient, unit_id: str, datetime_obj: datetime.datetime):
     formatted_date = format_datetime_for_mapon(datetime_obj)
-    url = f"https://mapon.com/api/v1/unit_data/can_point.json?key={api_key}&unit_id={unit_id}&datetime={formatted_date}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
 
-        if data.get('data') and data['data'].get('units') and \
-           isinstance(data['data']['units'], list) and len(data['data']['units']) > 0 and \
-           data['data']['units'][0].get('total_distance') and \
-           isinstance(data['data']['units'][0]['total_distance'].get('value'), (int, float)):
-            return data['data']['units'][0]['total_distance']['value']
-        else:
-            return None # Використовуємо None для відсутності даних
+    try:
+        data = client.get_json('unit_data/can_point.json', {'unit_id': unit_id, 'datetime': formatted_date}, cacheable=True)
+        return _parse_odometer(client, data)
     except requests.exceptions.RequestException as e:
         print(f"[Odometer] Помилка при отриманні одометра CAN для Unit ID {unit_id} на {formatted_date}: {e}")
+        client.error_budget.record_unit_failure(unit_id)
         return None
 
-# Функція для отримання рівня палива
-def fetch_fuel_level(api_key: str, unit_id: str, target_datetime: datetime.datetime, fuel_type: str):
-    # Встановлюємо часовий пояс на UTC для коректного порівняння
-    target_datetime_utc = target_datetime.astimezone(pytz.utc)
+# Одометр з відповіді can_point.json для одного юніта (None - немає даних)
+def _parse_odometer(client: MaponClient, data: dict):
+    value = None # Використовуємо None для відсутності даних
+    if data.get('data') and data['data'].get('units') and \
+       isinstance(data['data']['units'], list) and len(data['data']['units']) > 0:
+        value = _parse_total_distance(data['data']['units'][0])
+    client.metrics.record_result('unit_data/can_point.json', None, value is None)
+    return value
+
+# Одометри всіх юнітів з відповіді can_point.json без unit_id: {unit_id: total_distance або None}
+def _parse_odometer_snapshot(client: MaponClient, data: dict) -> dict:
+    snapshot = {}
+    units = data.get('data', {}).get('units') if isinstance(data.get('data'), dict) else None
+    if isinstance(units, list):
+        for unit_data in units:
+            if isinstance(unit_data, dict) and unit_data.get('unit_id') is not None:
+                snapshot[unit_data['unit_id']] = _parse_total_distance(unit_data)
+    client.metrics.record_result('unit_data/can_point.json', None, not snapshot)
+    return snapshot
+
+# Знімок одометрів CAN усього автопарку на момент datetime_obj: {unit_id: total_distance або None}.
+# Один запит can_point.json без unit_id повертає всі юніти акаунта. Юніти, яких немає у відповіді
+# (або якщо запит не вдався), доотримуються поштучно через fetch_odometer.
+def fetch_odometer_snapshot(client: MaponClient, datetime_obj: datetime.datetime, unit_ids: list, max_workers: int = None) -> dict:
+    formatted_date = format_datetime_for_mapon(datetime_obj)
+    snapshot = {}
+
+    try:
+        data = client.get_json('unit_data/can_point.json', {'datetime': formatted_date}, cacheable=True)
+        snapshot = _parse_odometer_snapshot(client, data)
+    except requests.exceptions.RequestException as e:
+        print(f"[Odometer] Помилка при отриманні знімка одометрів автопарку на {formatted_date}: {e}")
+
+    missing_unit_ids = [unit_id for unit_id in unit_ids if unit_id not in snapshot]
+    if missing_unit_ids:
+        print(f"[Odometer] Знімок на {formatted_date}: {len(unit_ids) - len(missing_unit_ids)} юнітів з одного запиту, {len(missing_unit_ids)} доотримуємо окремо.")
+        if max_workers and max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mapon-odometer') as executor:
+                values = list(executor.map(lambda unit_id: fetch_odometer(client, unit_id, datetime_obj), missing_unit_ids))
+        else:
+            values = [fetch_odometer(client, unit_id, datetime_obj) for unit_id in missing_unit_ids]
+        snapshot.update(zip(missing_unit_ids, values))
+
+    return {unit_id: snapshot.get(unit_id) for unit_id in unit_ids}
+
+
+# Джерела рівня палива в порядку пріоритету
+FUEL_LEVEL_SOURCES = ('sensor', 'can')
+
+
+# Параметри запиту fuel/data.json
+def _fuel_series_params(unit_id: str, data_source: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> dict:
+    return {
+        'unit_id': unit_id,
+        'from': format_datetime_for_mapon(start_datetime),
+        'till': format_datetime_for_mapon(end_datetime),
+        'data_source': data_source,
+    }
+
+
+# Серія рівня палива юніта з fuel/data.json за довільний проміжок [start, end] (UTC)
+def get_fuel_series(client: MaponClient, unit_id: str, data_source: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> FuelSeries:
+    data = client.get_json('fuel/data.json', _fuel_series_params(unit_id, data_source, start_datetime, end_datetime), cacheable=True)
+    return _parse_fuel_series_data(client, data, data_source)
+
+
+# Серія рівня палива з відповіді fuel/data.json
+def _parse_fuel_series_data(client: MaponClient, data: dict, data_source: str) -> FuelSeries:
+    started = time.perf_counter()
+    raw_values = data.get('data', {}).get(data_source, {}).get('tanks', [{}])[0].get('values')
+    series = parse_fuel_series(raw_values)
+    client.metrics.record_parse('fuel/data.json', data_source, time.perf_counter() - started)
+    client.metrics.record_result('fuel/data.json', data_source, len(series) == 0)
+    return series
+
+
+# Межі доби UTC: [00:00:00, 23:59:59.999999]
+def utc_day_bounds(day: datetime.date) -> tuple:
+    start_of_day = pytz.utc.localize(datetime.datetime.combine(day, datetime.time(0, 0, 0)))
+    return start_of_day, start_of_day.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+
+# Розібрана добова (UTC) серія рівня палива юніта з fuel/data.json.
+# Серія завантажується один раз і далі береться зі сховища клієнта (див. fuel_series.py).
+def get_fuel_series_for_day(client: MaponClient, unit_id: str, data_source: str, day: datetime.date) -> FuelSeries:
+    def load():
+        return get_fuel_series(client, unit_id, data_source, *utc_day_bounds(day))
+
+    return client.fuel_series_store.get_or_load((client.account, unit_id, data_source, day), day, load)
+
+
+# Запит серії рівня палива для пошуку рівня: добова серія UTC (day) або проміжок [start, end]
+FuelSeriesRequest = namedtuple('FuelSeriesRequest', ['data_source', 'day', 'start', 'end'])
+
+
+# Пошук рівня палива на момент target_datetime_utc без введення-виведення - спільний для синхронного
+# та асинхронного клієнтів. Генератор видає FuelSeriesRequest, отримує серію через send() і повертає значення
+# (StopIteration.value; None - немає даних). Завантаження серій виконує клієнт (див. fetch_fuel_level).
+# - Джерела - спершу сенсор, якщо там нічого немає - CAN (рівень палива); джерела, у яких за профілем
+#   юніта даних немає, не запитуються.
+# - FUEL_LOOKUP_DAY: найближча точка в серії за всю добу UTC.
+# - FUEL_LOOKUP_WINDOW: вікна навколо моменту ±15 хв, ±2 год, ±12 год - поки не знайдеться точка.
+#   Вікна не прив'язані до доби UTC, тож межі доби за Києвом (21:00/22:00 UTC) не обрізають пошук,
+#   а замість добової серії високої частоти завантажуються лише кілька точок.
+def fuel_level_lookup(client, unit_id: str, target_datetime_utc: datetime.datetime, fuel_type: str):
+    profile_key = (client.account, unit_id)
+    empty_sources = []
+    for data_source in client.fuel_profiles.ordered_sources(profile_key, FUEL_LEVEL_SOURCES):
+        has_data, value = False, None
+        if client.fuel_lookup == FUEL_LOOKUP_WINDOW:
+            for half_width in FUEL_LOOKUP_WINDOWS:
+                series = yield FuelSeriesRequest(data_source, None, target_datetime_utc - half_width, target_datetime_utc + half_width)
+                if len(series):
+                    has_data, value = True, find_nearest_fuel_value(series, target_datetime_utc, fuel_type)
+                    break
+        else:
+            series = yield FuelSeriesRequest(data_source, target_datetime_utc.date(), None, None)
+            has_data, value = len(series) > 0, find_fuel_value(series, target_datetime_utc, fuel_type)
+
+        if not has_data:
+            empty_sources.append(data_source)
+            continue
+        client.fuel_profiles.record(profile_key, data_source, True)
+        # Порожня доба сама по собі нічого не доводить (юніт міг стояти), але якщо інше джерело
+        # за ту ж добу дало дані - у порожнього джерела даних немає
+        for empty_source in empty_sources:
+            client.fuel_profiles.record(profile_key, empty_source, False)
+        if value is not None:
+            return value
+    return None
 
-    # Запит даних за весь день для пошуку найближчої точки
-    start_of_day = target_datetime_utc.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_of_day = target_datetime_utc.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    formatted_from = format_datetime_for_mapon(start_of_day)
-    formatted_till = format_datetime_for_mapon(end_of_day)
+# Серія для запиту пошуку рівня палива: добова - зі сховища серій клієнта, проміжок - одним запитом
+def _load_fuel_lookup_series(client: MaponClient, unit_id: str, request: FuelSeriesRequest) -> FuelSeries:
+    if request.day is not None:
+        return get_fuel_series_for_day(client, unit_id, request.data_source, request.day)
+    return get_fuel_series(client, unit_id, request.data_source, request.start, request.end)
 
-    # Спочатку спробуємо отримати дані від сенсора
-    data_source_sensor = 'sensor'
-    url_sensor = f"https://mapon.com/api/v1/fuel/data.json?key={api_key}&unit_id={unit_id}&from={formatted_from}&till={formatted_till}&data_source={data_source_sensor}"
 
+# Функція для отримання рівня палива (див. fuel_level_lookup)
+def fetch_fuel_level(client: MaponClient, unit_id: str, target_datetime: datetime.datetime, fuel_type: str):
+    # Встановлюємо часовий пояс на UTC для коректного порівняння
+    lookup = fuel_level_lookup(client, unit_id, target_datetime.astimezone(pytz.utc), fuel_type)
     try:
-        response_sensor = requests.get(url_sensor)
-        response_sensor.raise_for_status()
-        data_sensor = response_sensor.json()
-
-        raw_values_sensor = data_sensor.get('data', {}).get('sensor', {}).get('tanks', [{}])[0].get('values')
-        if raw_values_sensor and isinstance(raw_values_sensor, list) and len(raw_values_sensor) > 0:
-            points = sorted([
-                {'datetime': datetime.datetime.fromisoformat(point['gmt'].replace('Z', '+00:00')), 'value': point['value']}
-                for point in raw_values_sensor if isinstance(point.get('value'), (int, float)) and point['value'] >= 0
-            ], key=lambda x: x['datetime'])
-
-            if points:
-                found_point = None
-                if fuel_type == 'start':
-                    # Шукаємо першу точку, яка >= target_datetime
-                    found_point = next((p for p in points if p['datetime'] >= target_datetime_utc), None)
-                    if not found_point: # Якщо таких немає, беремо найпершу точку дня
-                        found_point = points[0]
-                elif fuel_type == 'end':
-                    # Шукаємо останню точку, яка <= target_datetime
-                    for p in reversed(points):
-                        if p['datetime'] <= target_datetime_utc:
-                            found_point = p
-                            break
-                    if not found_point: # Якщо таких немає, беремо найостаннішу точку дня
-                        found_point = points[-1]
-                
-                if found_point:
-                    return round(found_point['value'], 2)
-
-        # Якщо в 'sensor' нічого не знайшлося, спробуємо отримати дані від CAN (рівень палива)
-        data_source_can = 'can'
-        url_can = f"https://mapon.com/api/v1/fuel/data.json?key={api_key}&unit_id={unit_id}&from={formatted_from}&till={formatted_till}&data_source={data_source_can}"
-        
-        response_can = requests.get(url_can)
-        response_can.raise_for_status()
-        data_can = response_can.json()
-
-        raw_values_can = data_can.get('data', {}).get('can', {}).get('tanks', [{}])[0].get('values')
-        if raw_values_can and isinstance(raw_values_can, list) and len(raw_values_can) > 0:
-            points = sorted([
-                {'datetime': datetime.datetime.fromisoformat(point['gmt'].replace('Z', '+00:00')), 'value': point['value']}
-                for point in raw_values_can if isinstance(point.get('value'), (int, float)) and point['value'] >= 0
-            ], key=lambda x: x['datetime'])
-
-            if points:
-                found_point = None
-                if fuel_type == 'start':
-                    found_point = next((p for p in points if p['datetime'] >= target_datetime_utc), None)
-                    if not found_point:
-                        found_point = points[0]
-                elif fuel_type == 'end':
-                    for p in reversed(points):
-                        if p['datetime'] <= target_datetime_utc:
-                            found_point = p
-                            break
-                    if not found_point:
-                        found_point = points[-1]
-                
-                if found_point:
-                    return round(found_point['value'], 2)
-    
+        request = next(lookup)
+        while True:
+            request = lookup.send(_load_fuel_lookup_series(client, unit_id, request))
+    except StopIteration as result:
+        return result.value
     except requests.exceptions.RequestException as e:
         print(f"[FuelLevel] Критична помилка при отриманні рівня палива для Unit ID {unit_id} (тип: {fuel_type}) на {format_datetime_for_mapon(target_datetime)} : {e}")
-    
+        client.error_budget.record_unit_failure(unit_id)
     return None
 
-# Функція для отримання зведених даних по паливу (заправки, зливи, витрата)
-def fetch_fuel_summary_data(api_key: str, unit_id: str, start_date: datetime.datetime, end_date: datetime.datetime):
-    formatted_from = format_datetime_for_mapon(start_date)
-    formatted_till = format_datetime_for_mapon(end_date)
-    url = f"https://mapon.com/api/v1/fuel/summary.json?key={api_key}&unit_id={unit_id}&from={formatted_from}&till={formatted_till}"
+# Функція для отримання зведених даних по паливу (заправки, зливи, витрата).
+# Якщо в клієнта задано fuel_summary_chunk, довгий період запитується частинами, які потім об'єднуються
+# (помилка однієї частини не втрачає решту періоду).
+def fetch_fuel_summary_data(client: MaponClient, unit_id: str, start_date: datetime.datetime, end_date: datetime.datetime):
+    chunks = fuel_summary_chunks(start_date, end_date, client.fuel_summary_chunk)
+    return merge_chunk_summaries([fetch_fuel_summary_range(client, unit_id, chunk_start, chunk_end) for chunk_start, chunk_end in chunks])
+
+# Частини періоду [start, end] для fuel/summary.json, вирівняні за FUEL_SUMMARY_CHUNK_ANCHOR.
+# Частина закінчується за секунду до наступної межі (till у Mapon включний).
+def fuel_summary_chunks(start_date: datetime.datetime, end_date: datetime.datetime, chunk: str = None) -> list:
+    if chunk is None:
+        return [(start_date, end_date)]
+    length = FUEL_SUMMARY_CHUNKS[chunk]
+    chunks = []
+    chunk_start = start_date
+    boundary = FUEL_SUMMARY_CHUNK_ANCHOR + ((start_date - FUEL_SUMMARY_CHUNK_ANCHOR) // length + 1) * length
+    while boundary <= end_date:
+        chunks.append((chunk_start, boundary - datetime.timedelta(seconds=1)))
+        chunk_start = boundary
+        boundary += length
+    if chunk_start < end_date or not chunks:
+        chunks.append((chunk_start, end_date))
+    return chunks
+
+# Зведення за весь період з зведень його частин (одна частина - без змін, зберігаючи точні значення API)
+def merge_chunk_summaries(summaries: list) -> dict:
+    return summaries[0] if len(summaries) == 1 else merge_fuel_summaries(summaries)
+
+# Зведення по паливу за період одним запитом fuel/summary.json
+def fetch_fuel_summary_range(client: MaponClient, unit_id: str, start_date: datetime.datetime, end_date: datetime.datetime):
+    try:
+        data = client.get_json('fuel/summary.json', _fuel_summary_params(unit_id, start_date, end_date), cacheable=True)
+        return _parse_fuel_summary(client, unit_id, data)
+    except requests.exceptions.RequestException as e:
+        print(f"Критична помилка при отриманні зведених даних палива для Unit ID {unit_id}: {e}")
+        client.error_budget.record_unit_failure(unit_id)
+        return empty_fuel_summary() # Повертаємо ініціалізований словник з None значеннями
+
+# Параметри запиту fuel/summary.json
+def _fuel_summary_params(unit_id: str, start_date: datetime.datetime, end_date: datetime.datetime) -> dict:
+    return {'unit_id': unit_id, 'from': format_datetime_for_mapon(start_date), 'till': format_datetime_for_mapon(end_date)}
 
-    fuel_summary = {
+# Зведення по паливу без даних
+def empty_fuel_summary() -> dict:
+    return {
         'refuelled_sensor': None, 'drained_sensor': None, 'consumed_sensor': None, 'avg_consumption_sensor': None,
         'refuelled_can_level': None, 'drained_can_level': None, 'consumed_can_level': None, 'avg_consumption_can_level': None,
         'refuelled_flow': None, 'drained_flow': None, 'consumed_flow': None, 'avg_consumption_flow': None 
     }
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-
-        if isinstance(data.get('data'), list) and len(data['data']) > 0:
-            unit_summary = data['data'][0]
-
-            # Дані Sensor
-            if 'sensor' in unit_summary:
-                if isinstance(unit_summary['sensor'].get('fueled'), (int, float)):
-                    fuel_summary['refuelled_sensor'] = round(unit_summary['sensor']['fueled'], 2)
-                if isinstance(unit_summary['sensor'].get('drained'), (int, float)):
-                    fuel_summary['drained_sensor'] = round(unit_summary['sensor']['drained'], 2)
-                if isinstance(unit_summary['sensor'].get('total_consumed'), (int, float)):
-                    fuel_summary['consumed_sensor'] = round(unit_summary['sensor']['total_consumed'], 2)
-                if isinstance(unit_summary['sensor'].get('avg_consumption'), (int, float)):
-                    fuel_summary['avg_consumption_sensor'] = round(unit_summary['sensor']['avg_consumption'], 2)
-            
-            # Дані CAN (рівень палива або інші зведені дані CAN)
-            if 'can' in unit_summary:
-                if isinstance(unit_summary['can'].get('fueled'), (int, float)):
-                    fuel_summary['refuelled_can_level'] = round(unit_summary['can']['fueled'], 2)
-                if isinstance(unit_summary['can'].get('drained'), (int, float)):
-                    fuel_summary['drained_can_level'] = round(unit_summary['can']['drained'], 2)
-                if isinstance(unit_summary['can'].get('total_consumed'), (int, float)):
-                    fuel_summary['consumed_can_level'] = round(unit_summary['can']['total_consumed'], 2)
-                if isinstance(unit_summary['can'].get('avg_consumption'), (int, float)):
-                    fuel_summary['avg_consumption_can_level'] = round(unit_summary['can']['avg_consumption'], 2)
-
-            # Дані FLOW (проточний датчик)
-            if 'flow' in unit_summary:
-                if isinstance(unit_summary['flow'].get('fueled'), (int, float)):
-                    fuel_summary['refuelled_flow'] = round(unit_summary['flow']['fueled'], 2)
-                if isinstance(unit_summary['flow'].get('drained'), (int, float)):
-                    fuel_summary['drained_flow'] = round(unit_summary['flow']['drained'], 2)
-                if isinstance(unit_summary['flow'].get('total_consumed'), (int, float)):
-                    fuel_summary['consumed_flow'] = round(unit_summary['flow']['total_consumed'], 2)
-                if isinstance(unit_summary['flow'].get('avg_consumption'), (int, float)):
-                    fuel_summary['avg_consumption_flow'] = round(unit_summary['flow']['avg_consumption'], 2)
-            
-            if not ('sensor' in unit_summary or 'can' in unit_summary or 'flow' in unit_summary):
-                print(f"[FuelSummary] Для Unit ID {unit_id} відсутні дані 'sensor', 'can' і 'flow' у відповіді fuel/summary.json.")
-
-            return fuel_summary
-        else:
-            return fuel_summary # Повертаємо ініціалізований словник з None значеннями
-    except requests.exceptions.RequestException as e:
-        print(f"Критична помилка при отриманні зведених даних палива для Unit ID {unit_id}: {e}")
+# Зведення по паливу з відповіді fuel/summary.json; наповнює метрики та профіль джерел палива юніта
+def _parse_fuel_summary(client: MaponClient, unit_id: str, data: dict) -> dict:
+    fuel_summary = empty_fuel_summary()
+
+    if isinstance(data.get('data'), list) and len(data['data']) > 0:
+        unit_summary = data['data'][0]
+
+        # Дані Sensor
+        if 'sensor' in unit_summary:
+            if isinstance(unit_summary['sensor'].get('fueled'), (int, float)):
+                fuel_summary['refuelled_sensor'] = round(unit_summary['sensor']['fueled'], 2)
+            if isinstance(unit_summary['sensor'].get('drained'), (int, float)):
+                fuel_summary['drained_sensor'] = round(unit_summary['sensor']['drained'], 2)
+            if isinstance(unit_summary['sensor'].get('total_consumed'), (int, float)):
+                fuel_summary['consumed_sensor'] = round(unit_summary['sensor']['total_consumed'], 2)
+            if isinstance(unit_summary['sensor'].get('avg_consumption'), (int, float)):
+                fuel_summary['avg_consumption_sensor'] = round(unit_summary['sensor']['avg_consumption'], 2)
+        
+        # Дані CAN (рівень палива або інші зведені дані CAN)
+        if 'can' in unit_summary:
+            if isinstance(unit_summary['can'].get('fueled'), (int, float)):
+                fuel_summary['refuelled_can_level'] = round(unit_summary['can']['fueled'], 2)
+            if isinstance(unit_summary['can'].get('drained'), (int, float)):
+                fuel_summary['drained_can_level'] = round(unit_summary['can']['drained'], 2)
+            if isinstance(unit_summary['can'].get('total_consumed'), (int, float)):
+                fuel_summary['consumed_can_level'] = round(unit_summary['can']['total_consumed'], 2)
+            if isinstance(unit_summary['can'].get('avg_consumption'), (int, float)):
+                fuel_summary['avg_consumption_can_level'] = round(unit_summary['can']['avg_consumption'], 2)
+
+        # Дані FLOW (проточний датчик)
+        if 'flow' in unit_summary:
+            if isinstance(unit_summary['flow'].get('fueled'), (int, float)):
+                fuel_summary['refuelled_flow'] = round(unit_summary['flow']['fueled'], 2)
+            if isinstance(unit_summary['flow'].get('drained'), (int, float)):
+                fuel_summary['drained_flow'] = round(unit_summary['flow']['drained'], 2)
+            if isinstance(unit_summary['flow'].get('total_consumed'), (int, float)):
+                fuel_summary['consumed_flow'] = round(unit_summary['flow']['total_consumed'], 2)
+            if isinstance(unit_summary['flow'].get('avg_consumption'), (int, float)):
+                fuel_summary['avg_consumption_flow'] = round(unit_summary['flow']['avg_consumption'], 2)
+        
+        for data_source in ('sensor', 'can', 'flow'):
+            client.metrics.record_result('fuel/summary.json', data_source, data_source not in unit_summary)
+        # Профіль джерел палива юніта: відсутнє джерело вважаємо таким, що не має даних,
+        # лише коли зведення містить інше джерело (інакше юніт міг просто не працювати в періоді)
+        present_sources = [data_source for data_source in FUEL_PROFILE_SOURCES if isinstance(unit_summary.get(data_source), dict)]
+        if present_sources:
+            for data_source in FUEL_PROFILE_SOURCES:
+                client.fuel_profiles.record((client.account, unit_id), data_source, data_source in present_sources)
+
+        if not ('sensor' in unit_summary or 'can' in unit_summary or 'flow' in unit_summary):
+            print(f"[FuelSummary] Для Unit ID {unit_id} відсутні дані 'sensor', 'can' і 'flow' у відповіді fuel/summary.json.")
+
+        return fuel_summary
+    else:
+        client.metrics.record_result('fuel/summary.json', None, True)
         return fuel_summary # Повертаємо ініціалізований словник з None значеннями
 
+# Ключі зведення по паливу для кожного джерела: (заправлено, злито, витрачено, середня витрата)
+FUEL_SUMMARY_SOURCE_KEYS = {
+    'sensor': ('refuelled_sensor', 'drained_sensor', 'consumed_sensor', 'avg_consumption_sensor'),
+    'can_level': ('refuelled_can_level', 'drained_can_level', 'consumed_can_level', 'avg_consumption_can_level'),
+    'flow': ('refuelled_flow', 'drained_flow', 'consumed_flow', 'avg_consumption_flow'),
+}
+
+
+# Об'єднання зведень по паливу за кілька суміжних періодів в одне.
+# Заправки, зливи й витрата сумуються; середня витрата - середнє avg періодів з вагою пробігу.
+# Пробіг періоду - з distances (наприклад, різниця одометрів доби), якщо він відомий, інакше
+# відновлюється як consumed / avg * 100. Періоди без пробігу (None або 0) у середнє не входять,
+# а нульова середня витрата за відомого пробігу входить як 0.
+def merge_fuel_summaries(summaries: list, distances: list = None) -> dict:
+    distances = distances or [None] * len(summaries)
+    merged = {}
+    for refuelled_key, drained_key, consumed_key, avg_key in FUEL_SUMMARY_SOURCE_KEYS.values():
+        for key in (refuelled_key, drained_key, consumed_key):
+            values = [summary.get(key) for summary in summaries if summary.get(key) is not None]
+            merged[key] = round(sum(values), 2) if values else None
+
+        weighted_avg = 0.0
+        weighted_distance = 0.0
+        for summary, distance in zip(summaries, distances):
+            consumed = summary.get(consumed_key)
+            avg = summary.get(avg_key)
+            if not isinstance(avg, (int, float)):
+                continue
+            if not isinstance(distance, (int, float)):
+                distance = consumed / avg * 100 if isinstance(consumed, (int, float)) and avg > 0 else None
+            if distance is None or distance <= 0:
+                continue
+            weighted_avg += avg * distance
+            weighted_distance += distance
+        merged[avg_key] = round(weighted_avg / weighted_distance, 2) if weighted_distance > 0 else None
+    return merged
+
+
 # Допоміжна функція для перетворення timestamp в datetime в UTC (можливо, не потрібна, якщо використовуємо datetime об'єкти з pytz.utc)
 def datetime_from_utc_timestamp(ts: float) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(ts, tz=pytz.utc)
 
 
-# Основна функція, яка буде запускатися (потім інтегруємо в Streamlit)
-def get_fleet_odometer_and_fuel_data(api_key: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> pd.DataFrame:
-    
-    # Переконаємося, що дати в UTC
-    if start_datetime.tzinfo is None:
-        start_datetime = pytz.utc.localize(start_datetime)
-    else:
-        start_datetime = start_datetime.astimezone(pytz.utc)
-    
-    if end_datetime.tzinfo is None:
-        end_datetime = pytz.utc.localize(end_datetime)
-    else:
-        end_datetime = end_datetime.astimezone(pytz.utc)
+# Кількість паралельних потоків за замовчуванням для паралельного режиму звіту
+DEFAULT_MAX_WORKERS = 8
 
 
-    if start_datetime > end_datetime:
-        print("Помилка: Дата і час початку періоду не може бути пізніше дати і часу закінчення.")
-        return pd.DataFrame()
+# Назва юніта для звіту: номер, мітка або ID
+def get_unit_name(unit: dict) -> str:
+    return unit.get('number') or unit.get('label') or f"Unit {unit['unit_id']}"
 
-    filtered_units = get_unit_list(api_key)
-    if not filtered_units:
-        return pd.DataFrame()
 
-    results = []
+# Формує рядок звіту для одного юніта з уже отриманих даних API.
+# Числа - float (NaN, якщо даних немає); причина відсутності пробігу чи середньої витрати - у полях статусу.
+def build_unit_row(unit_name: str, odometer_start, odometer_end, fuel_level_start, fuel_level_end, fuel_summary_data: dict, unit_id=None) -> UnitReportRow:
+    row = UnitReportRow(
+        unit_name=unit_name,
+        unit_id=unit_id,
+        odometer_start=to_float(odometer_start),
+        odometer_end=to_float(odometer_end),
+        fuel_level_start=to_float(fuel_level_start),
+        fuel_level_end=to_float(fuel_level_end),
+    )
+    current_numeric_distance = 0.0
+
+    if isinstance(odometer_start, (int, float)) and isinstance(odometer_end, (int, float)):
+        numeric_distance_calc = odometer_end - odometer_start
+        if numeric_distance_calc < 0:
+            row.distance_status = STATUS_RESET # Скидання одометра; для розрахунків вважаємо пробіг 0
+        else:
+            row.distance = round(numeric_distance_calc, 2)
+            row.distance_status = STATUS_OK
+            current_numeric_distance = row.distance
+
+    # Обробка даних Sensor
+    consumed_sensor_numeric = fuel_summary_data.get('consumed_sensor')
+    row.consumed_sensor = to_float(consumed_sensor_numeric)
+
+    # Спочатку перевіряємо, чи Mapon API вже надав avg_consumption для сенсора
+    if fuel_summary_data.get('avg_consumption_sensor') is not None:
+        row.avg_consumption_sensor = to_float(fuel_summary_data.get('avg_consumption_sensor'))
+        row.avg_consumption_sensor_status = STATUS_OK
+    # Якщо ні, і є витрата та пробіг, обчислюємо вручну
+    elif isinstance(consumed_sensor_numeric, (int, float)) and consumed_sensor_numeric >= 0:
+       if current_numeric_distance > 0:
+           row.avg_consumption_sensor = round((consumed_sensor_numeric / current_numeric_distance) * 100, 2)
+           row.avg_consumption_sensor_status = STATUS_OK
+       elif consumed_sensor_numeric > 0 and current_numeric_distance == 0:
+           row.avg_consumption_sensor_status = STATUS_NO_DISTANCE # Якщо є витрата, але немає пробігу
+       else:
+           row.avg_consumption_sensor = 0.0 # Витрата 0
+           row.avg_consumption_sensor_status = STATUS_OK
+
+    # Обробка даних CAN Flow
+    row.consumed_flow = to_float(fuel_summary_data.get('consumed_flow'))
+    row.avg_consumption_flow = to_float(fuel_summary_data.get('avg_consumption_flow')) # Беремо готове значення з API
+
+    # Визначаємо загальні заправки/зливи, надаючи пріоритет sensor, потім flow, потім can_level
+    # Цей порядок можна налаштувати за потребою
+    for source in ('sensor', 'flow', 'can_level'):
+        if fuel_summary_data.get(f'refuelled_{source}') is not None:
+            row.refuelled = to_float(fuel_summary_data.get(f'refuelled_{source}'))
+            break
+    for source in ('sensor', 'flow', 'can_level'):
+        if fuel_summary_data.get(f'drained_{source}') is not None:
+            row.drained = to_float(fuel_summary_data.get(f'drained_{source}'))
+            break
+
+    return row
+
+
+# Сирі дані одного юніта за період (до форматування рядка звіту)
+def _unit_data(current_unit: dict, odometer_start, odometer_end, fuel_level_start, fuel_level_end, fuel_summary_data: dict) -> dict:
+    return {
+        'unit_id': current_unit['unit_id'],
+        'unit_name': get_unit_name(current_unit),
+        'odometer_start': odometer_start,
+        'odometer_end': odometer_end,
+        'fuel_level_start': fuel_level_start,
+        'fuel_level_end': fuel_level_end,
+        'fuel_summary_data': fuel_summary_data,
+    }
+
+
+# Рядок звіту із сирих даних юніта
+def build_unit_row_from_data(unit_data: dict) -> UnitReportRow:
+    return build_unit_row(
+        unit_data['unit_name'], unit_data['odometer_start'], unit_data['odometer_end'],
+        unit_data['fuel_level_start'], unit_data['fuel_level_end'], unit_data['fuel_summary_data'], unit_data['unit_id']
+    )
+
 
-    for current_unit in filtered_units:
+# Послідовна обробка юнітів (один запит за раз); видає (індекс юніта, дані) по мірі готовності
+def _iter_unit_data_serial(client: MaponClient, units: list, start_datetime: datetime.datetime, end_datetime: datetime.datetime, odometers_start: dict, odometers_end: dict):
+    for index, current_unit in enumerate(units):
         current_unit_id = current_unit['unit_id']
-        unit_name = current_unit.get('number') or current_unit.get('label') or f"Unit {current_unit_id}"
+        unit_name = get_unit_name(current_unit)
 
         print(f"--- Починаємо обробку юніта: {unit_name} (ID: {current_unit_id}) ---")
 
-        odometer_start = fetch_odometer(api_key, current_unit_id, start_datetime)
-        odometer_end = fetch_odometer(api_key, current_unit_id, end_datetime)
+        # Зведення першим: воно наповнює профіль джерел палива, і пошук рівня палива одразу йде до потрібного джерела
+        fuel_summary_data = fetch_fuel_summary_data(client, current_unit_id, start_datetime, end_datetime)
+        fuel_level_start = fetch_fuel_level(client, current_unit_id, start_datetime, 'start')
+        fuel_level_end = fetch_fuel_level(client, current_unit_id, end_datetime, 'end')
+
+        yield index, _unit_data(current_unit, odometers_start.get(current_unit_id), odometers_end.get(current_unit_id), fuel_level_start, fuel_level_end, fuel_summary_data)
+
+
+# Чи відомо з профілю, які джерела рівня палива юніта мають дані (тоді пошук не робить зайвих запитів)
+def _fuel_level_profile_known(client: MaponClient, unit_id: str) -> bool:
+    profile = client.fuel_profiles.get((client.account, unit_id))
+    return all(profile.get(data_source) is not None for data_source in FUEL_LEVEL_SOURCES)
+
+
+# Рівень палива після першої готової частини зведення юніта: зведення записує профіль джерел,
+# і пошук рівня одразу йде до джерела з даними (як у послідовному режимі)
+def _fetch_fuel_level_after_summary(summary_futures: list, client: MaponClient, unit_id: str, target_datetime: datetime.datetime, fuel_type: str):
+    wait(summary_futures, return_when=FIRST_COMPLETED)
+    return fetch_fuel_level(client, unit_id, target_datetime, fuel_type)
+
+
+# Паралельна обробка: усі незалежні запити всіх юнітів ставляться в один пул потоків.
+# Один спільний пул (а не вкладені пули на юніт) не дає потокам блокувати один одного.
+# Спершу в чергу йдуть зведення всіх юнітів, потім пошуки рівня палива: для юніта з невідомим профілем
+# джерел пошук чекає на його зведення, тож профіль, отриманий у цьому ж звіті, уже відсікає порожні джерела.
+# Черга пулу - FIFO, тож на момент старту пошуку зведення юніта вже виконується або готове.
+# Юніт видається, щойно завершились усі його запити; індекс дозволяє відновити початковий порядок юнітів,
+# тож зібраний результат такий самий, як у послідовному режимі.
+def _iter_unit_data_parallel(client: MaponClient, units: list, start_datetime: datetime.datetime, end_datetime: datetime.datetime, odometers_start: dict, odometers_end: dict, max_workers: int):
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mapon') as executor:
+        unit_futures = [{} for _ in units]
+        future_to_index = {}
+        # Частини зведення по паливу (див. fuel_summary_chunks) - окремі завдання в тому ж пулі
+        summary_chunks = fuel_summary_chunks(start_datetime, end_datetime, client.fuel_summary_chunk)
+        for index, current_unit in enumerate(units):
+            for chunk_index, (chunk_start, chunk_end) in enumerate(summary_chunks):
+                unit_futures[index][('fuel_summary', chunk_index)] = executor.submit(fetch_fuel_summary_range, client, current_unit['unit_id'], chunk_start, chunk_end)
+        for index, current_unit in enumerate(units):
+            current_unit_id = current_unit['unit_id']
+            futures = unit_futures[index]
+            if _fuel_level_profile_known(client, current_unit_id):
+                futures['fuel_level_start'] = executor.submit(fetch_fuel_level, client, current_unit_id, start_datetime, 'start')
+                futures['fuel_level_end'] = executor.submit(fetch_fuel_level, client, current_unit_id, end_datetime, 'end')
+            else:
+                summary_futures = list(futures.values())
+                futures['fuel_level_start'] = executor.submit(_fetch_fuel_level_after_summary, summary_futures, client, current_unit_id, start_datetime, 'start')
+                futures['fuel_level_end'] = executor.submit(_fetch_fuel_level_after_summary, summary_futures, client, current_unit_id, end_datetime, 'end')
+            for future in futures.values():
+                future_to_index[future] = index
+
+        pending_counts = [len(futures) for futures in unit_futures]
+        for future in as_completed(future_to_index):
+            index = future_to_index[future]
+            pending_counts[index] -= 1
+            if pending_counts[index]:
+                continue
+            current_unit = units[index]
+            current_unit_id = current_unit['unit_id']
+            values = {name: unit_future.result() for name, unit_future in unit_futures[index].items()}
+            fuel_summary_data = merge_chunk_summaries([values[('fuel_summary', chunk_index)] for chunk_index in range(len(summary_chunks))])
+            print(f"--- Юніт оброблено: {get_unit_name(current_unit)} ---")
+            yield index, _unit_data(current_unit, odometers_start.get(current_unit_id), odometers_end.get(current_unit_id), values['fuel_level_start'], values['fuel_level_end'], fuel_summary_data)
+
+
+# Переведення дати в UTC (дати без часового поясу вважаються UTC)
+def ensure_utc(dt_object: datetime.datetime) -> datetime.datetime:
+    if dt_object.tzinfo is None:
+        return pytz.utc.localize(dt_object)
+    return dt_object.astimezone(pytz.utc)
+
+
+# Потік сирих даних юнітів за період: (індекс юніта в units, дані) у порядку готовності
+def iter_fleet_unit_data(client: MaponClient, units: list, start_datetime: datetime.datetime, end_datetime: datetime.datetime, max_workers: int = None):
+    # Одометри на початок і кінець періоду - двома запитами на весь автопарк
+    unit_ids = [unit['unit_id'] for unit in units]
+    odometers_start = fetch_odometer_snapshot(client, start_datetime, unit_ids, max_workers)
+    odometers_end = fetch_odometer_snapshot(client, end_datetime, unit_ids, max_workers)
+
+    if max_workers and max_workers > 1:
+        return _iter_unit_data_parallel(client, units, start_datetime, end_datetime, odometers_start, odometers_end, max_workers)
+    return _iter_unit_data_serial(client, units, start_datetime, end_datetime, odometers_start, odometers_end)
+
+
+# Сирі дані всіх переданих юнітів за період: одометри, рівні палива та зведення по паливу (в порядку units).
+# Використовується сховищем щоденних агрегатів (daily_aggregates.py).
+# progress_callback(done, total) викликається після обробки кожного юніта.
+def collect_fleet_unit_data(client: MaponClient, units: list, start_datetime: datetime.datetime, end_datetime: datetime.datetime, max_workers: int = None, progress_callback=None) -> list:
+    results = [None] * len(units)
+    for done, (index, data) in enumerate(iter_fleet_unit_data(client, units, start_datetime, end_datetime, max_workers), start=1):
+        results[index] = data
+        if progress_callback:
+            progress_callback(done, len(units))
+    return results
+
+
+# Потоковий звіт: видає (індекс рядка, кількість юнітів, рядок звіту) для кожного юніта, щойно він готовий.
+# Рядки приходять у порядку готовності; індекс - позиція рядка в повному звіті.
+# unit_ids: лише ці юніти (None - увесь акаунт); exclude_inactive: пропустити юніти без даних з початку періоду
+def iter_fleet_report_rows(client: MaponClient, start_datetime: datetime.datetime, end_datetime: datetime.datetime, max_workers: int = None, unit_ids=None, exclude_inactive: bool = False):
+    # Переконаємося, що дати в UTC
+    start_datetime = ensure_utc(start_datetime)
+    end_datetime = ensure_utc(end_datetime)
 
-        distance = None
-        current_numeric_distance = 0.0
+    if start_datetime > end_datetime:
+        print("Помилка: Дата і час початку періоду не може бути пізніше дати і часу закінчення.")
+        return
 
-        if isinstance(odometer_start, (int, float)) and isinstance(odometer_end, (int, float)):
-            numeric_distance_calc = odometer_end - odometer_start
-            if numeric_distance_calc < 0:
-                distance = f"Скидання ({round(numeric_distance_calc, 2)} км)" # Вказуємо, що це скидання
-                current_numeric_distance = 0.0 # Для розрахунків вважаємо пробіг 0
-            else:
-                distance = round(numeric_distance_calc, 2)
-                current_numeric_distance = distance
-        else:
-            distance = "Немає даних для розрахунку"
-            current_numeric_distance = 0.0
+    filtered_units = select_report_units(client, unit_ids, start_datetime if exclude_inactive else None)
+    if not filtered_units:
+        return
 
+    for index, data in iter_fleet_unit_data(client, filtered_units, start_datetime, end_datetime, max_workers):
+        yield index, len(filtered_units), build_unit_row_from_data(data)
 
-        fuel_level_start = fetch_fuel_level(api_key, current_unit_id, start_datetime, 'start')
-        fuel_level_end = fetch_fuel_level(api_key, current_unit_id, end_datetime, 'end')
-        
-        fuel_summary_data = fetch_fuel_summary_data(api_key, current_unit_id, start_datetime, end_datetime)
 
-        # Обробка даних Sensor
-        consumed_sensor_numeric = fuel_summary_data.get('consumed_sensor')
-        average_consumption_sensor = None
-        
-        # Спочатку перевіряємо, чи Mapon API вже надав avg_consumption для сенсора
-        if fuel_summary_data.get('avg_consumption_sensor') is not None:
-            average_consumption_sensor = fuel_summary_data.get('avg_consumption_sensor')
-        # Якщо ні, і є витрата та пробіг, обчислюємо вручну
-        elif isinstance(consumed_sensor_numeric, (int, float)) and consumed_sensor_numeric >= 0:
-           if current_numeric_distance > 0:
-               average_consumption_sensor = round((consumed_sensor_numeric / current_numeric_distance) * 100, 2)
-           elif consumed_sensor_numeric > 0 and current_numeric_distance == 0:
-               average_consumption_sensor = 'Немає пробігу' # Якщо є витрата, але немає пробігу
-           else:
-               average_consumption_sensor = 0.0 if consumed_sensor_numeric is not None else None # Якщо витрата 0 або None
-
-        # Обробка даних CAN Flow
-        total_consumed_flow = fuel_summary_data.get('consumed_flow')
-        average_consumption_flow = fuel_summary_data.get('avg_consumption_flow') # Беремо готове значення з API
-
-        # Визначаємо загальні заправки/зливи, надаючи пріоритет sensor, потім flow, потім can_level
-        # Цей порядок можна налаштувати за потребою
-        refuelled_overall = None
-        if fuel_summary_data.get('refuelled_sensor') is not None:
-            refuelled_overall = fuel_summary_data.get('refuelled_sensor')
-        elif fuel_summary_data.get('refuelled_flow') is not None:
-            refuelled_overall = fuel_summary_data.get('refuelled_flow')
-        elif fuel_summary_data.get('refuelled_can_level') is not None:
-            refuelled_overall = fuel_summary_data.get('refuelled_can_level')
-        
-        drained_overall = None
-        if fuel_summary_data.get('drained_sensor') is not None:
-            drained_overall = fuel_summary_data.get('drained_sensor')
-        elif fuel_summary_data.get('drained_flow') is not None:
-            drained_overall = fuel_summary_data.get('drained_flow')
-        elif fuel_summary_data.get('drained_can_level') is not None:
-            drained_overall = fuel_summary_data.get('drained_can_level')
-
-
-        results.append({
-            'Номер Автомобіля': unit_name,
-            'Одометр CAN (початок)': odometer_start,
-            'Одометр CAN (кінець)': odometer_end,
-            'Пробіг (CAN, км)': distance,
-            'Паливо в баку (початок, л)': fuel_level_start,
-            'Паливо в баку (кінець, л)': fuel_level_end,   
-            'Заправлено за період (л)': refuelled_overall, 
-            'Зливи за період (л)': drained_overall,         
-            'Витрата (датчик рівня, л)': consumed_sensor_numeric, 
-            'Середня витрата (датчик рівня, л/100км)': average_consumption_sensor, 
-            'Витрата (CAN Flow, л)': total_consumed_flow, 
-            'Середня витрата (CAN Flow, л/100км)': average_consumption_flow 
-        })
-    
-    df = pd.DataFrame(results)
+# Основна функція, яка буде запускатися (потім інтегруємо в Streamlit)
+# client: MaponClient, створений один раз на звіт (спільний пул з'єднань)
+# max_workers: None або 1 - послідовний режим, більше 1 - паралельний режим з обмеженням кількості потоків
+# (пул з'єднань клієнта варто робити не меншим за max_workers)
+# progress_callback(done, total): необов'язковий колбек прогресу по юнітах (для фонових завдань)
+# row_callback(index, row): необов'язковий колбек, що отримує кожен рядок, щойно він готовий
+# unit_ids, exclude_inactive: фільтр юнітів (див. select_report_units) - запити робляться лише для обраних юнітів
+def get_fleet_odometer_and_fuel_data(client: MaponClient, start_datetime: datetime.datetime, end_datetime: datetime.datetime, max_workers: int = None, progress_callback=None, row_callback=None, unit_ids=None, exclude_inactive: bool = False) -> pd.DataFrame:
+    rows = {}
+    for index, total, row in iter_fleet_report_rows(client, start_datetime, end_datetime, max_workers, unit_ids, exclude_inactive):
+        rows[index] = row
+        if row_callback:
+            row_callback(index, row)
+        if progress_callback:
+            progress_callback(len(rows), total)
+
+    results = [rows[index] for index in sorted(rows)]
+    df = rows_to_dataframe(results)
     return df
- 
-    # Дати та час у UTC для прикладу
-    # 31 травня 21:00:00 UTC = 1 червня 00:00:00 Київ
-    start_date_example = datetime.datetime(2025, 5, 31, 21, 0, 0, tzinfo=pytz.utc) 
-    # 2 червня 20:59:59 UTC = 2 червня 23:59:59 Київ
-    end_date_example = datetime.datetime(2025, 6, 2, 20, 59, 59, tzinfo=pytz.utc) 
-
-    print(f"Запускаємо отримання даних з {start_date_example} по {end_date_example}")
-    
-    final_df = get_fleet_odometer_and_fuel_data(API_KEY, start_date_example, end_date_example)
-    print("\n--- Результати ---")
-    print(final_df)
-    
-    # Збереження в Excel (приклад)
-    # final_df.to_excel("fleet_report.xlsx", index=False)
-    # print("Звіт збережено до fleet_report.xlsx")
@@ -0,0 +1,326 @@
+import asyncio
+import datetime
+import json
+import time
+import aiohttp
+import pandas as pd
+import pytz # Для роботи з часовими поясами
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from mapon_cache import ResponseCache, account_hash
+from request_governor import RequestGovernor, ErrorBudget, get_request_governor
+from fuel_series import FuelSeries, FuelSeriesStore, DEFAULT_FUEL_SERIES_STORE
+from fuel_profiles import FuelSourceProfileStore, DEFAULT_FUEL_PROFILE_STORE
+from unit_directory import UnitDirectoryCache, DEFAULT_UNIT_DIRECTORY_CACHE
+from mapon_metrics import ClientMetrics
+from report_schema import rows_to_dataframe
+from mapon_api_client import (
+    MAPON_API_BASE_URL, DEFAULT_TIMEOUT, FUEL_LOOKUP_DAY, FuelSeriesRequest, fuel_level_lookup,
+    format_datetime_for_mapon, ensure_utc, utc_day_bounds, get_unit_name, build_unit_row_from_data, empty_fuel_summary,
+    fuel_summary_chunks, merge_chunk_summaries,
+    _parse_unit_list, _filter_report_units, _parse_odometer, _parse_odometer_snapshot, _fuel_series_params,
+    _parse_fuel_series_data, _fuel_summary_params, _parse_fuel_summary, _unit_data
+)
+
+# Асинхронний клієнт Mapon API: ті самі запити й розбір відповідей, що й у mapon_api_client.py,
+# але на одному event loop - сотні запитів одночасно без потоку на кожен запит.
+# Помилки запитів - ті самі requests.exceptions.RequestException, що й у синхронного клієнта.
+
+# Максимум одночасних запитів (і з'єднань) одного клієнта за замовчуванням
+DEFAULT_MAX_CONCURRENCY = 64
+
+
+# Асинхронний клієнт Mapon API: одна aiohttp сесія на звіт, кількість одночасних запитів обмежена семафором
+# (і пулом з'єднань того ж розміру). Ліміт швидкості, адаптивна паралельність і повтори - через той самий
+# RequestGovernor API ключа, що й у MaponClient (governor, за замовчуванням спільний для ключа), тож
+# синхронні та асинхронні звіти одного ключа разом не перевищують його ліміти.
+# Кеші та профілі (cache, fuel_series_store, fuel_profiles, unit_directory) - ті самі, що й у MaponClient,
+# тож синхронні та асинхронні звіти процесу ділять уже завантажені дані.
+# Використання: async with AsyncMaponClient(api_key) as client: ...
+class AsyncMaponClient:
+    def __init__(self, api_key: str, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT, base_url: str = MAPON_API_BASE_URL, cache: ResponseCache = None, fuel_series_store: FuelSeriesStore = None, fuel_profiles: FuelSourceProfileStore = None, fuel_lookup: str = FUEL_LOOKUP_DAY, unit_directory: UnitDirectoryCache = None, governor: RequestGovernor = None, error_budget: ErrorBudget = None, metrics: ClientMetrics = None, fuel_summary_chunk: str = None):
+        self.api_key = api_key
+        self.account = account_hash(api_key)
+        self.cache = cache
+        self.fuel_series_store = fuel_series_store if fuel_series_store is not None else DEFAULT_FUEL_SERIES_STORE
+        self.fuel_profiles = fuel_profiles if fuel_profiles is not None else DEFAULT_FUEL_PROFILE_STORE
+        self.fuel_lookup = fuel_lookup
+        self.unit_directory = unit_directory if unit_directory is not None else DEFAULT_UNIT_DIRECTORY_CACHE
+        self.governor = governor if governor is not None else get_request_governor(api_key)
+        self.error_budget = error_budget if error_budget is not None else ErrorBudget()
+        self.metrics = metrics if metrics is not None else ClientMetrics()
+        self.fuel_summary_chunk = fuel_summary_chunk
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.base_url = base_url.rstrip('/')
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = {} # ключ -> Task завантаження, на який чекають усі однакові запити
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'Accept-Encoding': 'gzip, deflate'},
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # GET-запит до ендпоінта Mapon з повторами (через RequestGovernor); повертає тіло відповіді (bytes).
+    # Остаточна помилка - requests.exceptions.HTTPError / ConnectionError, як у синхронного клієнта.
+    async def get(self, endpoint: str, params: dict = None) -> bytes:
+        query = {'key': self.api_key}
+        if params:
+            query.update(params)
+        url = f"{self.base_url}/{endpoint}"
+
+        # Одна спроба: відповідь aiohttp у вигляді requests.Response (статус, заголовки, тіло), щоб
+        # регулятор обробляв її так само, як відповіді синхронного клієнта
+        async def send() -> requests.Response:
+            async with self._semaphore:
+                try:
+                    async with self.session.get(url, params=query) as aiohttp_response:
+                        response = requests.Response()
+                        response._content = await aiohttp_response.read()
+                        response.status_code = aiohttp_response.status
+                        response.reason = aiohttp_response.reason
+                        response.headers = CaseInsensitiveDict(aiohttp_response.headers)
+                        response.url = str(aiohttp_response.url)
+                        return response
+                except asyncio.TimeoutError as e:
+                    raise requests.exceptions.Timeout(f"{endpoint}: {e}")
+                except aiohttp.ClientError as e:
+                    raise requests.exceptions.ConnectionError(f"{type(e).__name__}: {e}")
+
+        response = await self.governor.execute_async(send, self.error_budget, endpoint)
+        return response.content
+
+    # GET-запит з розбором JSON і кешем відповідей - як MaponClient.get_json.
+    # ResponseCache - локальний SQLite, його короткі звернення виконуються прямо в loop.
+    async def get_json(self, endpoint: str, params: dict = None, cacheable: bool = False) -> dict:
+        params = params or {}
+        source = params.get('data_source')
+        use_cache = cacheable and self.cache is not None
+        if use_cache:
+            key = ResponseCache.make_key(self.account, endpoint, params)
+            cached_text = self.cache.get(key)
+            if cached_text is not None:
+                self.metrics.record_cache_hit(endpoint, source)
+                started = time.perf_counter()
+                data = json.loads(cached_text)
+                self.metrics.record_parse(endpoint, source, time.perf_counter() - started)
+                return data
+
+        started = time.perf_counter()
+        try:
+            body = await self.get(endpoint, params)
+        except requests.exceptions.RequestException:
+            self.metrics.record_request(endpoint, source, time.perf_counter() - started, 0, error=True)
+            raise
+        self.metrics.record_request(endpoint, source, time.perf_counter() - started, len(body))
+
+        started = time.perf_counter()
+        # Тіло не JSON - RequestException, як response.json() у синхронному клієнті
+        try:
+            text = body.decode('utf-8')
+            data = json.loads(text)
+        except ValueError as e:
+            raise requests.exceptions.InvalidJSONError(f"{endpoint}: відповідь не є JSON: {e}")
+        self.metrics.record_parse(endpoint, source, time.perf_counter() - started)
+        # Відповіді з помилкою API не кешуємо
+        if use_cache and isinstance(data, dict) and 'error' not in data:
+            self.cache.put(key, endpoint, params, text)
+        return data
+
+    # Однакові одночасні завантаження (наприклад, добова серія палива для початку й кінця періоду)
+    # виконуються один раз: інші корутини чекають на той самий Task
+    async def single_flight(self, key: tuple, load):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+
+# Список юнітів (з кешу довідників клієнта, див. unit_directory.py)
+async def get_unit_list(client: AsyncMaponClient) -> list:
+    key = (client.account, 'units')
+    units = client.unit_directory.get(key)
+    if units is None:
+        units = await client.single_flight(key, lambda: _load_unit_list(client))
+    return list(units)
+
+async def _load_unit_list(client: AsyncMaponClient) -> list:
+    try:
+        units = _parse_unit_list(await client.get_json('unit/list.json'))
+    except requests.exceptions.RequestException as e:
+        print(f"Критична помилка при отриманні списку юнітів: {e}")
+        return []
+    client.unit_directory.put((client.account, 'units'), units)
+    return units
+
+# Юніти для звіту (див. mapon_api_client.select_report_units)
+async def select_report_units(client: AsyncMaponClient, unit_ids=None, active_since: datetime.datetime = None) -> list:
+    return _filter_report_units(await get_unit_list(client), unit_ids, active_since)
+
+# Одометр CAN юніта на момент datetime_obj (None - немає даних або помилка)
+async def fetch_odometer(client: AsyncMaponClient, unit_id: str, datetime_obj: datetime.datetime):
+    formatted_date = format_datetime_for_mapon(datetime_obj)
+    try:
+        data = await client.get_json('unit_data/can_point.json', {'unit_id': unit_id, 'datetime': formatted_date}, cacheable=True)
+        return _parse_odometer(client, data)
+    except requests.exceptions.RequestException as e:
+        print(f"[Odometer] Помилка при отриманні одометра CAN для Unit ID {unit_id} на {formatted_date}: {e}")
+        client.error_budget.record_unit_failure(unit_id)
+        return None
+
+# Знімок одометрів автопарку одним запитом; юніти, яких немає у відповіді, доотримуються паралельно
+async def fetch_odometer_snapshot(client: AsyncMaponClient, datetime_obj: datetime.datetime, unit_ids: list) -> dict:
+    formatted_date = format_datetime_for_mapon(datetime_obj)
+    snapshot = {}
+    try:
+        data = await client.get_json('unit_data/can_point.json', {'datetime': formatted_date}, cacheable=True)
+        snapshot = _parse_odometer_snapshot(client, data)
+    except requests.exceptions.RequestException as e:
+        print(f"[Odometer] Помилка при отриманні знімка одометрів автопарку на {formatted_date}: {e}")
+
+    missing_unit_ids = [unit_id for unit_id in unit_ids if unit_id not in snapshot]
+    if missing_unit_ids:
+        print(f"[Odometer] Знімок на {formatted_date}: {len(unit_ids) - len(missing_unit_ids)} юнітів з одного запиту, {len(missing_unit_ids)} доотримуємо окремо.")
+        values = await asyncio.gather(*(fetch_odometer(client, unit_id, datetime_obj) for unit_id in missing_unit_ids))
+        snapshot.update(zip(missing_unit_ids, values))
+    return {unit_id: snapshot.get(unit_id) for unit_id in unit_ids}
+
+# Серія рівня палива юніта з fuel/data.json за проміжок [start, end] (UTC)
+async def get_fuel_series(client: AsyncMaponClient, unit_id: str, data_source: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> FuelSeries:
+    data = await client.get_json('fuel/data.json', _fuel_series_params(unit_id, data_source, start_datetime, end_datetime), cacheable=True)
+    return _parse_fuel_series_data(client, data, data_source)
+
+# Добова (UTC) серія рівня палива зі сховища серій клієнта
+async def get_fuel_series_for_day(client: AsyncMaponClient, unit_id: str, data_source: str, day: datetime.date) -> FuelSeries:
+    key = (client.account, unit_id, data_source, day)
+    series = client.fuel_series_store.get(key)
+    if series is not None:
+        return series
+
+    async def load():
+        loaded = await get_fuel_series(client, unit_id, data_source, *utc_day_bounds(day))
+        client.fuel_series_store.put(key, day, loaded)
+        return loaded
+
+    return await client.single_flight(key, load)
+
+# Серія для запиту пошуку рівня палива (див. mapon_api_client._load_fuel_lookup_series)
+async def _load_fuel_lookup_series(client: AsyncMaponClient, unit_id: str, request: FuelSeriesRequest) -> FuelSeries:
+    if request.day is not None:
+        return await get_fuel_series_for_day(client, unit_id, request.data_source, request.day)
+    return await get_fuel_series(client, unit_id, request.data_source, request.start, request.end)
+
+# Рівень палива на момент target_datetime - той самий пошук mapon_api_client.fuel_level_lookup,
+# серії завантажуються асинхронно
+async def fetch_fuel_level(client: AsyncMaponClient, unit_id: str, target_datetime: datetime.datetime, fuel_type: str):
+    lookup = fuel_level_lookup(client, unit_id, target_datetime.astimezone(pytz.utc), fuel_type)
+    try:
+        request = next(lookup)
+        while True:
+            request = lookup.send(await _load_fuel_lookup_series(client, unit_id, request))
+    except StopIteration as result:
+        return result.value
+    except requests.exceptions.RequestException as e:
+        print(f"[FuelLevel] Критична помилка при отриманні рівня палива для Unit ID {unit_id} (тип: {fuel_type}) на {format_datetime_for_mapon(target_datetime)} : {e}")
+        client.error_budget.record_unit_failure(unit_id)
+    return None
+
+# Зведення по паливу (заправки, зливи, витрата) за період; частини періоду (fuel_summary_chunk) - одночасно
+async def fetch_fuel_summary_data(client: AsyncMaponClient, unit_id: str, start_date: datetime.datetime, end_date: datetime.datetime) -> dict:
+    chunks = fuel_summary_chunks(start_date, end_date, client.fuel_summary_chunk)
+    return merge_chunk_summaries(await asyncio.gather(*(fetch_fuel_summary_range(client, unit_id, chunk_start, chunk_end) for chunk_start, chunk_end in chunks)))
+
+# Зведення по паливу за період одним запитом fuel/summary.json
+async def fetch_fuel_summary_range(client: AsyncMaponClient, unit_id: str, start_date: datetime.datetime, end_date: datetime.datetime) -> dict:
+    try:
+        data = await client.get_json('fuel/summary.json', _fuel_summary_params(unit_id, start_date, end_date), cacheable=True)
+        return _parse_fuel_summary(client, unit_id, data)
+    except requests.exceptions.RequestException as e:
+        print(f"Критична помилка при отриманні зведених даних палива для Unit ID {unit_id}: {e}")
+        client.error_budget.record_unit_failure(unit_id)
+        return empty_fuel_summary()
+
+
+# Дані одного юніта: спершу зведення (воно наповнює профіль джерел палива), потім рівні палива на початок
+# і кінець періоду одночасно. Паралельність між юнітами забезпечує сам loop.
+async def _fetch_unit_data(client: AsyncMaponClient, unit: dict, start_datetime: datetime.datetime, end_datetime: datetime.datetime, odometers_start: dict, odometers_end: dict) -> dict:
+    unit_id = unit['unit_id']
+    fuel_summary_data = await fetch_fuel_summary_data(client, unit_id, start_datetime, end_datetime)
+    fuel_level_start, fuel_level_end = await asyncio.gather(
+        fetch_fuel_level(client, unit_id, start_datetime, 'start'),
+        fetch_fuel_level(client, unit_id, end_datetime, 'end'),
+    )
+    return _unit_data(unit, odometers_start.get(unit_id), odometers_end.get(unit_id), fuel_level_start, fuel_level_end, fuel_summary_data)
+
+
+# Звіт по автопарку за період (див. mapon_api_client.get_fleet_odometer_and_fuel_data).
+# Усі юніти обробляються одночасно; кількість запитів у польоті обмежує семафор клієнта.
+# progress_callback(done, total) і row_callback(index, row) викликаються в потоці loop.
+async def get_fleet_odometer_and_fuel_data(client: AsyncMaponClient, start_datetime: datetime.datetime, end_datetime: datetime.datetime, progress_callback=None, row_callback=None, unit_ids=None, exclude_inactive: bool = False) -> pd.DataFrame:
+    start_datetime = ensure_utc(start_datetime)
+    end_datetime = ensure_utc(end_datetime)
+    if start_datetime > end_datetime:
+        print("Помилка: Дата і час початку періоду не може бути пізніше дати і часу закінчення.")
+        return pd.DataFrame()
+
+    units = await select_report_units(client, unit_ids, start_datetime if exclude_inactive else None)
+    if not units:
+        return pd.DataFrame()
+
+    report_unit_ids = [unit['unit_id'] for unit in units]
+    odometers_start, odometers_end = await asyncio.gather(
+        fetch_odometer_snapshot(client, start_datetime, report_unit_ids),
+        fetch_odometer_snapshot(client, end_datetime, report_unit_ids),
+    )
+
+    async def unit_row(index: int, unit: dict):
+        data = await _fetch_unit_data(client, unit, start_datetime, end_datetime, odometers_start, odometers_end)
+        return index, build_unit_row_from_data(data)
+
+    rows = {}
+    for next_row in asyncio.as_completed([unit_row(index, unit) for index, unit in enumerate(units)]):
+        index, row = await next_row
+        rows[index] = row
+        print(f"--- Юніт оброблено: {get_unit_name(units[index])} ---")
+        if row_callback:
+            row_callback(index, row)
+        if progress_callback:
+            progress_callback(len(rows), len(units))
+
+    return rows_to_dataframe([rows[index] for index in sorted(rows)])
+
+
+# Синхронна обгортка: звіт через асинхронний клієнт в окремому event loop (asyncio.run).
+# Для коду без asyncio, якому потрібно багато одночасних запитів без пулу потоків.
+# Синхронний конвеєр (mapon_api_client.get_fleet_odometer_and_fuel_data) лишається основним і не
+# викликає цю обгортку: він працює з MaponClient, який створює викликач (app.py, пакетні звіти та
+# попереднє завантаження потім читають його error_budget і metrics), його частини (iter_fleet_unit_data,
+# collect_fleet_unit_data) використовують щоденні агрегати та розбивка по днях, а asyncio.run не можна
+# викликати з потоку, де вже працює event loop. Розбір відповідей, пошук рівня палива (fuel_level_lookup),
+# регулятор запитів і кеші - спільні; окремо існує лише порядок виконання запитів.
+# client_options - параметри AsyncMaponClient (max_concurrency, cache, fuel_lookup, base_url, ...).
+def run_fleet_report(api_key: str, start_datetime: datetime.datetime, end_datetime: datetime.datetime, progress_callback=None, row_callback=None, unit_ids=None, exclude_inactive: bool = False, **client_options) -> pd.DataFrame:
+    async def run():
+        async with AsyncMaponClient(api_key, **client_options) as client:
+            df = await get_fleet_odometer_and_fuel_data(client, start_datetime, end_datetime, progress_callback, row_callback, unit_ids, exclude_inactive)
+            df.attrs['failed_requests'] = client.error_budget.failures
+            df.attrs['metrics'] = client.metrics.snapshot()
+            return df
+
+    return asyncio.run(run())
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import hashlib
+import json
+import time
+import zlib
+import os
+import datetime
+import pytz # Для роботи з часовими поясами
+
+# Файл кешу за замовчуванням (поруч із застосунком, в .mapon_cache/)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.mapon_cache')
+DEFAULT_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIR, 'responses.sqlite3')
+# Максимальний розмір кешу (стиснуті відповіді), байти
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Скільки живуть записи, що зачіпають "сьогодні" (дані ще можуть змінитися), секунди
+DEFAULT_RECENT_TTL = 300
+
+# Параметри запиту, що містять час (за ними визначаємо, чи дані вже "закриті")
+TIME_PARAMS = ('datetime', 'from', 'till')
+
+
+# Короткий хеш API ключа: ключ не зберігається на диску, але кеш різних акаунтів не змішується
+def account_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+# Найпізніший момент часу, якого стосується запит (datetime для can_point, till для діапазонів)
+def data_horizon(params: dict):
+    horizon = None
+    for name in TIME_PARAMS:
+        value = params.get(name)
+        if not value:
+            continue
+        parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = pytz.utc.localize(parsed)
+        if horizon is None or parsed > horizon:
+            horizon = parsed
+    return horizon
+
+
+# Персистентний кеш відповідей Mapon API в SQLite.
+# Дані за закриті періоди (до початку поточної доби UTC) не змінюються і зберігаються без терміну дії,
+# записи, що зачіпають сьогодні, живуть recent_ttl секунд. При перевищенні max_bytes
+# видаляються найдавніше використані записи (LRU).
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, recent_ttl: float = DEFAULT_RECENT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Одне з'єднання на процес, доступ серіалізується через self._lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                unit_id TEXT,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    # Ключ кешу: акаунт, ендпоінт, unit_id та нормалізовані параметри (відсортовані, без API ключа)
+    @staticmethod
+    def make_key(account: str, endpoint: str, params: dict) -> str:
+        normalised = {name: str(value) for name, value in params.items() if name != 'key'}
+        return f"{account}|{endpoint}|{normalised.get('unit_id', '')}|{json.dumps(normalised, sort_keys=True)}"
+
+    # Термін дії запису: None (назавжди) для закритих періодів, інакше now + recent_ttl
+    def expires_at_for(self, params: dict, now: float = None):
+        now = time.time() if now is None else now
+        horizon = data_horizon(params)
+        if horizon is None:
+            return now + self.recent_ttl
+        start_of_today = datetime.datetime.fromtimestamp(now, tz=pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        if horizon < start_of_today:
+            return None
+        return now + self.recent_ttl
+
+    # Повертає текст відповіді або None, якщо запису немає чи він застарів
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT body, size, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            body, size, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total_bytes -= size
+                return None
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+        return zlib.decompress(body).decode('utf-8')
+
+    def put(self, key: str, endpoint: str, params: dict, text: str):
+        body = zlib.compress(text.encode('utf-8'))
+        size = len(body)
+        now = time.time()
+        expires_at = self.expires_at_for(params, now)
+        unit_id = params.get('unit_id')
+        with self._lock:
+            previous = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, endpoint, unit_id, body, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, endpoint, None if unit_id is None else str(unit_id), body, size, expires_at, now)
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    # LRU-витіснення: видаляємо найдавніше використані записи, поки не звільнимо 10% ліміту
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        victims = []
+        for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            if self._total_bytes <= target:
+                break
+            victims.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', victims)
+        print(f"[Cache] Витіснено {len(victims)} старих записів, розмір кешу: {self._total_bytes} байт.")
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
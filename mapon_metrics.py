@@ -0,0 +1,144 @@
+import json
+import math
+import threading
+
+# Межі кошиків гістограми затримок запитів, секунди
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+# Мітка джерела для ендпоінтів без data_source
+NO_SOURCE = '-'
+
+
+# Лічильники одного ендпоінта й джерела даних (sensor/can/flow)
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.empty = 0
+        self.results = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.parse_seconds = 0.0
+        self.parse_count = 0
+
+    def observe_latency(self, seconds: float):
+        self.latency_sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                break
+
+
+# Метрики одного клієнта (звіту): кількість викликів, гістограми затримок, отримані байти,
+# порожні та помилкові результати і час розбору - по ендпоінтах і джерелах даних.
+class ClientMetrics:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint: str, source) -> EndpointStats:
+        key = (endpoint, source or NO_SOURCE)
+        if key not in self._stats:
+            self._stats[key] = EndpointStats()
+        return self._stats[key]
+
+    # HTTP запит (разом з повторами регулятора): тривалість, розмір відповіді, помилка
+    def record_request(self, endpoint: str, source, seconds: float, size: int, error: bool = False):
+        with self._lock:
+            stats = self._get(endpoint, source)
+            stats.requests += 1
+            stats.bytes += size
+            stats.observe_latency(seconds)
+            if error:
+                stats.errors += 1
+
+    def record_cache_hit(self, endpoint: str, source):
+        with self._lock:
+            self._get(endpoint, source).cache_hits += 1
+
+    # Крок розбору (JSON, серія палива тощо)
+    def record_parse(self, endpoint: str, source, seconds: float):
+        with self._lock:
+            stats = self._get(endpoint, source)
+            stats.parse_seconds += seconds
+            stats.parse_count += 1
+
+    # Результат запиту з точки зору звіту: є дані чи ні
+    def record_result(self, endpoint: str, source, empty: bool):
+        with self._lock:
+            stats = self._get(endpoint, source)
+            stats.results += 1
+            if empty:
+                stats.empty += 1
+
+    # Знімок метрик у вигляді простих структур (для JSON, Prometheus і відображення)
+    def snapshot(self) -> dict:
+        with self._lock:
+            rows = []
+            for (endpoint, source), stats in sorted(self._stats.items()):
+                rows.append({
+                    'endpoint': endpoint,
+                    'source': source,
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'results': stats.results,
+                    'empty': stats.empty,
+                    'cache_hits': stats.cache_hits,
+                    'bytes': stats.bytes,
+                    'latency_sum': round(stats.latency_sum, 6),
+                    'latency_buckets': list(stats.latency_buckets),
+                    'parse_seconds': round(stats.parse_seconds, 6),
+                    'parse_count': stats.parse_count,
+                })
+        return {'latency_bounds': [str(bound) if bound != math.inf else '+Inf' for bound in LATENCY_BUCKETS], 'endpoints': rows}
+
+
+def metrics_to_json(snapshot: dict) -> str:
+    return json.dumps(snapshot, ensure_ascii=False, indent=2)
+
+
+# Експорт знімка метрик у текстовому форматі Prometheus
+def metrics_to_prometheus(snapshot: dict) -> str:
+    counters = (
+        ('mapon_requests_total', 'requests', 'HTTP requests to Mapon API'),
+        ('mapon_request_errors_total', 'errors', 'Mapon API requests that failed after retries'),
+        ('mapon_results_total', 'results', 'Data lookups by the report'),
+        ('mapon_empty_results_total', 'empty', 'Data lookups that returned no data'),
+        ('mapon_cache_hits_total', 'cache_hits', 'Responses served from the local cache'),
+        ('mapon_response_bytes_total', 'bytes', 'Bytes received from Mapon API'),
+        ('mapon_parse_seconds_total', 'parse_seconds', 'Time spent parsing responses'),
+    )
+    lines = []
+    for name, field, help_text in counters:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for row in snapshot['endpoints']:
+            lines.append(f'{name}{{endpoint="{row["endpoint"]}",source="{row["source"]}"}} {row[field]}')
+
+    name = 'mapon_request_duration_seconds'
+    lines.append(f"# HELP {name} Mapon API request latency including retries")
+    lines.append(f"# TYPE {name} histogram")
+    for row in snapshot['endpoints']:
+        labels = f'endpoint="{row["endpoint"]}",source="{row["source"]}"'
+        cumulative = 0
+        for bound, count in zip(snapshot['latency_bounds'], row['latency_buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {row["latency_sum"]}')
+        lines.append(f'{name}_count{{{labels}}} {row["requests"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# Приблизний квантиль затримки з гістограми (верхня межа кошика), секунди
+def latency_quantile(row: dict, quantile: float):
+    total = sum(row['latency_buckets'])
+    if not total:
+        return None
+    threshold = quantile * total
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, row['latency_buckets']):
+        cumulative += count
+        if cumulative >= threshold:
+            return bound
+    return math.inf
@@ -0,0 +1,305 @@
+import argparse
+import datetime
+import gzip
+import json
+import multiprocessing
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальний замінник Mapon API для вимірювань без реального ключа і мережі.
+# Реалізує unit/list.json, unit_groups/list.json, unit_groups/list_units.json, unit_data/can_point.json,
+# fuel/data.json і fuel/summary.json на синтетичному автопарку з детермінованими даними.
+
+# Початок відліку синтетичного одометра
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+# Частка бака, що заправляється за одну заправку
+REFUEL_SHARE = 0.7
+# Кількість синтетичних груп юнітів (юніт потрапляє в групу unit_id % STUB_GROUPS)
+STUB_GROUPS = 4
+
+
+def parse_mapon_datetime(value: str) -> float:
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def format_mapon_datetime(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Синтетичний юніт: пробіг росте лінійно, паливо витрачається рівномірно і заправляється "пилкою"
+class SyntheticUnit:
+    def __init__(self, unit_id: int, rng: random.Random):
+        self.unit_id = unit_id
+        self.number = f"AA{unit_id:04d}BB"
+        self.speed = rng.uniform(20, 60) # км/год у середньому
+        self.odometer_base = rng.uniform(10000, 500000)
+        self.tank = rng.choice((300, 400, 500, 600))
+        self.burn_rate = rng.uniform(6, 14) # л/год
+        self.phase = rng.uniform(0, 1)
+        # Джерело даних про паливо: сенсор рівня, CAN рівень або CAN рівень + проточний датчик
+        self.fuel_source = ('sensor', 'can', 'can+flow')[unit_id % 3]
+
+    @property
+    def refuel_period(self) -> float:
+        return self.tank * REFUEL_SHARE / self.burn_rate * 3600
+
+    def odometer(self, timestamp: float) -> float:
+        return round(self.odometer_base + self.speed * (timestamp - EPOCH.timestamp()) / 3600, 1)
+
+    def fuel_level(self, timestamps):
+        period = self.refuel_period
+        position = [((t - EPOCH.timestamp()) / period + self.phase) % 1 for t in timestamps]
+        return [round(self.tank - self.tank * REFUEL_SHARE * p, 1) for p in position]
+
+    def refuels_between(self, start: float, end: float) -> int:
+        period = self.refuel_period
+        offset = EPOCH.timestamp() - self.phase * period
+        return int((end - offset) // period) - int((start - offset) // period)
+
+    def summary(self, start: float, end: float) -> dict:
+        hours = max(0.0, end - start) / 3600
+        consumed = self.burn_rate * hours
+        distance = self.speed * hours
+        values = {
+            'fueled': round(self.refuels_between(start, end) * self.tank * REFUEL_SHARE, 2),
+            'drained': 0,
+            'total_consumed': round(consumed, 2),
+            'avg_consumption': round(consumed / distance * 100, 2) if distance > 0 else None,
+        }
+        if self.fuel_source == 'sensor':
+            return {'sensor': values}
+        if self.fuel_source == 'can':
+            return {'can': values}
+        return {'can': values, 'flow': {'total_consumed': values['total_consumed'], 'avg_consumption': values['avg_consumption']}}
+
+
+# Синтетичний автопарк і параметри поведінки сервера
+class SyntheticFleet:
+    def __init__(self, size: int = 100, points_per_day: int = 1440, seed: int = 42):
+        rng = random.Random(seed)
+        self.points_per_day = points_per_day
+        self.units = [SyntheticUnit(unit_id, rng) for unit_id in range(1, size + 1)]
+        self.units_by_id = {unit.unit_id: unit for unit in self.units}
+
+    @property
+    def step(self) -> float:
+        return 86400 / self.points_per_day
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, як у справжнього API
+    # Заголовки й тіло йдуть одним пакетом: без цього keep-alive з'єднання чекають затримки ACK (~40 мс на запит)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass # Без логу кожного запиту
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path.split('/api/v1/', 1)[-1]
+        params = dict(urllib.parse.parse_qsl(url.query))
+        # Службовий ендпоінт статистики (не рахується як запит до API)
+        if url.path == '/_stats':
+            return self._send(200, server.stats())
+        server.count_request(endpoint)
+
+        if server.latency:
+            time.sleep(server.rng_uniform(0.5, 1.5) * server.latency)
+
+        roll = server.rng_uniform(0, 1)
+        if roll < server.throttle_rate:
+            return self._send(429, {'error': {'code': 429, 'msg': 'Too many requests'}}, {'Retry-After': '1'})
+        if roll < server.throttle_rate + server.error_rate:
+            return self._send(500, {'error': {'code': 500, 'msg': 'Injected error'}})
+
+        handler = {
+            'unit/list.json': self._unit_list,
+            'unit_groups/list.json': self._unit_groups,
+            'unit_groups/list_units.json': self._group_units,
+            'unit_data/can_point.json': self._can_point,
+            'fuel/data.json': self._fuel_data,
+            'fuel/summary.json': self._fuel_summary,
+        }.get(endpoint)
+        if handler is None:
+            return self._send(404, {'error': {'code': 404, 'msg': 'Unknown endpoint'}})
+        try:
+            self._send(200, handler(params))
+        except (KeyError, ValueError) as e:
+            self._send(400, {'error': {'code': 400, 'msg': str(e)}})
+
+    def _unit_list(self, params: dict) -> dict:
+        now = time.time()
+        # Кожен десятий юніт "списаний": останні дані місяць тому
+        return {'data': {'units': [
+            {'unit_id': unit.unit_id, 'number': unit.number, 'label': f"Truck {unit.unit_id}",
+             'last_update': format_mapon_datetime(now - 30 * 86400 if unit.unit_id % 10 == 0 else now)}
+            for unit in self.server.fleet.units
+        ]}}
+
+    def _unit_groups(self, params: dict) -> dict:
+        return {'data': {'groups': [{'id': group_id, 'name': f"Group {group_id}"} for group_id in range(STUB_GROUPS)]}}
+
+    def _group_units(self, params: dict) -> dict:
+        group_id = int(params['id'])
+        return {'data': {'units': [{'unit_id': unit.unit_id} for unit in self.server.fleet.units if unit.unit_id % STUB_GROUPS == group_id]}}
+
+    def _can_point(self, params: dict) -> dict:
+        timestamp = parse_mapon_datetime(params['datetime'])
+        fleet = self.server.fleet
+        units = [fleet.units_by_id[int(params['unit_id'])]] if params.get('unit_id') else fleet.units
+        return {'data': {'units': [
+            {'unit_id': unit.unit_id, 'total_distance': {'value': unit.odometer(timestamp)}} for unit in units
+        ]}}
+
+    def _fuel_data(self, params: dict) -> dict:
+        unit = self.server.fleet.units_by_id[int(params['unit_id'])]
+        data_source = params.get('data_source', 'sensor')
+        if data_source not in unit.fuel_source.split('+'):
+            return {'data': {}}
+        start = parse_mapon_datetime(params['from'])
+        end = parse_mapon_datetime(params['till'])
+        step = self.server.fleet.step
+        first = (start // step + (1 if start % step else 0)) * step
+        count = max(0, int((end - first) // step) + 1)
+        timestamps = [first + i * step for i in range(count)]
+        values = unit.fuel_level(timestamps)
+        return {'data': {data_source: {'tanks': [{'values': [
+            {'gmt': format_mapon_datetime(t), 'value': v} for t, v in zip(timestamps, values)
+        ]}]}}}
+
+    def _fuel_summary(self, params: dict) -> dict:
+        unit = self.server.fleet.units_by_id[int(params['unit_id'])]
+        return {'data': [unit.summary(parse_mapon_datetime(params['from']), parse_mapon_datetime(params['till']))]}
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=1)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_bytes(len(body))
+
+
+# Локальний HTTP сервер-замінник Mapon API. Використання:
+#   with StubMaponServer(SyntheticFleet(size=100)) as server:
+#       client = MaponClient('any-key', base_url=server.base_url)
+class StubMaponServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fleet: SyntheticFleet, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0, seed: int = 42):
+        super().__init__((host, port), StubRequestHandler)
+        self.fleet = fleet
+        self.latency = latency # середня затримка відповіді, секунди
+        self.error_rate = error_rate # частка відповідей 500
+        self.throttle_rate = throttle_rate # частка відповідей 429 з Retry-After
+        self.request_counts = Counter()
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def rng_uniform(self, low: float, high: float) -> float:
+        with self._stats_lock:
+            return self._rng.uniform(low, high)
+
+    def count_request(self, endpoint: str):
+        with self._stats_lock:
+            self.request_counts[endpoint] += 1
+
+    def count_bytes(self, size: int):
+        with self._stats_lock:
+            self.bytes_sent += size
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {'request_counts': dict(self.request_counts), 'bytes_sent': self.bytes_sent}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.request_counts.clear()
+            self.bytes_sent = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mapon-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+# Запуск сервера в окремому процесі (щоб навантаження сервера не впливало на вимірювання клієнта).
+# Повертає (процес, base_url); статистику можна отримати через fetch_stub_stats(base_url).
+def _serve_in_process(connection, fleet_options: dict, server_options: dict):
+    server = StubMaponServer(SyntheticFleet(**fleet_options), **server_options)
+    connection.send(server.base_url)
+    connection.close()
+    server.serve_forever()
+
+
+def start_stub_server_process(fleet_options: dict, server_options: dict = None):
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve_in_process, args=(child_connection, fleet_options, server_options or {}), daemon=True)
+    process.start()
+    base_url = parent_connection.recv()
+    return process, base_url
+
+
+def fetch_stub_stats(base_url: str) -> dict:
+    root = base_url.split('/api/v1', 1)[0]
+    with urllib.request.urlopen(f"{root}/_stats") as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальний замінник Mapon API з синтетичним автопарком.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--units', type=int, default=100, help="Кількість юнітів")
+    parser.add_argument('--points-per-day', type=int, default=1440, help="Точок fuel/data.json на добу")
+    parser.add_argument('--latency', type=float, default=0.0, help="Середня затримка відповіді, секунди")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Частка відповідей 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Частка відповідей 429")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    fleet = SyntheticFleet(args.units, args.points_per_day, args.seed)
+    server = StubMaponServer(fleet, args.host, args.port, args.latency, args.error_rate, args.throttle_rate, args.seed)
+    print(f"[Stub] Mapon API-замінник на {server.base_url} ({args.units} юнітів). Ctrl+C для зупинки.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import pytz # Для роботи з часовими поясами
+
+from mapon_api_client import MaponClient, get_unit_list, get_fleet_odometer_and_fuel_data, DEFAULT_MAX_WORKERS, MAPON_API_BASE_URL, FUEL_LOOKUP_DAY
+from mapon_cache import ResponseCache, DEFAULT_CACHE_DIR
+from daily_breakdown import get_fleet_daily_breakdown
+from daily_aggregates import DailyAggregateStore, get_fleet_report_from_daily_aggregates, day_bounds_utc, DEFAULT_TIMEZONE
+from batch_reports import account_api_key
+
+# Попереднє завантаження даних за щойно закриту добу в нічні години, щоб ранкові звіти "за вчора"
+# (у застосунку та пакетні) відповідались з локальних кешів за секунди, а не чекали на API.
+# Для кожного акаунта виконуються ті самі запити, що й у звітах обраних режимів, тож відповіді лягають
+# у персистентний кеш відповідей (.mapon_cache/responses.sqlite3) з тими самими ключами, а доба -
+# у сховище щоденних агрегатів. Приклад:
+#   python prefetch_worker.py prefetch.json          # працює постійно, запуск щодня о run_at
+#   python prefetch_worker.py prefetch.json --once   # одноразово (наприклад, з cron)
+#
+# Файл завдання (JSON):
+# {
+#     "timezone": "Europe/Kiev",         # часовий пояс доби та run_at (як у app.py)
+#     "run_at": "03:30",                 # локальний час запуску
+#     "days": 1,                         # скільки останніх закритих діб завантажувати
+#     "modes": ["period", "daily_aggregates", "daily_breakdown"],
+#     "max_workers": 8,                  # паралельних запитів усередині акаунта
+#     "fuel_lookup": "day",              # має збігатися з налаштуванням ранкових звітів
+#     "fuel_summary_chunk": "day",       # необов'язково: так само
+#     "base_url": "https://mapon.com/api/v1",
+#     "accounts": [
+#         {"name": "client-a", "api_key_env": "MAPON_KEY_A"},
+#         {"name": "client-b", "api_key": "...", "modes": ["daily_aggregates"]}
+#     ]
+# }
+#
+# Кеш відповідей зберігає без терміну дії лише дані, що закінчились до початку поточної доби UTC;
+# локальна доба за Києвом закінчується о 21:00/22:00 UTC, тож run_at за замовчуванням - після півночі UTC.
+# Доби, які не вдалося завантажити, записуються в .mapon_cache/prefetch_retry.json і повторюються
+# наступними проходами (у тому числі наступними запусками --once).
+
+# Режими попереднього завантаження (відповідають режимам звіту в app.py)
+PREFETCH_PERIOD = 'period' # звіт за період [00:00:00, 23:59:59] доби
+PREFETCH_DAILY_AGGREGATES = 'daily_aggregates' # доба у сховищі щоденних агрегатів
+PREFETCH_DAILY_BREAKDOWN = 'daily_breakdown' # серії палива за добу та зведення (розбивка по днях)
+PREFETCH_MODES = (PREFETCH_PERIOD, PREFETCH_DAILY_AGGREGATES, PREFETCH_DAILY_BREAKDOWN)
+DEFAULT_RUN_AT = datetime.time(3, 30)
+DEFAULT_PREFETCH_DAYS = 1
+# Невдалі (акаунт, доба) попередніх проходів - додаються до наступного проходу (і між запусками з cron)
+DEFAULT_RETRY_PATH = os.path.join(DEFAULT_CACHE_DIR, 'prefetch_retry.json')
+# Скільки днів після доби ще пробувати завантажити її знову
+DEFAULT_RETRY_MAX_AGE_DAYS = 7
+
+
+# Наступний момент запуску (UTC) - найближчий run_at за локальним часом tz, строго після now
+def next_run_at(now_utc: datetime.datetime, run_at: datetime.time, tz) -> datetime.datetime:
+    local_date = now_utc.astimezone(tz).date()
+    for offset in range(3):
+        candidate = tz.localize(datetime.datetime.combine(local_date + datetime.timedelta(days=offset), run_at)).astimezone(pytz.utc)
+        if candidate > now_utc:
+            return candidate
+    raise ValueError(f"Не вдалося визначити наступний запуск для {run_at}")
+
+
+# Закриті локальні доби для завантаження: days останніх діб перед сьогоднішньою (від найстарішої)
+def closed_days(today: datetime.date, days: int = DEFAULT_PREFETCH_DAYS) -> list:
+    return [today - datetime.timedelta(days=offset) for offset in range(max(days, 1), 0, -1)]
+
+
+# Чи потрапить доба в кеш відповідей без терміну дії, якщо завантажити її зараз (див. ResponseCache.expires_at_for)
+def is_day_closed_in_utc(day: datetime.date, tz, now_utc: datetime.datetime) -> bool:
+    start_of_today_utc = now_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day_bounds_utc(day, tz)[1] < start_of_today_utc
+
+
+# Невдалі доби попередніх проходів: {акаунт: [доба, ...]}
+def load_retry_days(path: str = DEFAULT_RETRY_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {account: [datetime.date.fromisoformat(day) for day in days] for account, days in json.load(f).items()}
+
+
+def save_retry_days(retry_days: dict, path: str = DEFAULT_RETRY_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({account: [day.isoformat() for day in days] for account, days in retry_days.items() if days}, f, ensure_ascii=False, indent=2)
+
+
+# Розгортає файл завдання у список акаунтів з налаштуваннями (значення акаунта перекривають загальні)
+def build_prefetch_accounts(spec: dict) -> list:
+    accounts = []
+    for number, account in enumerate(spec['accounts'], start=1):
+        modes = account.get('modes', spec.get('modes', list(PREFETCH_MODES)))
+        for mode in modes:
+            if mode not in PREFETCH_MODES:
+                raise ValueError(f"Невідомий режим '{mode}', доступні: {', '.join(PREFETCH_MODES)}")
+        accounts.append({
+            'account': account.get('name') or f"account{number}",
+            'api_key': account_api_key(account),
+            'modes': modes,
+            'max_workers': account.get('max_workers', spec.get('max_workers', DEFAULT_MAX_WORKERS)),
+            'fuel_lookup': account.get('fuel_lookup', spec.get('fuel_lookup', FUEL_LOOKUP_DAY)),
+            'fuel_summary_chunk': account.get('fuel_summary_chunk', spec.get('fuel_summary_chunk')),
+            'base_url': spec.get('base_url', MAPON_API_BASE_URL),
+        })
+    return accounts
+
+
+# Попереднє завантаження доби для одного акаунта всіма його режимами.
+# Один клієнт на всі режими: запити, спільні для режимів (одометри на межах доби, серії палива),
+# виконуються один раз, далі відповідаються з кешу. Повертає короткий підсумок.
+# Доба з невдалими запитами даних юнітів або не збережена у сховищі щоденних агрегатів вважається
+# невдалою (поле 'error'): run_prefetch додає її до наступних проходів, а успішні відповіді беруться з кешу.
+def prefetch_account_day(account: dict, day: datetime.date, timezone: str, response_cache: ResponseCache, aggregate_store: DailyAggregateStore) -> dict:
+    started = time.perf_counter()
+    tz = pytz.timezone(timezone)
+    day_start, day_end = day_bounds_utc(day, tz)
+    max_workers = account['max_workers']
+
+    with MaponClient(account['api_key'], pool_size=max(max_workers or 1, 1), base_url=account['base_url'], cache=response_cache, fuel_lookup=account['fuel_lookup'], fuel_summary_chunk=account['fuel_summary_chunk']) as client:
+        units = get_unit_list(client)
+        rows = {}
+        for mode in account['modes']:
+            if mode == PREFETCH_PERIOD:
+                df = get_fleet_odometer_and_fuel_data(client, day_start, day_end, max_workers=max_workers)
+            elif mode == PREFETCH_DAILY_AGGREGATES:
+                df = get_fleet_report_from_daily_aggregates(client, day, day, aggregate_store, timezone=timezone, max_workers=max_workers)
+            else:
+                df = get_fleet_daily_breakdown(client, day, day, timezone=timezone, max_workers=max_workers)
+            rows[mode] = len(df)
+        metrics = client.metrics.snapshot()
+        failed_requests = client.error_budget.failures
+        failed_units = len(client.error_budget.unit_failures)
+
+    problems = []
+    # Невдалий знімок одометрів автопарку доотримується поштучно, тож рахуються лише невдачі даних юнітів;
+    # без юнітів (не вдався список юнітів) - будь-яка невдача
+    if failed_units or (failed_requests and not units):
+        problems.append(f"невдалих запитів: {failed_requests}, юнітів з невдалими запитами: {failed_units}")
+    if PREFETCH_DAILY_AGGREGATES in account['modes']:
+        missing = aggregate_store.missing_unit_days(client.account, timezone, [day], [unit['unit_id'] for unit in units])
+        if missing:
+            problems.append(f"доба не збережена у сховищі щоденних агрегатів ({len(missing[day])} юнітів)")
+
+    endpoints = metrics.get('endpoints', [])
+    result = {
+        'account': account['account'],
+        'day': day.isoformat(),
+        'units': len(units),
+        'rows': rows,
+        'requests': sum(row['requests'] for row in endpoints),
+        'cache_hits': sum(row['cache_hits'] for row in endpoints),
+        'failed_requests': failed_requests,
+        'seconds': round(time.perf_counter() - started, 1),
+    }
+    if problems:
+        result['error'] = '; '.join(problems)
+    return result
+
+
+# Один прохід: усі акаунти по черзі (щоб не ділити ліміт швидкості API між кількома звітами одночасно)
+# для кожної з закритих діб. Помилка одного акаунта не зупиняє решту. Повертає список підсумків.
+# Невдалі доби записуються в retry_path і додаються до наступних проходів акаунта, доки не завантажаться
+# або не стануть старшими за DEFAULT_RETRY_MAX_AGE_DAYS днів (retry_path=None - без повторів).
+def run_prefetch(spec: dict, days: list = None, now_utc: datetime.datetime = None, retry_path: str = DEFAULT_RETRY_PATH) -> list:
+    timezone = spec.get('timezone', DEFAULT_TIMEZONE)
+    tz = pytz.timezone(timezone)
+    now_utc = now_utc or datetime.datetime.now(pytz.utc)
+    if days is None:
+        days = closed_days(now_utc.astimezone(tz).date(), spec.get('days', DEFAULT_PREFETCH_DAYS))
+    for day in days:
+        if not is_day_closed_in_utc(day, tz, now_utc):
+            print(f"[Prefetch] Увага: доба {day} ще не закрилась за UTC - відповіді, що її зачіпають, кешуються лише на кілька хвилин. Запускайте після 00:00 UTC.")
+
+    oldest_retry_day = now_utc.astimezone(tz).date() - datetime.timedelta(days=DEFAULT_RETRY_MAX_AGE_DAYS)
+    retry_days = load_retry_days(retry_path) if retry_path else {}
+    response_cache = ResponseCache()
+    aggregate_store = DailyAggregateStore()
+    results = []
+    try:
+        for account in build_prefetch_accounts(spec):
+            pending = [day for day in retry_days.get(account['account'], []) if day >= oldest_retry_day and day not in days]
+            if pending:
+                print(f"[Prefetch] {account['account']}: повторне завантаження невдалих діб: {', '.join(day.isoformat() for day in pending)}.")
+            failed_days = []
+            for day in sorted(pending + list(days)):
+                try:
+                    result = prefetch_account_day(account, day, timezone, response_cache, aggregate_store)
+                    print(f"[Prefetch] {result['account']} / {result['day']}: {result['units']} юнітів, {result['requests']} запитів до API, {result['cache_hits']} з кешу, {result['seconds']} с.")
+                    if 'error' in result:
+                        print(f"[Prefetch] {result['account']} / {result['day']}: помилка: {result['error']}")
+                except Exception as e:
+                    result = {'account': account['account'], 'day': day.isoformat(), 'error': str(e)}
+                    print(f"[Prefetch] {account['account']} / {day}: помилка: {e}")
+                if 'error' in result:
+                    failed_days.append(day)
+                results.append(result)
+            retry_days[account['account']] = failed_days
+            if failed_days and retry_path:
+                print(f"[Prefetch] {account['account']}: невдалі доби ({', '.join(day.isoformat() for day in failed_days)}) буде завантажено знову при наступному проході.")
+    finally:
+        aggregate_store.close()
+        response_cache.close()
+        if retry_path:
+            save_retry_days(retry_days, retry_path)
+    return results
+
+
+# Постійна робота: чекаємо до run_at за локальним часом і виконуємо прохід, щодня
+def run_forever(spec: dict):
+    tz = pytz.timezone(spec.get('timezone', DEFAULT_TIMEZONE))
+    run_at = datetime.time.fromisoformat(spec['run_at']) if spec.get('run_at') else DEFAULT_RUN_AT
+    while True:
+        next_run = next_run_at(datetime.datetime.now(pytz.utc), run_at, tz)
+        print(f"[Prefetch] Наступний запуск: {next_run.astimezone(tz):%d.%m.%Y %H:%M} ({tz.zone}).")
+        while True:
+            remaining = (next_run - datetime.datetime.now(pytz.utc)).total_seconds()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 60)) # короткими кроками - щоб не проспати після зміни часу чи сну машини
+        run_prefetch(spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нічне попереднє завантаження даних Mapon у локальні кеші за файлом завдання (JSON).")
+    parser.add_argument('spec', help="Файл завдання")
+    parser.add_argument('--once', action='store_true', help="Виконати один прохід зараз і завершитись")
+    parser.add_argument('--day', type=datetime.date.fromisoformat, help="Доба для одного проходу (YYYY-MM-DD), замість останніх закритих")
+    parser.add_argument('--summary', help="Зберегти підсумок проходу в JSON файл (з --once)")
+    args = parser.parse_args()
+
+    with open(args.spec, encoding='utf-8') as f:
+        spec = json.load(f)
+    if not args.once and not args.day:
+        run_forever(spec)
+        return
+
+    results = run_prefetch(spec, [args.day] if args.day else None)
+    failed = [result for result in results if 'error' in result]
+    print(f"[Prefetch] Готово: {len(results) - len(failed)} з {len(results)}, з помилкою: {len(failed)}.")
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
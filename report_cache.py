@@ -0,0 +1,117 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import pandas as pd
+import pytz # Для роботи з часовими поясами
+
+# Максимальний обсяг готових звітів у пам'яті процесу, байти
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Скільки живе звіт, період якого зачіпає поточну добу UTC (дані ще надходять), секунди
+DEFAULT_LIVE_TTL = 300
+
+
+# Обсяг DataFrame у пам'яті (з текстовими значеннями), байти
+def dataframe_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# Спільний для процесу кеш готових звітів (DataFrame) з обмеженням пам'яті та витісненням LRU.
+# Ключ - кортеж (хеш API ключа, період, фільтр юнітів, режим звіту...), див. make_key.
+# Однакові звіти, запитані одночасно з різних сесій, рахуються один раз: поки звіт формується,
+# інші запити чекають на той самий результат (single-flight). Сесії отримують посилання на спільний
+# DataFrame і не повинні його змінювати.
+class ReportResultCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, live_ttl: float = DEFAULT_LIVE_TTL):
+        self.max_bytes = max_bytes
+        self.live_ttl = live_ttl
+        self._entries = OrderedDict() # ключ -> (DataFrame, розмір, expires_at)
+        self._in_flight = {} # ключ -> Future звіту, що формується
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(account: str, start_datetime_utc: datetime.datetime, end_datetime_utc: datetime.datetime, unit_ids=None, **options) -> tuple:
+        units = tuple(sorted(unit_ids)) if unit_ids is not None else None
+        return (account, start_datetime_utc.isoformat(), end_datetime_utc.isoformat(), units, tuple(sorted(options.items())))
+
+    # Звіт за період, що закінчився до початку поточної доби UTC, не змінюється (зберігається до витіснення);
+    # інакше - живе live_ttl секунд
+    def expires_at_for(self, end_datetime_utc: datetime.datetime, now: float = None):
+        now = time.time() if now is None else now
+        start_of_today = datetime.datetime.fromtimestamp(now, tz=pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        if end_datetime_utc < start_of_today:
+            return None
+        return now + self.live_ttl
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            df, size, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return df
+
+    def put(self, key: tuple, df: pd.DataFrame, expires_at=None):
+        size = dataframe_bytes(df)
+        if size > self.max_bytes:
+            print(f"[ReportCache] Звіт ({size / 1024 / 1024:.1f} МБ) більший за ліміт кешу, не кешуємо.")
+            return
+        # Звіти з втраченими запитами кешуємо ненадовго, щоб наступний запит міг отримати повні дані
+        if df.attrs.get('failed_requests'):
+            expires_at = min(expires_at, time.time() + self.live_ttl) if expires_at is not None else time.time() + self.live_ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (df, size, expires_at)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    # Звіт з кешу або сформований через compute(). Якщо такий самий звіт уже формується в іншому потоці,
+    # чекаємо на його результат замість повторного завантаження. Помилка compute() передається всім, хто чекав.
+    def get_or_compute(self, key: tuple, compute, expires_at=None) -> pd.DataFrame:
+        df = self.get(key)
+        if df is not None:
+            return df
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not is_owner:
+            print("[ReportCache] Такий самий звіт уже формується, чекаємо на його результат.")
+            return future.result()
+
+        try:
+            df = compute()
+            self.put(key, df, expires_at)
+            future.set_result(df)
+            return df
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
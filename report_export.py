@@ -0,0 +1,164 @@
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from report_schema import to_text_frame
+
+# Формати експорту: розширення -> MIME тип
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+EXCEL_SHEET_NAME = 'Звіт по автопарку'
+# Скільки рядків переглядати для оцінки ширини колонок Excel (а не весь звіт)
+WIDTH_SAMPLE_ROWS = 500
+MAX_COLUMN_WIDTH = 60
+# Скільки рядків перетворювати за раз при потоковому записі Excel
+EXCEL_CHUNK_ROWS = 5000
+# Максимальний обсяг готових файлів експорту в пам'яті процесу, байти
+DEFAULT_EXPORT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+# Ширини колонок Excel за вибіркою рядків: початок, кінець і рівномірно розподілені рядки між ними
+def estimate_column_widths(df: pd.DataFrame, sample_rows: int = WIDTH_SAMPLE_ROWS) -> list:
+    if len(df) > sample_rows:
+        sample = df.iloc[np.unique(np.linspace(0, len(df) - 1, sample_rows).astype(int))]
+    else:
+        sample = df
+    widths = []
+    for col in df.columns:
+        values_len = sample[col].astype(str).map(len).max() if len(sample) else 0
+        widths.append(min(max(values_len, len(str(col))) + 2, MAX_COLUMN_WIDTH))
+    return widths
+
+
+# Значення для xlsxwriter: NaN / NaT -> None (порожня клітинка)
+def _excel_values(chunk: pd.DataFrame) -> list:
+    values = chunk.astype(object).to_numpy()
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+
+# Потоковий запис Excel: xlsxwriter у режимі constant_memory скидає кожен рядок на диск одразу після запису,
+# тож пам'ять не росте разом із кількістю рядків (на відміну від DataFrame.to_excel, що пише колонками).
+# target - шлях або бінарний файловий об'єкт.
+def write_excel(df: pd.DataFrame, target, sheet_name: str = EXCEL_SHEET_NAME):
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'default_date_format': 'dd.mm.yyyy'})
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({'bold': True})
+        for i, width in enumerate(estimate_column_widths(df)):
+            worksheet.set_column(i, i, width)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+        row_number = 1
+        for chunk_start in range(0, len(df), EXCEL_CHUNK_ROWS):
+            for values in _excel_values(df.iloc[chunk_start:chunk_start + EXCEL_CHUNK_ROWS]):
+                worksheet.write_row(row_number, 0, values)
+                row_number += 1
+    finally:
+        workbook.close()
+
+
+# CSV з BOM - щоб Excel коректно відкривав кирилицю
+def write_csv(df: pd.DataFrame, target):
+    df.to_csv(target, index=False, encoding='utf-8-sig')
+
+
+def write_parquet(df: pd.DataFrame, target):
+    df.to_parquet(target, index=False)
+
+
+# Експорт звіту у файл або файловий об'єкт. columns - колонки для експорту (None - усі).
+# Parquet зберігає типізовані колонки (float64 + категорії статусу), Excel і CSV - текстовий вигляд звіту
+# (причина відсутності значення - у самій клітинці, див. report_schema.to_text_frame).
+def export_report(df: pd.DataFrame, export_format: str, target, columns: list = None):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Невідомий формат експорту: {export_format}")
+    if export_format != 'parquet':
+        df = to_text_frame(df)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    if export_format == 'xlsx':
+        write_excel(df, target)
+    elif export_format == 'csv':
+        write_csv(df, target)
+    else:
+        write_parquet(df, target)
+
+
+def export_report_bytes(df: pd.DataFrame, export_format: str, columns: list = None) -> bytes:
+    output = io.BytesIO()
+    export_report(df, export_format, output, columns)
+    return output.getvalue()
+
+
+# Кеш готових файлів експорту з ключем (ID звіту, формат, колонки) замість хешування всього DataFrame
+# при кожному перезапуску скрипта Streamlit. Кожен файл формується один раз - навіть якщо його одночасно
+# запитали кілька сесій; обсяг обмежений max_bytes (витіснення LRU).
+class ReportExportCache:
+    def __init__(self, max_bytes: int = DEFAULT_EXPORT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # ключ -> bytes
+        self._loading = {} # ключ -> Lock для формування
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(report_id: str, export_format: str, columns: list = None) -> tuple:
+        return (report_id, export_format, tuple(columns) if columns is not None else None)
+
+    def _get(self, key: tuple):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def _put(self, key: tuple, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = data
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and self._entries:
+                self._total_bytes -= len(self._entries.popitem(last=False)[1])
+
+    def get_or_export(self, report_id: str, df: pd.DataFrame, export_format: str, columns: list = None) -> bytes:
+        key = self.make_key(report_id, export_format, columns)
+        data = self._get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            data = self._get(key)
+            if data is not None:
+                return data
+            try:
+                data = export_report_bytes(df, export_format, columns)
+                self._put(key, data)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return data
+
+    # Файли звіту більше не потрібні (наприклад, завдання видалене)
+    def invalidate(self, report_id: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == report_id]:
+                self._total_bytes -= len(self._entries.pop(key))
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
@@ -0,0 +1,176 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+from report_schema import rows_to_dataframe
+from report_cache import dataframe_bytes, DEFAULT_MAX_BYTES
+
+# Скільки звітів може виконуватися одночасно у фоновому виконавці
+DEFAULT_MAX_CONCURRENT_JOBS = 4
+# Скільки секунд зберігати завершені завдання (щоб до них можна було повернутися після оновлення сторінки)
+DEFAULT_KEEP_FINISHED = 6 * 60 * 60
+# Максимальний обсяг результатів завершених завдань у пам'яті процесу, байти (як і для кешу готових звітів)
+DEFAULT_MAX_RESULT_BYTES = DEFAULT_MAX_BYTES
+
+# Стани завдання
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+# Фонове завдання генерації звіту: стан, прогрес і результат живуть тут, а не в session_state.
+# Якщо результат лежить у спільному кеші готових звітів, завдання тримає лише його ключ (result_key)
+# і бере DataFrame з кешу - звіт зберігається в пам'яті в одному місці й рахується в одному ліміті.
+class ReportJob:
+    def __init__(self, job_id: str, owner: str, description: str, metadata: dict, result_cache=None):
+        self.job_id = job_id
+        self.owner = owner
+        self.description = description
+        self.metadata = metadata
+        self.status = JOB_QUEUED
+        self.progress_done = 0
+        self.progress_total = 0
+        self.result_key = None
+        self.result_bytes = 0 # обсяг результату, який завдання тримає саме (не в кеші)
+        self._result = None
+        self._result_cache = result_cache
+        self._result_evicted = False
+        self.error = None
+        self.rows = {} # Рядки, що надійшли під час формування: індекс -> рядок
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    # Результат (DataFrame): власний або з кешу готових звітів за result_key; None - немає або видалено
+    @property
+    def result(self):
+        if self.result_key is not None:
+            return self._result_cache.get(self.result_key)
+        return self._result
+
+    # Результат видалено з пам'яті (ліміт обсягу або термін кешу) - звіт треба згенерувати знову
+    @property
+    def result_evicted(self) -> bool:
+        if self.result_key is not None:
+            return self._result_cache.get(self.result_key) is None
+        return self._result_evicted
+
+    # Колбек прогресу, який передається у функцію звіту
+    def update_progress(self, done: int, total: int):
+        self.progress_done = done
+        self.progress_total = total
+
+    # Колбек рядків: звіт передає кожен готовий рядок, не чекаючи на весь автопарк
+    def add_row(self, index: int, row: dict):
+        self.rows[index] = row
+
+    # Частковий результат у порядку рядків повного звіту (зберігається і після помилки)
+    def partial_result(self) -> pd.DataFrame:
+        rows = dict(self.rows)
+        return rows_to_dataframe([rows[index] for index in sorted(rows)])
+
+    # Орієнтовний час до завершення (секунди) за середньою швидкістю обробки, або None
+    def eta_seconds(self):
+        if not self.started_at or not self.progress_done or not self.progress_total:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.progress_done * (self.progress_total - self.progress_done)
+
+
+# Менеджер фонових завдань: один на процес (у Streamlit - через st.cache_resource).
+# Звіт виконується в окремому потоці й не залежить від перезапусків скрипта Streamlit,
+# тож зміна віджетів чи оновлення сторінки не обриває завантаження.
+# result_cache (ReportResultCache): якщо результат завдання з dedup_key лежить у цьому кеші під тим самим
+# ключем, завдання тримає лише ключ. Інші результати завершених завдань займають не більше max_result_bytes:
+# при перевищенні в найстаріших результат видаляється (завдання лишається в списку з позначкою result_evicted).
+class ReportJobManager:
+    def __init__(self, max_concurrent_jobs: int = DEFAULT_MAX_CONCURRENT_JOBS, keep_finished: float = DEFAULT_KEEP_FINISHED, max_result_bytes: int = DEFAULT_MAX_RESULT_BYTES, result_cache=None):
+        self.keep_finished = keep_finished
+        self.max_result_bytes = max_result_bytes
+        self.result_cache = result_cache
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix='report-job')
+        self._jobs = {}
+        self._active_keys = {} # ключ звіту -> ID завдання, що його формує
+        self._lock = threading.Lock()
+
+    # Ставить звіт у чергу. func викликається як func(*args, progress_callback=..., row_callback=..., **kwargs)
+    # і повертає результат (DataFrame). Повертає ID завдання.
+    # dedup_key: якщо завдання з таким ключем уже в черзі або формується, повертається його ID -
+    # сесії, що запросили той самий звіт, стежать за одним завданням замість запуску другого.
+    def submit(self, owner: str, description: str, func, *args, metadata: dict = None, dedup_key=None, **kwargs) -> str:
+        self._cleanup()
+        with self._lock:
+            active_job = self._jobs.get(self._active_keys.get(dedup_key)) if dedup_key is not None else None
+            if active_job is not None and not active_job.is_finished:
+                print(f"[Jobs] Такий самий звіт уже формується в завданні {active_job.job_id}: {description}")
+                return active_job.job_id
+            job = ReportJob(uuid.uuid4().hex[:12], owner, description, metadata or {}, self.result_cache)
+            self._jobs[job.job_id] = job
+            if dedup_key is not None:
+                self._active_keys[dedup_key] = job.job_id
+        self._executor.submit(self._run, job, func, args, kwargs, dedup_key)
+        print(f"[Jobs] Завдання {job.job_id} поставлено в чергу: {description}")
+        return job.job_id
+
+    def _run(self, job: ReportJob, func, args: tuple, kwargs: dict, dedup_key=None):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            result = func(*args, progress_callback=job.update_progress, row_callback=job.add_row, **kwargs)
+            if self.result_cache is not None and dedup_key is not None and self.result_cache.get(dedup_key) is result:
+                job.result_key = dedup_key
+            else:
+                job._result = result
+                job.result_bytes = dataframe_bytes(result) if isinstance(result, pd.DataFrame) else 0
+            job.rows = {} # Повний результат готовий, проміжні рядки більше не потрібні
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+            print(f"[Jobs] Завдання {job.job_id} завершилося з помилкою: {e}")
+        finally:
+            job.finished_at = time.time()
+            if dedup_key is not None:
+                with self._lock:
+                    if self._active_keys.get(dedup_key) == job.job_id:
+                        del self._active_keys[dedup_key]
+            self._limit_result_bytes()
+
+    # Видаляє власні результати найстаріших завершених завдань, поки їх загальний обсяг більший
+    # за max_result_bytes (результат найновішого завдання лишається завжди; результати в кеші не рахуються)
+    def _limit_result_bytes(self):
+        with self._lock:
+            jobs = sorted((job for job in self._jobs.values() if job._result is not None), key=lambda job: job.finished_at or 0)
+            total_bytes = sum(job.result_bytes for job in jobs)
+            while total_bytes > self.max_result_bytes and len(jobs) > 1:
+                job = jobs.pop(0)
+                total_bytes -= job.result_bytes
+                job._result = None
+                job.result_bytes = 0
+                job._result_evicted = True
+                print(f"[Jobs] Результат завдання {job.job_id} видалено з пам'яті (ліміт обсягу результатів).")
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Завдання власника (наприклад, хеш API ключа), новіші першими
+    def list_jobs(self, owner: str) -> list:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    # Видаляє завершені завдання, старші за keep_finished
+    def _cleanup(self):
+        threshold = time.time() - self.keep_finished
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.is_finished and job.finished_at < threshold]
+            for job_id in expired:
+                del self._jobs[job_id]
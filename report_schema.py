@@ -0,0 +1,136 @@
+import datetime
+import math
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# Типізована схема результату звіту.
+# Числові колонки - лише float64 (відсутні значення - NaN), причини відсутності значення - в окремих
+# категоріальних колонках статусу. Текст для людей ("Скидання (...)", "Немає пробігу") формується лише
+# при відображенні та експорті (to_text_frame, label_statuses).
+
+COL_UNIT = 'Номер Автомобіля'
+COL_UNIT_ID = 'ID юніта' # номери юнітів можуть повторюватися; остання колонка звіту
+COL_DAY = 'Дата'
+COL_ODOMETER_START = 'Одометр CAN (початок)'
+COL_ODOMETER_END = 'Одометр CAN (кінець)'
+COL_DISTANCE = 'Пробіг (CAN, км)'
+COL_DISTANCE_STATUS = 'Статус пробігу'
+COL_FUEL_START = 'Паливо в баку (початок, л)'
+COL_FUEL_END = 'Паливо в баку (кінець, л)'
+COL_REFUELLED = 'Заправлено за період (л)'
+COL_DRAINED = 'Зливи за період (л)'
+COL_CONSUMED_SENSOR = 'Витрата (датчик рівня, л)'
+COL_AVG_SENSOR = 'Середня витрата (датчик рівня, л/100км)'
+COL_AVG_SENSOR_STATUS = 'Статус середньої витрати (датчик рівня)'
+COL_CONSUMED_FLOW = 'Витрата (CAN Flow, л)'
+COL_AVG_FLOW = 'Середня витрата (CAN Flow, л/100км)'
+
+# Статуси (категорії) значень
+STATUS_OK = 'ok'
+STATUS_RESET = 'reset' # одометр на кінець менший, ніж на початок
+STATUS_NO_DATA = 'no_data'
+STATUS_NO_DISTANCE = 'no_distance' # є витрата, але немає пробігу
+DISTANCE_STATUSES = (STATUS_OK, STATUS_RESET, STATUS_NO_DATA)
+AVG_STATUSES = (STATUS_OK, STATUS_NO_DISTANCE, STATUS_NO_DATA)
+
+# Підписи статусів для відображення
+STATUS_LABELS = {
+    STATUS_OK: 'Є дані',
+    STATUS_RESET: 'Скидання',
+    STATUS_NO_DATA: 'Немає даних для розрахунку',
+    STATUS_NO_DISTANCE: 'Немає пробігу',
+}
+
+
+# Рядок звіту по юніту (за період або за одну добу). Компактний: __slots__, числа - float (NaN - немає даних).
+@dataclass(slots=True)
+class UnitReportRow:
+    unit_name: str
+    odometer_start: float = math.nan
+    odometer_end: float = math.nan
+    distance: float = math.nan
+    distance_status: str = STATUS_NO_DATA
+    fuel_level_start: float = math.nan
+    fuel_level_end: float = math.nan
+    refuelled: float = math.nan
+    drained: float = math.nan
+    consumed_sensor: float = math.nan
+    avg_consumption_sensor: float = math.nan
+    avg_consumption_sensor_status: str = STATUS_NO_DATA
+    consumed_flow: float = math.nan
+    avg_consumption_flow: float = math.nan
+    day: datetime.date = None # лише для звіту з розбивкою по днях
+    unit_id: object = None
+
+
+# Колонки звіту в порядку відображення: (колонка, поле UnitReportRow, категорії статусу або None для чисел)
+REPORT_SCHEMA = (
+    (COL_ODOMETER_START, 'odometer_start', None),
+    (COL_ODOMETER_END, 'odometer_end', None),
+    (COL_DISTANCE, 'distance', None),
+    (COL_DISTANCE_STATUS, 'distance_status', DISTANCE_STATUSES),
+    (COL_FUEL_START, 'fuel_level_start', None),
+    (COL_FUEL_END, 'fuel_level_end', None),
+    (COL_REFUELLED, 'refuelled', None),
+    (COL_DRAINED, 'drained', None),
+    (COL_CONSUMED_SENSOR, 'consumed_sensor', None),
+    (COL_AVG_SENSOR, 'avg_consumption_sensor', None),
+    (COL_AVG_SENSOR_STATUS, 'avg_consumption_sensor_status', AVG_STATUSES),
+    (COL_CONSUMED_FLOW, 'consumed_flow', None),
+    (COL_AVG_FLOW, 'avg_consumption_flow', None),
+)
+REPORT_COLUMNS = [COL_UNIT] + [column for column, _, _ in REPORT_SCHEMA]
+STATUS_COLUMNS = [column for column, _, categories in REPORT_SCHEMA if categories is not None]
+
+
+# Число з відповіді API або NaN
+def to_float(value) -> float:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else math.nan
+
+
+# Колонковий DataFrame з рядків звіту: кожна колонка будується одним масивом потрібного типу
+def rows_to_dataframe(rows: list) -> pd.DataFrame:
+    if not rows:
+        return pd.DataFrame()
+    columns = {COL_UNIT: [row.unit_name for row in rows]}
+    if any(row.day is not None for row in rows):
+        columns[COL_DAY] = [row.day for row in rows]
+    for column, field, categories in REPORT_SCHEMA:
+        values = [getattr(row, field) for row in rows]
+        if categories is None:
+            columns[column] = np.array(values, dtype=np.float64)
+        else:
+            columns[column] = pd.Categorical(values, categories=categories)
+    if any(row.unit_id is not None for row in rows):
+        columns[COL_UNIT_ID] = [row.unit_id for row in rows]
+    return pd.DataFrame(columns)
+
+
+# Статуси з підписами для відображення (перейменовуються лише категорії, а не кожне значення)
+def label_statuses(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy(deep=False)
+    for column in STATUS_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].cat.rename_categories(lambda status: STATUS_LABELS.get(status, status))
+    return df
+
+
+# Текстовий вигляд звіту для експорту (як у попередніх версіях звіту): замість NaN з причиною - текст
+# у самій клітинці, колонки статусу прибираються.
+def to_text_frame(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty or COL_DISTANCE_STATUS not in df.columns:
+        return df
+    df = df.copy()
+    distance_status = df[COL_DISTANCE_STATUS]
+    distance = df[COL_DISTANCE].astype(object)
+    reset = distance_status == STATUS_RESET
+    delta = (df[COL_ODOMETER_END] - df[COL_ODOMETER_START]).round(2)
+    distance[reset] = [f"Скидання ({value} км)" for value in delta[reset]]
+    distance[distance_status == STATUS_NO_DATA] = STATUS_LABELS[STATUS_NO_DATA]
+    df[COL_DISTANCE] = distance
+
+    avg_sensor = df[COL_AVG_SENSOR].astype(object)
+    avg_sensor[df[COL_AVG_SENSOR_STATUS] == STATUS_NO_DISTANCE] = STATUS_LABELS[STATUS_NO_DISTANCE]
+    df[COL_AVG_SENSOR] = avg_sensor
+    return df.drop(columns=STATUS_COLUMNS)
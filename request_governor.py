@@ -0,0 +1,307 @@
+import asyncio
+import contextlib
+import random
+from collections import deque
+import threading
+import time
+import email.utils
+import requests
+
+from mapon_cache import account_hash
+
+# Ліміти за замовчуванням на один API ключ: запитів за секунду, розмір "сплеску" і максимум одночасних запитів
+DEFAULT_RATE_PER_SECOND = 20.0
+DEFAULT_BURST = 40
+DEFAULT_MAX_CONCURRENCY = 32
+# Повтори одного запиту та бюджет повторів на один звіт (клієнт)
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BUDGET = 500
+# Експоненційна затримка між повторами: база і стеля, секунди
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# HTTP статуси, які варто повторити (перевантаження або тимчасова помилка сервера)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Статуси, що означають перевантаження API - при них зменшуємо паралельність
+OVERLOAD_STATUSES = (429, 503)
+
+
+# Відро токенів: не більше rate запитів за секунду в середньому, зі сплеском до burst
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Забирає токен, якщо він є (повертає 0), інакше - скільки секунд чекати до наступної спроби
+    def try_acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return max(self._paused_until - now, (1 - self._tokens) / self.rate)
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    # Те саме для event loop: очікування не блокує loop
+    async def acquire_async(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    # Пауза для всіх потоків (наприклад, за заголовком Retry-After)
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Адаптивна межа одночасних запитів (AIMD): +1 після кожних `limit` успішних запитів,
+# удвічі менше при ознаках перевантаження API
+class AdaptiveConcurrencyLimit:
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+        self._async_waiters = deque() # (loop, Future) корутин, що чекають на місце
+
+    def __enter__(self):
+        with self._condition:
+            while self._in_flight >= max(self.min_limit, int(self.limit)):
+                self._condition.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+            self._wake_async_waiters(1)
+
+    # Місце в межі для корутини: межа та лічильник спільні з потоками. Корутина без місця чекає на
+    # Future, який будить звільнення місця чи збільшення межі (з будь-якого потоку чи loop), - loop не блокується.
+    @contextlib.asynccontextmanager
+    async def slot_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._in_flight < max(self.min_limit, int(self.limit)):
+                    self._in_flight += 1
+                    break
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._condition:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+                    else:
+                        self._wake_async_waiters(1) # пробудження дісталося скасованій корутині - передаємо далі
+                raise
+        try:
+            yield self
+        finally:
+            self.__exit__(None, None, None)
+
+    # Будить до count корутин, що чекають на місце (викликається під self._condition)
+    def _wake_async_waiters(self, count: int = None):
+        while self._async_waiters and (count is None or count > 0):
+            loop, waiter = self._async_waiters.popleft()
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(_resolve_waiter, waiter)
+            if count is not None:
+                count -= 1
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self._successes = 0
+                self.limit = min(self.max_limit, self.limit + 1)
+                self._condition.notify_all()
+                self._wake_async_waiters()
+
+    def on_overload(self):
+        with self._condition:
+            self._successes = 0
+            self.limit = max(self.min_limit, self.limit / 2)
+
+
+def _resolve_waiter(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# Бюджет помилок одного звіту: скільки повторів можна витратити і скільки запитів остаточно не вдалося.
+# Коли бюджет вичерпано, запити більше не повторюються, щоб звіт не "висів" на недоступному API.
+# unit_failures - невдалі запити за юнітами (для рішення, чи можна зберегти дані окремого юніта).
+class ErrorBudget:
+    def __init__(self, max_retries: int = DEFAULT_RETRY_BUDGET):
+        self.max_retries = max_retries
+        self.retries = 0
+        self.failures = 0
+        self.unit_failures = {} # unit_id -> кількість невдалих запитів
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.retries >= self.max_retries:
+                return False
+            self.retries += 1
+            return True
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    # Запит даних юніта остаточно не вдався (викликається там, де помилку перехоплено і дані юніта - None)
+    def record_unit_failure(self, unit_id):
+        with self._lock:
+            self.unit_failures[unit_id] = self.unit_failures.get(unit_id, 0) + 1
+
+    # Лічильники невдач переданих юнітів на цей момент: {unit_id: кількість}
+    def unit_failure_counts(self, unit_ids: list) -> dict:
+        with self._lock:
+            return {unit_id: self.unit_failures.get(unit_id, 0) for unit_id in unit_ids}
+
+    @property
+    def exhausted(self) -> bool:
+        return self.retries >= self.max_retries
+
+
+# Затримка з заголовка Retry-After (секунди або HTTP-дата), або None
+def parse_retry_after(response) -> float:
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Експоненційна затримка з повним джитером: випадкова в [0, min(cap, base * 2^attempt)]
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+# Центральний регулятор запитів одного API ключа: відро токенів, адаптивна паралельність,
+# повтори 429/5xx і мережевих помилок з урахуванням Retry-After та експоненційною затримкою.
+# Синхронний (execute) і асинхронний (execute_async) клієнти одного ключа ділять ті самі ліміти.
+class RequestGovernor:
+    def __init__(self, rate: float = DEFAULT_RATE_PER_SECOND, burst: int = DEFAULT_BURST, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrencyLimit(max_concurrency)
+        self.max_attempts = max_attempts
+
+    # Виконує send() (функцію, що робить HTTP запит і повертає Response) з повторами.
+    # Повертає успішну відповідь або викликає requests.exceptions.RequestException.
+    def execute(self, send, budget: ErrorBudget, description: str = '') -> requests.Response:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            response = None
+            error = None
+            with self.concurrency:
+                try:
+                    response = send()
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+
+            attempt += 1
+            delay = self.retry_delay(response, error, attempt, budget, description)
+            if delay is None:
+                return self._final(response, error)
+            time.sleep(delay)
+
+    # Те саме для event loop: send - корутина, що повертає requests.Response (або викликає
+    # requests.exceptions.ConnectionError / Timeout); очікування токена, місця в межі паралельності
+    # та затримки між повторами не блокують loop.
+    async def execute_async(self, send, budget: ErrorBudget, description: str = '') -> requests.Response:
+        attempt = 0
+        while True:
+            await self.bucket.acquire_async()
+            response = None
+            error = None
+            async with self.concurrency.slot_async():
+                try:
+                    response = await send()
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+
+            attempt += 1
+            delay = self.retry_delay(response, error, attempt, budget, description)
+            if delay is None:
+                return self._final(response, error)
+            await asyncio.sleep(delay)
+
+    # Реакція на результат спроби номер attempt: сигнали для адаптивної паралельності, облік невдач у budget.
+    # Повертає затримку перед повтором або None, якщо відповідь остаточна (успіх або помилка без повтору).
+    def retry_delay(self, response, error, attempt: int, budget: ErrorBudget, description: str = ''):
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            if response.status_code >= 400:
+                # Інші 4xx (401, 404...) не повторюємо і не вважаємо ознакою здорового API
+                budget.record_failure()
+            else:
+                self.concurrency.on_success()
+            return None
+
+        if response is not None and response.status_code in OVERLOAD_STATUSES:
+            self.concurrency.on_overload()
+
+        if attempt >= self.max_attempts or not budget.try_spend():
+            budget.record_failure()
+            return None
+
+        retry_after = parse_retry_after(response)
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        if retry_after is not None:
+            self.bucket.pause(retry_after)
+        reason = f"HTTP {response.status_code}" if response is not None else type(error).__name__
+        print(f"[Governor] {description}: {reason}, повтор {attempt} через {delay:.1f} с (межа паралельності {int(self.concurrency.limit)}).")
+        return delay
+
+    # Остаточний результат: відповідь або виняток (HTTP помилка чи мережева)
+    @staticmethod
+    def _final(response, error) -> requests.Response:
+        if response is None:
+            raise error
+        response.raise_for_status()
+        return response
+
+
+# Регулятори за API ключем: усі клієнти (звіти) одного ключа в процесі ділять ліміти
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_request_governor(api_key: str, **kwargs) -> RequestGovernor:
+    key = account_hash(api_key)
+    with _governors_lock:
+        if key not in _governors:
+            _governors[key] = RequestGovernor(**kwargs)
+        return _governors[key]
@@ -0,0 +1,66 @@
+import threading
+import time
+
+# Скільки живе закешований список юнітів / груп акаунта, секунди
+DEFAULT_UNIT_LIST_TTL = 10 * 60
+
+
+# Кеш довідників акаунта (список юнітів, групи та їх склад) у пам'яті процесу з TTL.
+# Ключ - кортеж, наприклад (акаунт, 'units') або (акаунт, 'group', group_id).
+# Список юнітів змінюється рідко, тож кожен звіт і кожне перемальовування бокової панелі
+# не повинні запитувати unit/list.json заново.
+class UnitDirectoryCache:
+    def __init__(self, ttl: float = DEFAULT_UNIT_LIST_TTL):
+        self.ttl = ttl
+        self._entries = {} # ключ -> (значення, expires_at)
+        self._loading = {} # ключ -> Lock для завантаження
+        self._lock = threading.Lock()
+
+    # Значення з кешу або None (немає або застаріло)
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                return None
+            return entry[0]
+
+    # Значення з кешу або завантажене через loader(). Порожні результати не кешуються
+    # (вони зазвичай означають помилку запиту).
+    def get_or_load(self, key: tuple, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self.get(key)
+            if value is not None:
+                return value
+            try:
+                value = loader()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    # Збереження значення (порожні результати не кешуються)
+    def put(self, key: tuple, value):
+        if value:
+            with self._lock:
+                self._entries[key] = (value, time.time() + self.ttl)
+
+    # Примусове оновлення довідників акаунта (наприклад, кнопкою в інтерфейсі)
+    def invalidate(self, account: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == account]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Спільний кеш процесу
+DEFAULT_UNIT_DIRECTORY_CACHE = UnitDirectoryCache()